@@ -13,25 +13,18 @@ def add_activity_log(user_id, action_type, action_description, related_order_id=
     Returns:
         log_id: ID записи в логе или None в случае ошибки
     """
-    from database import is_postgres, get_placeholder
+    from database import get_backend
     
     cursor = conn.cursor()
-    
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
     
     try:
-        cursor.execute(
-            f"INSERT INTO activity_logs (user_id, action_type, action_description, related_order_id, related_user_id) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})",
-            (user_id, action_type, action_description, related_order_id, related_user_id)
+        log_id = backend.insert_returning_id(
+            cursor,
+            f"INSERT INTO activity_logs (user_id, action_type, action_description, related_order_id, related_user_id) VALUES ({backend.placeholders(5)})",
+            (user_id, action_type, action_description, related_order_id, related_user_id),
+            'log_id'
         )
-        
-        # Для PostgreSQL и SQLite получение ID последней вставленной записи отличается
-        if is_postgres():
-            cursor.execute("SELECT lastval()")
-            log_id = cursor.fetchone()[0]
-        else:
-            log_id = cursor.lastrowid
             
         return log_id
     except Exception as e:
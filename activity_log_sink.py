@@ -0,0 +1,293 @@
+"""
+Буферизованная запись логов активности
+
+add_activity_log не обращается к базе данных: запись добавляется в буфер в памяти,
+а фоновый поток записывает накопленные записи одной транзакцией (многострочный
+INSERT) - когда в буфере набирается пачка или истекает интервал сброса. Поэтому
+действия пользователей не ждут отдельного соединения и commit ради строки лога.
+Время записи фиксируется при добавлении в буфер, а не при записи в БД.
+
+Выборки логов (get_activity_logs, get_activity_logs_page и т.д.) перед чтением вызывают
+flush_activity_logs, поэтому показывают и записи, еще не записанные по интервалу.
+Выборки выполняются в обработчиках бота, поэтому сброс ждет записи не дольше
+ACTIVITY_LOG_READ_FLUSH_TIMEOUT секунд: если БД медленная, выборка выполняется без
+ожидания, и в ней может не оказаться последних записей.
+
+Буфер ограничен: при переполнении новая запись отбрасывается (политика drop) или
+добавляющий поток ждет освобождения места не дольше ACTIVITY_LOG_BLOCK_TIMEOUT
+секунд (политика block). При завершении процесса оставшиеся записи сбрасываются в БД,
+а записи, добавленные после начала остановки, записываются сразу в добавляющем потоке.
+
+Настройки из переменных окружения:
+    ACTIVITY_LOG_BATCH_SIZE      - записей в одной пачке (по умолчанию 200)
+    ACTIVITY_LOG_FLUSH_INTERVAL  - максимум секунд до записи в БД (по умолчанию 1)
+    ACTIVITY_LOG_QUEUE_SIZE      - максимум записей в буфере (по умолчанию 10000)
+    ACTIVITY_LOG_OVERFLOW        - политика переполнения: drop или block (по умолчанию drop)
+    ACTIVITY_LOG_BLOCK_TIMEOUT   - ожидание места в буфере для block, сек (по умолчанию 1)
+    ACTIVITY_LOG_READ_FLUSH_TIMEOUT - ожидание сброса перед выборкой логов, сек (по умолчанию 0.5)
+"""
+
+import os
+import time
+import atexit
+import datetime
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('activity_log_sink')
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+
+# Сколько раз пачка записывается повторно после ошибки БД, прежде чем будет отброшена
+_MAX_WRITE_ATTEMPTS = 3
+
+# Сколько выборка логов ждет записи буфера (выборки выполняются в обработчиках бота)
+READ_FLUSH_TIMEOUT = float(os.environ.get('ACTIVITY_LOG_READ_FLUSH_TIMEOUT', 0.5))
+
+
+class ActivityLogEntry(NamedTuple):
+    """Запись лога активности, ожидающая записи в БД"""
+    user_id: Optional[int]
+    action_type: str
+    action_description: str
+    related_order_id: Optional[int]
+    related_user_id: Optional[int]
+    created_at: datetime.datetime  # Время действия (UTC)
+
+
+class ActivityLogSink:
+    """
+    Буфер логов активности с фоновой записью пачками.
+    writer(entries) записывает список ActivityLogEntry одной транзакцией.
+    """
+
+    def __init__(self, writer: Callable[[List[ActivityLogEntry]], None], batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None, max_size: Optional[int] = None,
+                 overflow: Optional[str] = None, block_timeout: Optional[float] = None):
+        self.writer = writer
+        self.batch_size = batch_size or int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 200))
+        self.flush_interval = flush_interval or float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', 1))
+        self.max_size = max_size or int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+        self.overflow = overflow or os.environ.get('ACTIVITY_LOG_OVERFLOW', OVERFLOW_DROP)
+        self.block_timeout = block_timeout or float(os.environ.get('ACTIVITY_LOG_BLOCK_TIMEOUT', 1))
+        if self.overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError(f"Неизвестная политика переполнения буфера логов: {self.overflow}")
+
+        self._buffer: Deque[ActivityLogEntry] = deque()
+        self._first_added: Optional[float] = None  # Когда в пустой буфер добавлена первая запись
+        self._writing = 0                          # Записей, которые сейчас пишутся в БД
+        self._flush_requested = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._stopping = False
+
+        # Счетчики
+        self.added = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+    def start(self) -> None:
+        """Запускает поток записи"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._stopping = False
+            thread = self._thread = threading.Thread(target=self._run, name='activity-log-sink', daemon=True)
+        thread.start()
+        logger.info(f"Запущена буферизованная запись логов активности: пачка {self.batch_size}, "
+                    f"интервал {self.flush_interval} сек, буфер {self.max_size}, политика {self.overflow}")
+
+    def add(self, user_id: Optional[int], action_type: str, action_description: str,
+            related_order_id: Optional[int] = None, related_user_id: Optional[int] = None) -> bool:
+        """
+        Добавляет запись в буфер и сразу возвращает управление. После начала остановки
+        поток записи может уже завершиться, поэтому запись пишется в БД сразу
+
+        Returns:
+            bool: True, если запись принята, False если буфер переполнен или запись
+            после начала остановки не удалась
+        """
+        entry = ActivityLogEntry(user_id, action_type, action_description, related_order_id, related_user_id,
+                                 datetime.datetime.now(datetime.timezone.utc))
+        with self._lock:
+            if len(self._buffer) >= self.max_size and self.overflow == OVERFLOW_BLOCK and not self._stopping:
+                self._space.wait_for(lambda: len(self._buffer) < self.max_size or self._stopping,
+                                     self.block_timeout)
+            stopping = self._stopping
+            if stopping:
+                self.added += 1
+        if stopping:
+            return self._write_now(entry)
+        with self._lock:
+            if len(self._buffer) >= self.max_size:
+                self.dropped += 1
+                # Предупреждение не на каждую запись, чтобы не засорять лог при длительной перегрузке
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"Буфер логов активности заполнен, отброшено записей: {self.dropped}")
+                return False
+            if not self._buffer:
+                self._first_added = time.monotonic()
+            self._buffer.append(entry)
+            self.added += 1
+            # Поток записи просыпается, чтобы начать отсчет интервала или записать полную пачку
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._changed.notify()
+        return True
+
+    def _write_now(self, entry: ActivityLogEntry) -> bool:
+        """Записывает одну запись в добавляющем потоке (после начала остановки)"""
+        try:
+            self.writer([entry])
+        except Exception as e:
+            with self._lock:
+                self.write_errors += 1
+                self.dropped += 1
+            logger.error(f"Ошибка при записи лога активности во время остановки: {e}")
+            return False
+        with self._lock:
+            self.written += 1
+            self.batches += 1
+        return True
+
+    def _take_batch(self) -> List[ActivityLogEntry]:
+        """Забирает из буфера следующую пачку (вызывается под блокировкой)"""
+        count = min(self.batch_size, len(self._buffer))
+        batch = [self._buffer.popleft() for _ in range(count)]
+        self._first_added = time.monotonic() if self._buffer else None
+        self._writing = len(batch)
+        self._space.notify_all()
+        return batch
+
+    def _ready(self, now: float) -> bool:
+        if not self._buffer:
+            return False
+        return (self._stopping or self._flush_requested or len(self._buffer) >= self.batch_size
+                or now - self._first_added >= self.flush_interval)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if self._ready(now):
+                        break
+                    if not self._buffer:
+                        self._flush_requested = False
+                        self._idle.notify_all()
+                        if self._stopping:
+                            return
+                        self._changed.wait()
+                    else:
+                        self._changed.wait(self.flush_interval - (now - self._first_added))
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _write(self, batch: List[ActivityLogEntry]) -> None:
+        """Записывает пачку, повторяя при ошибке БД"""
+        for attempt in range(1, _MAX_WRITE_ATTEMPTS + 1):
+            try:
+                self.writer(batch)
+                with self._lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                    self._writing = 0
+                return
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                logger.error(f"Ошибка при записи {len(batch)} логов активности (попытка {attempt}): {e}")
+                if attempt < _MAX_WRITE_ATTEMPTS:
+                    time.sleep(min(self.flush_interval * attempt, 5.0))
+        with self._lock:
+            self.dropped += len(batch)
+            self._writing = 0
+        logger.error(f"Отброшено логов активности после {_MAX_WRITE_ATTEMPTS} попыток записи: {len(batch)}")
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        Записывает все накопленные записи, не дожидаясь интервала сброса
+
+        Returns:
+            bool: True, если буфер записан, False если истекло время ожидания
+        """
+        with self._lock:
+            if not self._running:
+                return not self._buffer
+            self._flush_requested = True
+            self._changed.notify()
+            return self._idle.wait_for(lambda: not self._buffer and not self._writing, timeout)
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Записывает оставшиеся записи и останавливает поток"""
+        with self._lock:
+            if not self._running or self._stopping:
+                return
+            self._stopping = True
+            thread = self._thread
+            self._changed.notify()
+            self._space.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._lock:
+            if thread is not None and thread.is_alive():
+                logger.warning(f"При остановке не записано логов активности: {len(self._buffer)}")
+            self._running = False
+            self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает размер буфера и счетчики записи"""
+        with self._lock:
+            return {
+                'buffered': len(self._buffer),
+                'writing': self._writing,
+                'added': self.added,
+                'written': self.written,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'write_errors': self.write_errors
+            }
+
+
+_sink: Optional[ActivityLogSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_activity_log_sink() -> ActivityLogSink:
+    """Возвращает буфер логов активности, создавая и запуская его при первом обращении"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                from database import insert_activity_logs
+                sink = ActivityLogSink(insert_activity_logs)
+                sink.start()
+                atexit.register(sink.stop)
+                _sink = sink
+    return _sink
+
+
+def flush_activity_logs(timeout: Optional[float] = None) -> bool:
+    """
+    Записывает накопленные логи активности перед их чтением из БД.
+    Если буфер еще не создан (в процессе не добавлялось записей), ничего не делает.
+    Вызывается из обработчиков бота, поэтому ждет не дольше timeout
+    (по умолчанию READ_FLUSH_TIMEOUT)
+
+    Returns:
+        bool: True, если буфер записан, False если истекло время ожидания
+    """
+    sink = _sink
+    if sink is None:
+        return True
+    return sink.flush(READ_FLUSH_TIMEOUT if timeout is None else timeout)
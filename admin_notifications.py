@@ -210,25 +210,11 @@ def get_admin_user_ids() -> List[int]:
     """
     try:
         # Импортируем необходимые функции
-        from database import get_all_users
+        from database import get_users_by_role
         from config import ROLES
         
-        users = get_all_users()
-        admin_ids = []
-        
-        # Проверяем каждого пользователя
-        if users:
-            for user in users:
-                try:
-                    from database import get_user_role
-                    
-                    user_id = user.get('user_id') or user.get('id')
-                    if user_id and get_user_role(user_id) == ROLES['admin']:
-                        admin_ids.append(user_id)
-                except Exception as e:
-                    error_logger.error(f"Ошибка при проверке роли пользователя: {e}")
-        
-        return admin_ids
+        # Один запрос по индексу роли вместо проверки роли каждого пользователя
+        return [user['user_id'] for user in get_users_by_role(ROLES['admin'])]
     except Exception as e:
         error_logger.error(f"Ошибка при получении списка администраторов: {e}")
         # Возвращаем пустой список в случае ошибки
@@ -252,7 +238,7 @@ def notify_admins_about_error(message: str,
         force: Принудительно отправить, игнорируя тротлинг
         
     Returns:
-        bool: True, если уведомление отправлено хотя бы одному администратору
+        bool: True, если уведомление поставлено в очередь хотя бы для одного администратора
     """
     # Получаем информацию о стеке вызовов, если есть исключение
     traceback_info = None
@@ -291,18 +277,19 @@ def notify_admins_about_error(message: str,
     # Форматируем сообщение для Telegram
     telegram_message = notification.format_message_for_telegram()
     
-    # Отправляем сообщение каждому администратору
+    # Ставим сообщения администраторам в очередь отправки: повторы при 429 и
+    # ограничение скорости выполняет очередь, вызывающий код не ждет Telegram
     success = False
     try:
         from shared_state import bot
+        from outbound_queue import enqueue_message, PRIORITY_BROADCAST
         
         for admin_id in admin_ids:
-            try:
-                bot.send_message(admin_id, telegram_message, parse_mode="Markdown")
-                admin_logger.info(f"Уведомление об ошибке отправлено администратору {admin_id}")
+            if enqueue_message(bot, admin_id, telegram_message, PRIORITY_BROADCAST, parse_mode="Markdown"):
+                admin_logger.info(f"Уведомление об ошибке поставлено в очередь для администратора {admin_id}")
                 success = True
-            except Exception as e:
-                error_logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+            else:
+                error_logger.error(f"Не удалось поставить уведомление в очередь для администратора {admin_id}")
     except Exception as e:
         error_logger.error(f"Ошибка при отправке уведомлений: {e}")
     
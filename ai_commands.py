@@ -5,10 +5,12 @@
 import json
 from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
-from shared_state import clear_user_state, set_user_state, get_user_state, get_current_order_id, bot
+from typing import Optional
+from shared_state import clear_user_state, set_user_state, get_user_state, get_current_order_id, get_user_state_snapshot, bot
 from database import get_user_role, get_order, get_activity_logs, update_order, add_activity_log
 from logger import get_component_logger
 from ui_constants import EMOJI, format_success_message, format_error_message
+import callback_codec
 from ai_assistant import (
     analyze_problem_description, 
     suggest_service_cost, 
@@ -39,6 +41,26 @@ def register_ai_commands(bot_instance):
     # Ничего не делаем здесь, так как обработчики уже оформлены как декораторы ниже
     pass
 
+def register_ai_callback_routes(router):
+    """
+    Регистрирует маршруты callback-запросов ИИ функций в CallbackRouter
+    """
+    router.add_route("ai_analyze_problem",
+                     lambda ctx: handle_ai_analyze_problem_callback(ctx.user_id, ctx.message_id))
+    router.add_route("ai_suggest_cost",
+                     lambda ctx: handle_ai_suggest_cost_callback(ctx.user_id, ctx.message_id))
+    router.add_route("ai_generate_description",
+                     lambda ctx: handle_ai_generate_description_callback(ctx.user_id, ctx.message_id))
+    router.add_route("ai_technician_help",
+                     lambda ctx: handle_ai_technician_help_callback(ctx.user_id, ctx.message_id))
+    router.add_route("ai_order_help_{order_id:int}",
+                     lambda ctx, order_id: handle_ai_order_help_callback(ctx.user_id, ctx.message_id, order_id))
+    router.add_route("set_cost_{order_id:int}_{cost:float}",
+                     lambda ctx, order_id, cost: handle_set_cost_callback(ctx.user_id, ctx.message_id, order_id, cost),
+                     action="set_cost")
+    router.add_route("set_description_{order_id:int}",
+                     lambda ctx, order_id: handle_set_description_callback(ctx.user_id, ctx.message_id, order_id))
+
 # Регистрируем команды через декораторы
 @bot.message_handler(commands=['analyze_problem'])
 def handle_analyze_problem_command(message: Message):
@@ -336,9 +358,10 @@ def handle_problem_analysis_input(user_id: int, text: str):
         # Очищаем состояние пользователя
         clear_user_state(user_id)
 
-def handle_cost_suggestion_input(user_id: int, text: str):
+def handle_cost_suggestion_input(user_id: int, text: str, order_id: Optional[int] = None):
     """
     Обрабатывает ввод для предложения стоимости услуг
+    (order_id - ID текущего заказа, если уже известен вызывающему коду)
     """
     try:
         # Разбираем ввод пользователя
@@ -381,14 +404,22 @@ def handle_cost_suggestion_input(user_id: int, text: str):
         bot.send_message(user_id, message, parse_mode="Markdown")
         
         # Если пользователь работает с заказом, предлагаем обновить стоимость
-        order_id = get_current_order_id(user_id)
+        if order_id is None:
+            order_id = get_current_order_id(user_id)
         if order_id:
+            try:
+                set_cost_data = callback_codec.encode('set_cost', order_id=order_id, cost=rec_cost)
+            except callback_codec.CallbackDataError as e:
+                # ИИ вернул стоимость, которую нельзя установить (например, не число)
+                logger.warning(f"Не удалось сформировать кнопку установки стоимости {rec_cost!r}: {e}")
+                return
+            
             # Создаем клавиатуру для обновления стоимости
             keyboard = InlineKeyboardMarkup()
             keyboard.add(
                 InlineKeyboardButton(
                     f"Установить стоимость {rec_cost} руб.", 
-                    callback_data=f"set_cost_{order_id}_{rec_cost}"
+                    callback_data=set_cost_data
                 )
             )
             
@@ -409,9 +440,10 @@ def handle_cost_suggestion_input(user_id: int, text: str):
         # Очищаем состояние пользователя
         clear_user_state(user_id)
 
-def handle_description_generation_input(user_id: int, text: str):
+def handle_description_generation_input(user_id: int, text: str, order_id: Optional[int] = None):
     """
     Обрабатывает ввод для генерации описания выполненных работ
+    (order_id - ID текущего заказа, если уже известен вызывающему коду)
     """
     try:
         # Разбираем ввод пользователя
@@ -447,7 +479,8 @@ def handle_description_generation_input(user_id: int, text: str):
         bot.send_message(user_id, message, parse_mode="Markdown")
         
         # Если пользователь работает с заказом, предлагаем обновить описание
-        order_id = get_current_order_id(user_id)
+        if order_id is None:
+            order_id = get_current_order_id(user_id)
         if order_id:
             # Создаем клавиатуру для обновления описания
             keyboard = InlineKeyboardMarkup()
@@ -550,13 +583,15 @@ def handle_technician_question_input(user_id: int, text: str):
         # Очищаем состояние пользователя
         clear_user_state(user_id)
 
-def handle_customer_question_input(user_id: int, text: str):
+def handle_customer_question_input(user_id: int, text: str, order_id: Optional[int] = None):
     """
     Обрабатывает ввод вопроса клиента для генерации ответа
+    (order_id - ID текущего заказа, если уже известен вызывающему коду)
     """
     try:
         # Получаем ID текущего заказа
-        order_id = get_current_order_id(user_id)
+        if order_id is None:
+            order_id = get_current_order_id(user_id)
         if not order_id:
             bot.send_message(
                 user_id,
@@ -906,10 +941,18 @@ def handle_set_description_callback(user_id: int, message_id: int, order_id: int
             parse_mode="Markdown"
         )
 
+# Маркер "состояние не передано", чтобы отличать его от отсутствующего состояния (None)
+_SNAPSHOT_NOT_LOADED = object()
+
 # Обработчик всех текстовых сообщений для ИИ функций
-def handle_ai_message_input(message: Message):
+def handle_ai_message_input(message: Message, snapshot=_SNAPSHOT_NOT_LOADED):
     """
     Обрабатывает текстовые сообщения для ИИ функций
+    
+    Args:
+        message: Сообщение пользователя
+        snapshot: Уже прочитанное состояние пользователя (UserStateSnapshot или None);
+                  если не передано, читается из хранилища состояний
     """
     user_id = message.from_user.id
     text = message.text
@@ -919,8 +962,13 @@ def handle_ai_message_input(message: Message):
         handle_cancel_command(message)
         return True  # Сообщение обработано
     
-    # Получаем текущее состояние пользователя
-    state = get_user_state(user_id)
+    # Получаем текущее состояние пользователя одним обращением
+    if snapshot is _SNAPSHOT_NOT_LOADED:
+        snapshot = get_user_state_snapshot(user_id)
+    if snapshot is None:
+        return False  # Сообщение не обработано (не связано с ИИ функциями)
+    state = snapshot.state
+    order_id = snapshot.order_id
     
     # Проверяем, находится ли пользователь в одном из ИИ состояний
     if state == AI_STATES['waiting_for_problem_analysis']:
@@ -928,11 +976,11 @@ def handle_ai_message_input(message: Message):
         return True  # Сообщение обработано
     
     elif state == AI_STATES['waiting_for_cost_suggestion']:
-        handle_cost_suggestion_input(user_id, text)
+        handle_cost_suggestion_input(user_id, text, order_id)
         return True  # Сообщение обработано
     
     elif state == AI_STATES['waiting_for_description_generation']:
-        handle_description_generation_input(user_id, text)
+        handle_description_generation_input(user_id, text, order_id)
         return True  # Сообщение обработано
     
     elif state == AI_STATES['waiting_for_technician_question']:
@@ -940,7 +988,7 @@ def handle_ai_message_input(message: Message):
         return True  # Сообщение обработано
     
     elif state == AI_STATES['waiting_for_customer_question']:
-        handle_customer_question_input(user_id, text)
+        handle_customer_question_input(user_id, text, order_id)
         return True  # Сообщение обработано
     
     # Сообщение не обработано (не связано с ИИ функциями)
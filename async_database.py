@@ -0,0 +1,70 @@
+"""
+Асинхронный доступ к функциям database.py
+
+Каждая функция database.py доступна как корутина с тем же именем и аргументами:
+    order = await async_database.get_order(order_id)
+
+Вызовы выполняются в отдельном пуле потоков, размер которого равен размеру пула
+соединений (DB_POOL_MAX_SIZE), поэтому ожидание базы данных не блокирует цикл событий,
+а число одновременных запросов не превышает число соединений.
+"""
+
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import database
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('async_database')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_wrappers: Dict[str, Callable] = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-db')
+    return _executor
+
+
+async def run_db(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Выполняет синхронную функцию работы с БД в пуле потоков базы данных"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def _wrap(name: str, func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+def __getattr__(name: str) -> Callable:
+    """Возвращает асинхронную обертку функции database.<name>"""
+    wrapper = _wrappers.get(name)
+    if wrapper is not None:
+        return wrapper
+    func = getattr(database, name, None)
+    if name.startswith('_') or not callable(func):
+        raise AttributeError(f"module 'async_database' has no attribute '{name}'")
+    wrapper = _wrappers[name] = _wrap(name, func)
+    return wrapper
+
+
+def shutdown() -> None:
+    """Дожидается завершения запросов и останавливает пул потоков"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
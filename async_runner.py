@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Асинхронный запуск бота на цикле событий asyncio
+
+Обновления получаются асинхронным клиентом Telegram (AsyncTeleBot из pyTelegramBotAPI,
+требует aiohttp), поэтому ожидание long polling не занимает потоков. Полученные обновления
+передаются в тот же UpdateDispatcher, что и при синхронном запуске: обработчики бота
+из working_bot вызываются в ограниченном пуле потоков (BOT_WORKERS), обновления одного
+чата обрабатываются строго по порядку, разных чатов - параллельно. Число обновлений
+в обработке ограничено (BOT_UPDATE_QUEUE_SIZE): при достижении предела получение новых
+обновлений приостанавливается. Если aiohttp не установлен, обновления
+получаются синхронным клиентом в отдельном потоке.
+
+Для собственного асинхронного кода доступ к базе данных - через async_database.
+
+Запуск:
+    python async_runner.py
+"""
+
+import asyncio
+import functools
+from typing import Any, Dict, Optional
+from logger import get_component_logger
+from update_dispatcher import UpdateDispatcher, create_bot_dispatcher
+import async_database
+
+try:
+    from telebot.async_telebot import AsyncTeleBot
+except ImportError:  # Для AsyncTeleBot нужен aiohttp
+    AsyncTeleBot = None
+
+# Настройка логирования
+logger = get_component_logger('async_runner')
+
+
+class AsyncUpdateRunner:
+    """
+    Асинхронное получение обновлений с обработкой в UpdateDispatcher: порядок внутри
+    чата, пул потоков и ограничение числа обновлений в обработке - те же, что при
+    синхронном запуске (run_polling)
+    """
+
+    def __init__(self, bot, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 timeout: int = 20, allowed_updates=None,
+                 dispatcher: Optional[UpdateDispatcher] = None):
+        self.bot = bot
+        # Обработчики вызываются из потоков диспетчера, собственный пул telebot отключается
+        self.dispatcher = dispatcher or create_bot_dispatcher(bot, workers, max_pending)
+        self.timeout = timeout
+        self.allowed_updates = allowed_updates
+        self._client = None
+
+    async def submit(self, update) -> None:
+        """
+        Ставит обновление в очередь диспетчера. Если очередь заполнена, ожидание места
+        идет в потоке, а цикл событий продолжает работу
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.dispatcher.submit, update)
+
+    async def _get_updates(self, offset: Optional[int]):
+        if self._client is not None:
+            return await self._client.get_updates(
+                offset=offset, timeout=self.timeout, allowed_updates=self.allowed_updates,
+                request_timeout=self.timeout + 10
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.bot.get_updates, offset=offset, timeout=self.timeout + 10,
+            allowed_updates=self.allowed_updates, long_polling_timeout=self.timeout
+        ))
+
+    async def run(self, stop_event: Optional[asyncio.Event] = None) -> None:
+        """Получает и обрабатывает обновления до установки stop_event или отмены задачи"""
+        stop_event = stop_event or asyncio.Event()
+        if AsyncTeleBot is not None:
+            self._client = AsyncTeleBot(self.bot.token)
+        else:
+            logger.warning("AsyncTeleBot недоступен (нет aiohttp), обновления получаются синхронным клиентом")
+
+        self.dispatcher.start()
+        offset = None
+        error_delay = 1
+        try:
+            while not stop_event.is_set():
+                try:
+                    updates = await self._get_updates(offset)
+                    error_delay = 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка при получении обновлений: {e}. Повтор через {error_delay} сек")
+                    await asyncio.sleep(error_delay)
+                    error_delay = min(error_delay * 2, 30)
+                    continue
+
+                for update in updates:
+                    # Подтверждаем обновление, только когда оно принято в очередь
+                    await self.submit(update)
+                    offset = update.update_id + 1
+        finally:
+            if self._client is not None:
+                await self._client.close_session()
+            # Остановка ждет обработки принятых обновлений, поэтому выполняется в потоке
+            await asyncio.get_running_loop().run_in_executor(None, self.dispatcher.stop)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает размер очереди и счетчики обработки диспетчера"""
+        return self.dispatcher.get_stats()
+
+
+async def main_async() -> None:
+    """Проверяет базу данных и запускает асинхронную обработку обновлений"""
+    if not await async_database.check_database_connection():
+        logger.error("Нет подключения к базе данных, бот не будет запущен")
+        return
+    # Импорт регистрирует обработчики команд на общем экземпляре бота
+    from working_bot import bot
+    await AsyncUpdateRunner(bot).run()
+
+
+def main() -> None:
+    try:
+        asyncio.run(main_async())
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен")
+    finally:
+        async_database.shutdown()
+
+
+if __name__ == '__main__':
+    main()
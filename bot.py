@@ -4,6 +4,7 @@ Telegram бот для управления заказами сервиса ре
 
 import os
 import re
+import datetime
 from typing import Optional, Dict, List
 
 import telebot
@@ -11,31 +12,45 @@ from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 
 from config import ROLES, ORDER_STATUSES
 from database import (
-    save_user, get_user, get_all_users, get_user_role, is_user_approved,
+    save_user, get_user, get_all_users, get_users_by_role, get_user_role, is_user_approved,
     get_unapproved_users, approve_user, reject_user, update_user_role,
-    save_order, update_order, get_order, get_orders_by_user, get_all_orders,
+    save_order, update_order, get_order, get_orders_by_user,
     get_assigned_orders, assign_order, get_technicians, get_order_technicians,
-    set_user_state, get_user_state, get_current_order_id, clear_user_state,
     save_problem_template, update_problem_template, get_problem_template,
     get_problem_templates, delete_problem_template, delete_user, delete_order,
-    add_activity_log, get_activity_logs, get_admin_activity_summary
+    add_activity_log, get_admin_activity_summary,
+    get_orders_page, get_activity_logs_page, PAGE_OLDER, get_order_view,
+    search_orders, normalize_search_query, get_client_history
 )
 from utils import (
     get_main_menu_keyboard, get_order_status_keyboard, get_order_management_keyboard,
     get_technician_order_keyboard, get_back_to_main_menu_keyboard, get_approval_requests_keyboard,
     get_user_management_keyboard, is_admin, is_dispatcher, is_technician,
-    send_order_notification_to_admins, validate_phone, format_orders_list, get_technician_list_keyboard,
-    get_role_name, get_user_list_for_deletion, get_order_list_for_deletion, get_status_text
+    send_order_notification_to_admins, format_orders_list, get_technician_list_keyboard,
+    get_role_name, get_user_list_for_deletion, get_order_list_for_deletion, get_status_text,
+    format_orders_page, get_page_navigation_row, format_search_results
 )
 from logger import get_component_logger, DEBUG, INFO, WARNING, ERROR, CRITICAL, log_function_call
 
 # Импорт модуля shared_state будет использоваться для общих функций управления состоянием
-from shared_state import set_user_state, clear_user_state, get_user_state, get_current_order_id
-from ui_constants import EMOJI, format_error_message, format_success_message, format_info_message
+from shared_state import set_user_state, clear_user_state, get_user_state, get_current_order_id, get_user_state_snapshot
+from ui_constants import (
+    EMOJI, format_error_message, format_success_message, format_info_message, format_order_card,
+    format_client_history
+)
+from phone_numbers import normalize_phone
+from outbound_queue import enqueue_message, PRIORITY_NOTIFICATION, PRIORITY_BROADCAST
 
 # Настройка логирования с использованием новой системы
 logger = get_component_logger('bot', level=INFO)
 
+# Размер страниц списков заказов и логов активности
+ORDERS_PAGE_SIZE = 10
+LOGS_PAGE_SIZE = 10
+SEARCH_PAGE_SIZE = 10
+# Сколько предыдущих заказов клиента показывать при создании заказа
+CLIENT_HISTORY_SIZE = 3
+
 # Словарь для хранения временных данных пользователей
 user_data = {}
 
@@ -87,17 +102,10 @@ TEMPLATE_DESCRIPTION_INPUT = "template_description_input"
 TEMPLATE_EDIT_TITLE_INPUT = "template_edit_title_input"
 TEMPLATE_EDIT_DESCRIPTION_INPUT = "template_edit_description_input"
 
-# Используем bot из shared_state и импортируем обработчики AI-колбеков
+# Используем bot из shared_state и импортируем маршруты AI-колбеков
 from shared_state import bot
-from ai_commands import (
-    handle_ai_analyze_problem_callback,
-    handle_ai_suggest_cost_callback, 
-    handle_ai_generate_description_callback,
-    handle_ai_technician_help_callback,
-    handle_ai_order_help_callback,
-    handle_set_cost_callback,
-    handle_set_description_callback
-)
+from ai_commands import register_ai_callback_routes
+from callback_router import CallbackRouter, CallbackContext
 
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
@@ -186,7 +194,7 @@ def handle_start_command(message):
         )
 
         # Отправляем уведомление администраторам о новом пользователе
-        admins = [user for user in get_all_users() if user['role'] == 'admin']
+        admins = get_users_by_role('admin')
 
         if admins:
             username_info = f" (@{username})" if username else ""
@@ -203,11 +211,10 @@ def handle_start_command(message):
             keyboard.add(approve_button, reject_button)
             keyboard.add(InlineKeyboardButton(text="👥 Управление пользователями", callback_data="manage_users"))
 
+            # Ставим уведомления в очередь отправки, обработчик не ждет Telegram
             for admin in admins:
-                try:
-                    bot.send_message(admin['user_id'], notification, parse_mode="Markdown", reply_markup=keyboard)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления администратору {admin['user_id']}: {e}")
+                enqueue_message(bot, admin['user_id'], notification, PRIORITY_NOTIFICATION,
+                                parse_mode="Markdown", reply_markup=keyboard)
 
 # Обработчик команды /help
 @bot.message_handler(commands=['help'])
@@ -240,6 +247,7 @@ def handle_help_command(message):
     if is_admin(user_id):
         help_text += "Команды администратора:\n"
         help_text += "/all_orders - Просмотр всех заказов\n"
+        help_text += "/find <текст> - Поиск заказов по клиенту, телефону, адресу и проблеме\n"
         help_text += "/manage_users - Управление пользователями\n"
         help_text += "\nКак администратор, вы можете:\n"
         help_text += "• Просматривать все заказы\n"
@@ -251,6 +259,7 @@ def handle_help_command(message):
         help_text += "Команды диспетчера:\n"
         help_text += "/new_order - Создать новый заказ\n"
         help_text += "/my_orders - Просмотр созданных вами заказов\n"
+        help_text += "/find <текст> - Поиск заказов по клиенту, телефону, адресу и проблеме\n"
         help_text += "\nКак диспетчер, вы можете:\n"
         help_text += "• Создавать новые заказы\n"
         help_text += "• Просматривать и редактировать созданные вами заказы\n"
@@ -417,15 +426,15 @@ def handle_all_orders_command(message):
             )
             return
 
-        # Получаем все заказы
-        logger.info("Получение всех заказов из БД")
-        orders = get_all_orders()
-        logger.info(f"Получено заказов: {len(orders)}")
+        # Получаем первую страницу заказов
+        logger.info("Получение первой страницы заказов из БД")
+        page = get_orders_page(limit=ORDERS_PAGE_SIZE)
+        logger.info(f"Получено заказов: {len(page.items)}")
 
         # Форматируем список заказов и получаем клавиатуру
         role = 'admin' if is_admin(user) else 'dispatcher' if is_dispatcher(user) else 'technician'
         logger.info(f"Роль пользователя: {role}")
-        message_text, keyboard = format_orders_list(orders, user_role=role)
+        message_text, keyboard = format_orders_page(page, user_role=role)
         
         # Логируем для отладки
         logger.info(f"Сформировано сообщение длиной {len(message_text)} символов")
@@ -440,6 +449,53 @@ def handle_all_orders_command(message):
         import traceback
         logger.error(traceback.format_exc())
 
+# Обработчик команды /find (для администраторов и диспетчеров)
+@bot.message_handler(commands=['find'])
+def handle_find_command(message):
+    """
+    Обработчик команды /find <текст> - полнотекстовый поиск заказов
+    """
+    user_id = message.from_user.id
+
+    # Получаем пользователя из БД
+    user = get_user(user_id)
+
+    if not user or not user["is_approved"]:
+        bot.reply_to(
+            message,
+            "Ваша учетная запись не подтверждена администратором. "
+            "Пожалуйста, дождитесь подтверждения."
+        )
+        return
+
+    if not (is_admin(user) or is_dispatcher(user)):
+        bot.reply_to(
+            message,
+            "Эта команда доступна только для администраторов и диспетчеров."
+        )
+        return
+
+    parts = message.text.split(maxsplit=1)
+    query = normalize_search_query(parts[1]) if len(parts) > 1 else ''
+    if not query:
+        bot.reply_to(
+            message,
+            "Укажите, что искать: /find <текст>\n"
+            "Например: /find Иванов ноутбук или /find 89991234567"
+        )
+        return
+
+    role = 'admin' if is_admin(user) else 'dispatcher'
+    message_text, keyboard = _search_results_page(query, 0, role)
+    bot.send_message(user_id, message_text, reply_markup=keyboard, parse_mode="Markdown")
+
+def _search_results_page(query, offset, role):
+    """Находит страницу результатов поиска и форматирует ее"""
+    # Лишний заказ показывает, есть ли следующая страница
+    orders = search_orders(query, limit=SEARCH_PAGE_SIZE + 1, offset=offset)
+    has_more = len(orders) > SEARCH_PAGE_SIZE
+    return format_search_results(orders[:SEARCH_PAGE_SIZE], query, offset, has_more, SEARCH_PAGE_SIZE, user_role=role)
+
 # Обработчик команды /manage_users (только для администраторов)
 @bot.message_handler(commands=['manage_users'])
 def handle_manage_users_command(message):
@@ -532,6 +588,95 @@ def handle_order_command(message):
         # Отправляем информацию о заказе
         bot.send_message(user_id, message_text, reply_markup=keyboard, parse_mode="Markdown")
 
+# Маршруты callback-запросов inline-кнопок
+callback_router = CallbackRouter()
+_route = callback_router.add_route
+
+_route("main_menu", lambda ctx: handle_main_menu_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("help", lambda ctx: handle_help_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("new_order", lambda ctx: handle_new_order_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("my_orders", lambda ctx: handle_my_orders_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("my_assigned_orders", lambda ctx: handle_my_assigned_orders_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("all_orders", lambda ctx: handle_all_orders_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("orders_cursor_{direction:int}_{created_us:int}_{order_id:int}",
+       lambda ctx, direction, created_us, order_id: handle_all_orders_callback(
+           ctx.user_id, ctx.message_id, ctx.chat_id, (created_us, order_id), direction),
+       action="orders_page")
+_route("search_{offset:int}_{query:rest}",
+       lambda ctx, offset, query: handle_search_page_callback(ctx.user_id, ctx.message_id, query, offset, ctx.chat_id),
+       action="search_page")
+_route("order_{order_id:int}",
+       lambda ctx, order_id: handle_order_detail_callback(ctx.user_id, ctx.message_id, order_id, ctx.chat_id))
+_route("change_status_{order_id:int}",
+       lambda ctx, order_id: handle_change_status_callback(ctx.user_id, ctx.message_id, order_id, ctx.chat_id))
+# Статус может состоять из нескольких частей, например in_progress
+_route("status_{order_id:int}_{status:rest}",
+       lambda ctx, order_id, status: handle_update_status_callback(ctx.user_id, ctx.message_id, order_id, status, ctx.chat_id),
+       action="status")
+_route("assign_technician_{order_id:int}",
+       lambda ctx, order_id: handle_assign_technician_callback(ctx.user_id, ctx.message_id, order_id))
+_route("assign_{order_id:int}_{technician_id:int}",
+       lambda ctx, order_id, technician_id: handle_assign_order_callback(ctx.user_id, ctx.message_id, order_id, technician_id),
+       action="assign")
+_route("add_cost_{order_id:int}", lambda ctx, order_id: handle_add_cost_callback(ctx.user_id, ctx.message_id, order_id))
+_route("add_description_{order_id:int}",
+       lambda ctx, order_id: handle_add_description_callback(ctx.user_id, ctx.message_id, order_id))
+
+# Управление пользователями
+_route("manage_users", lambda ctx: handle_manage_users_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("list_users", lambda ctx: handle_list_users_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("approval_requests", lambda ctx: handle_approval_requests_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("approve_{target_id:int}",
+       lambda ctx, target_id: handle_approve_user_callback(ctx.user_id, ctx.message_id, target_id, ctx.chat_id))
+_route("reject_{target_id:int}",
+       lambda ctx, target_id: handle_reject_user_callback(ctx.user_id, ctx.message_id, target_id, ctx.chat_id))
+_route("add_admin", lambda ctx: handle_add_admin_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("add_dispatcher", lambda ctx: handle_add_dispatcher_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("add_technician", lambda ctx: handle_add_technician_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("set_admin_{target_id:int}",
+       lambda ctx, target_id: handle_set_role_callback(ctx.user_id, ctx.message_id, target_id, "admin", ctx.chat_id))
+_route("set_dispatcher_{target_id:int}",
+       lambda ctx, target_id: handle_set_role_callback(ctx.user_id, ctx.message_id, target_id, "dispatcher", ctx.chat_id))
+_route("set_technician_{target_id:int}",
+       lambda ctx, target_id: handle_set_role_callback(ctx.user_id, ctx.message_id, target_id, "technician", ctx.chat_id))
+_route("delete_user_menu", lambda ctx: handle_delete_user_menu_callback(ctx.user_id, ctx.message_id))
+_route("delete_user_{target_id:int}",
+       lambda ctx, target_id: handle_delete_user_callback(ctx.user_id, ctx.message_id, target_id))
+_route("confirm_delete_user_{target_id:int}",
+       lambda ctx, target_id: handle_confirm_delete_user_callback(ctx.user_id, ctx.message_id, target_id))
+
+# Шаблоны проблем
+_route("manage_templates", lambda ctx: handle_manage_templates_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("view_templates", lambda ctx: handle_view_templates_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("add_template", lambda ctx: handle_add_template_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("use_template_{template_id:int}",
+       lambda ctx, template_id: handle_use_template_callback(ctx.user_id, ctx.message_id, template_id, ctx.chat_id))
+_route("edit_template_{template_id:int}",
+       lambda ctx, template_id: handle_edit_template_callback(ctx.user_id, ctx.message_id, template_id, ctx.chat_id))
+_route("delete_template_{template_id:int}",
+       lambda ctx, template_id: handle_delete_template_callback(ctx.user_id, ctx.message_id, template_id, ctx.chat_id))
+
+# Управление заказами
+_route("manage_orders", lambda ctx: handle_manage_orders_callback(ctx.user_id, ctx.message_id, ctx.chat_id))
+_route("delete_order_{order_id:int}",
+       lambda ctx, order_id: handle_delete_order_callback(ctx.user_id, ctx.message_id, order_id, ctx.chat_id))
+_route("confirm_delete_order_{order_id:int}",
+       lambda ctx, order_id: handle_confirm_delete_order_callback(ctx.user_id, ctx.message_id, order_id, ctx.chat_id))
+
+# Логи активности
+_route("activity_logs", lambda ctx: handle_activity_logs_callback(ctx.user_id, ctx.message_id))
+# Кнопки с номером страницы из отправленных ранее сообщений открывают первую страницу
+_route("logs_page_{page:int}", lambda ctx, page: handle_logs_page_callback(ctx.user_id, ctx.message_id))
+_route("logs_cursor_{direction:int}_{created_us:int}_{log_id:int}",
+       lambda ctx, direction, created_us, log_id: handle_logs_page_callback(
+           ctx.user_id, ctx.message_id, (created_us, log_id), direction),
+       action="logs_page")
+_route("logs_filter_{filter_type:str}",
+       lambda ctx, filter_type: handle_logs_filter_callback(ctx.user_id, ctx.message_id, filter_type))
+
+# ИИ функции
+register_ai_callback_routes(callback_router)
+
 # Обработчик всех callback-запросов от inline-кнопок
 @bot.callback_query_handler(func=lambda call: True)
 def handle_callback_query(call):
@@ -551,7 +696,6 @@ def handle_callback_query(call):
             
         user_id = call.from_user.id
         chat_id = call.message.chat.id  # Используем chat_id для отправки сообщений
-        message_id = call.message.message_id
         callback_data = call.data
 
         # Получаем пользователя из кэша или БД
@@ -581,148 +725,8 @@ def handle_callback_query(call):
             pass
         return
 
-    # Обрабатываем различные типы callback-запросов
-    if callback_data == "main_menu":
-        handle_main_menu_callback(user_id, message_id, chat_id)
-    elif callback_data == "help":
-        handle_help_callback(user_id, message_id, chat_id)
-    elif callback_data == "new_order":
-        handle_new_order_callback(user_id, message_id, chat_id)
-    elif callback_data == "my_orders":
-        handle_my_orders_callback(user_id, message_id, chat_id)
-    elif callback_data == "my_assigned_orders":
-        handle_my_assigned_orders_callback(user_id, message_id, chat_id)
-    elif callback_data == "all_orders":
-        handle_all_orders_callback(user_id, message_id, chat_id)
-    elif callback_data == "manage_users":
-        handle_manage_users_callback(user_id, message_id, chat_id)
-    elif callback_data == "list_users":
-        handle_list_users_callback(user_id, message_id, chat_id)
-    elif callback_data == "approval_requests":
-        handle_approval_requests_callback(user_id, message_id, chat_id)
-    elif callback_data.startswith("approve_"):
-        user_to_approve = int(callback_data.split("_")[1])
-        handle_approve_user_callback(user_id, message_id, user_to_approve, chat_id)
-    elif callback_data.startswith("reject_"):
-        user_to_reject = int(callback_data.split("_")[1])
-        handle_reject_user_callback(user_id, message_id, user_to_reject, chat_id)
-    elif callback_data == "add_admin":
-        handle_add_admin_callback(user_id, message_id, chat_id)
-    elif callback_data == "add_dispatcher":
-        handle_add_dispatcher_callback(user_id, message_id, chat_id)
-    elif callback_data == "add_technician":
-        handle_add_technician_callback(user_id, message_id, chat_id)
-    elif callback_data.startswith("set_admin_"):
-        user_to_set = int(callback_data.split("_")[2])
-        handle_set_role_callback(user_id, message_id, user_to_set, "admin", chat_id)
-    elif callback_data.startswith("set_dispatcher_"):
-        user_to_set = int(callback_data.split("_")[2])
-        handle_set_role_callback(user_id, message_id, user_to_set, "dispatcher", chat_id)
-    elif callback_data.startswith("set_technician_"):
-        user_to_set = int(callback_data.split("_")[2])
-        handle_set_role_callback(user_id, message_id, user_to_set, "technician", chat_id)
-    elif callback_data == "manage_templates":
-        handle_manage_templates_callback(user_id, message_id, chat_id)
-    elif callback_data == "view_templates":
-        handle_view_templates_callback(user_id, message_id, chat_id)
-    elif callback_data == "add_template":
-        handle_add_template_callback(user_id, message_id, chat_id)
-    elif callback_data.startswith("use_template_"):
-        template_id = int(callback_data.split("_")[2])
-        handle_use_template_callback(user_id, message_id, template_id, chat_id)
-    elif callback_data.startswith("edit_template_"):
-        template_id = int(callback_data.split("_")[2])
-        handle_edit_template_callback(user_id, message_id, template_id, chat_id)
-    elif callback_data.startswith("delete_template_"):
-        template_id = int(callback_data.split("_")[2])
-        handle_delete_template_callback(user_id, message_id, template_id, chat_id)
-    elif callback_data.startswith("order_"):
-        order_id = int(callback_data.split("_")[1])
-        handle_order_detail_callback(user_id, message_id, order_id, chat_id)
-    elif callback_data.startswith("change_status_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_change_status_callback(user_id, message_id, order_id, chat_id)
-    elif callback_data.startswith("status_"):
-        parts = callback_data.split("_")
-        order_id = int(parts[1])
-
-        # Для случая "in_progress", части будут: ["status", "order_id", "in", "progress"]
-        # Для других статусов: ["status", "order_id", "status_name"]
-        if len(parts) > 3 and parts[2] == "in" and parts[3] == "progress":
-            status = "in_progress"
-        else:
-            status = parts[2]
-
-        handle_update_status_callback(user_id, message_id, order_id, status, chat_id)
-    elif callback_data.startswith("assign_technician_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_assign_technician_callback(user_id, message_id, order_id)
-    elif callback_data.startswith("assign_"):
-        parts = callback_data.split("_")
-        order_id = int(parts[1])
-        technician_id = int(parts[2])
-        handle_assign_order_callback(user_id, message_id, order_id, technician_id)
-    elif callback_data.startswith("add_cost_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_add_cost_callback(user_id, message_id, order_id)
-    elif callback_data.startswith("add_description_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_add_description_callback(user_id, message_id, order_id)
-    # Обработка удаления пользователей и заказов
-    elif callback_data == "delete_user_menu":
-        handle_delete_user_menu_callback(user_id, message_id)
-    elif callback_data.startswith("delete_user_"):
-        user_to_delete = int(callback_data.split("_")[2])
-        handle_delete_user_callback(user_id, message_id, user_to_delete)
-    elif callback_data.startswith("confirm_delete_user_"):
-        user_to_delete = int(callback_data.split("_")[3])
-        handle_confirm_delete_user_callback(user_id, message_id, user_to_delete)
-    elif callback_data == "manage_orders":
-        handle_manage_orders_callback(user_id, message_id, chat_id)
-    elif callback_data.startswith("delete_order_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_delete_order_callback(user_id, message_id, order_id, chat_id)
-    elif callback_data.startswith("confirm_delete_order_"):
-        order_id = int(callback_data.split("_")[3])
-        handle_confirm_delete_order_callback(user_id, message_id, order_id, chat_id)
-    # Обработка логов активности
-    elif callback_data == "activity_logs":
-        handle_activity_logs_callback(user_id, message_id)
-    elif callback_data.startswith("logs_page_"):
-        page = int(callback_data.split("_")[2])
-        handle_logs_page_callback(user_id, message_id, page)
-    elif callback_data.startswith("logs_filter_"):
-        filter_type = callback_data.split("_")[2]
-        handle_logs_filter_callback(user_id, message_id, filter_type)
-    # Обработка AI-колбэков
-    elif callback_data == "ai_analyze_problem":
-        handle_ai_analyze_problem_callback(user_id, message_id)
-    elif callback_data == "ai_suggest_cost":
-        handle_ai_suggest_cost_callback(user_id, message_id)
-    elif callback_data == "ai_generate_description":
-        handle_ai_generate_description_callback(user_id, message_id)
-    elif callback_data == "ai_technician_help":
-        handle_ai_technician_help_callback(user_id, message_id)
-    elif callback_data.startswith("set_cost_"):
-        parts = callback_data.split("_")
-        order_id = int(parts[2])
-        cost = float(parts[3])
-        handle_set_cost_callback(user_id, message_id, order_id, cost)
-    elif callback_data.startswith("set_description_"):
-        order_id = int(callback_data.split("_")[2])
-        handle_set_description_callback(user_id, message_id, order_id)
-    elif callback_data.startswith("ai_analyze_problem"):
-        handle_ai_analyze_problem_callback(user_id, message_id)
-    elif callback_data.startswith("ai_suggest_cost"):
-        handle_ai_suggest_cost_callback(user_id, message_id)
-    elif callback_data.startswith("ai_generate_description"):
-        handle_ai_generate_description_callback(user_id, message_id)
-    elif callback_data.startswith("ai_technician_help"):
-        handle_ai_technician_help_callback(user_id, message_id)
-    elif callback_data.startswith("ai_order_help_"):
-        order_id = int(callback_data.split("_")[3])
-        handle_ai_order_help_callback(user_id, message_id, order_id)
-    else:
+    # Находим обработчик по callback_data через маршрутизатор
+    if not callback_router.dispatch(CallbackContext(call, callback_data, user)):
         bot.answer_callback_query(call.id, "Неизвестная команда")
 
 # Обработчики callback-запросов
@@ -1046,6 +1050,7 @@ def handle_help_callback(user_id, message_id, chat_id=None):
     if is_admin(user):
         help_text += "Команды администратора:\n"
         help_text += "/all_orders - Просмотр всех заказов\n"
+        help_text += "/find <текст> - Поиск заказов по клиенту, телефону, адресу и проблеме\n"
         help_text += "/manage_users - Управление пользователями\n"
         help_text += "\nКак администратор, вы можете:\n"
         help_text += "• Просматривать все заказы\n"
@@ -1057,6 +1062,7 @@ def handle_help_callback(user_id, message_id, chat_id=None):
         help_text += "Команды диспетчера:\n"
         help_text += "/new_order - Создать новый заказ\n"
         help_text += "/my_orders - Просмотр созданных вами заказов\n"
+        help_text += "/find <текст> - Поиск заказов по клиенту, телефону, адресу и проблеме\n"
         help_text += "\nКак диспетчер, вы можете:\n"
         help_text += "• Создавать новые заказы\n"
         help_text += "• Просматривать и редактировать созданные вами заказы\n"
@@ -1194,9 +1200,10 @@ def handle_my_assigned_orders_callback(user_id, message_id, chat_id=None):
         parse_mode="Markdown"
     )
 
-def handle_all_orders_callback(user_id, message_id, chat_id=None):
+def handle_all_orders_callback(user_id, message_id, chat_id=None, page_key=None, direction=PAGE_OLDER):
     """
-    Обработчик callback-запроса all_orders
+    Обработчик callback-запроса all_orders и кнопок навигации по страницам заказов
+    (page_key и direction - ключ соседней страницы из callback_data)
     """
     # Если chat_id не указан, используем user_id (для обратной совместимости)
     if chat_id is None:
@@ -1215,12 +1222,12 @@ def handle_all_orders_callback(user_id, message_id, chat_id=None):
         )
         return
 
-    # Получаем все заказы
-    orders = get_all_orders()
+    # Получаем страницу заказов
+    page = get_orders_page(page_key, direction, limit=ORDERS_PAGE_SIZE)
 
     # Форматируем список заказов и получаем клавиатуру
     role = 'admin' if is_admin(user) else 'dispatcher' if is_dispatcher(user) else 'technician'
-    message_text, keyboard = format_orders_list(orders, user_role=role)
+    message_text, keyboard = format_orders_page(page, user_role=role)
 
     # Редактируем сообщение со списком заказов
     bot.edit_message_text(
@@ -1231,6 +1238,29 @@ def handle_all_orders_callback(user_id, message_id, chat_id=None):
         parse_mode="Markdown"
     )
 
+def handle_search_page_callback(user_id, message_id, query, offset, chat_id=None):
+    """
+    Обработчик кнопок навигации по страницам результатов поиска /find
+    """
+    if chat_id is None:
+        chat_id = user_id
+
+    user = get_user(user_id)
+
+    if not user:
+        return
+
+    if not (is_admin(user) or is_dispatcher(user)):
+        bot.send_message(
+            chat_id,
+            "Эта функция доступна только для администраторов и диспетчеров."
+        )
+        return
+
+    role = 'admin' if is_admin(user) else 'dispatcher'
+    message_text, keyboard = _search_results_page(normalize_search_query(query), offset, role)
+    safe_edit_message_text(chat_id, message_id, message_text, reply_markup=keyboard, parse_mode="Markdown")
+
 def handle_manage_users_callback(user_id, message_id, chat_id=None):
     """
     Обработчик callback-запроса manage_users
@@ -1835,10 +1865,10 @@ def handle_order_detail_callback(user_id, message_id, order_id, chat_id=None):
     if not user:
         return
 
-    # Получаем информацию о заказе
-    order = get_order(order_id)
+    # Получаем заказ вместе с диспетчером и мастерами одним запросом
+    view = get_order_view(order_id)
 
-    if not order:
+    if not view:
         bot.edit_message_text(
             chat_id=chat_id,
             message_id=message_id,
@@ -1847,22 +1877,19 @@ def handle_order_detail_callback(user_id, message_id, order_id, chat_id=None):
         )
         return
 
-    # Формируем сообщение с информацией о заказе в зависимости от роли пользователя
+    # Формируем карточку заказа в зависимости от роли пользователя (мастерам телефон не показывается)
     role = 'admin' if is_admin(user) else 'dispatcher' if is_dispatcher(user) else 'technician'
-    message_text, _ = format_orders_list([order], user_role=role)
+    message_text = format_order_card(view, include_phone=role != 'technician')
 
     # Определяем тип клавиатуры в зависимости от роли пользователя
     keyboard = None
     if is_admin(user):
         keyboard = get_order_management_keyboard(order_id)
-    elif is_dispatcher(user) and order["dispatcher_id"] == user_id:
+    elif is_dispatcher(user) and view.order["dispatcher_id"] == user_id:
         keyboard = get_order_management_keyboard(order_id)
     elif is_technician(user):
         # Проверяем, назначен ли заказ этому мастеру
-        technicians = get_order_technicians(order_id)
-        is_assigned = any(tech["technician_id"] == user_id for tech in technicians)
-
-        if is_assigned:
+        if view.is_assigned_to(user_id):
             keyboard = get_technician_order_keyboard(order_id)
         else:
             keyboard = get_back_to_main_menu_keyboard()
@@ -2002,53 +2029,47 @@ def handle_update_status_callback(user_id, message_id, order_id, status, chat_id
             # Отправляем уведомление мастерам
             for tech in technicians:
                 if tech["technician_id"] != user_id:  # Не отправляем уведомление тому, кто обновил статус
-                    try:
-                        bot.send_message(
-                            tech["technician_id"],
-                            f"🔄 *Обновление статуса заказа #{order_id}*\n\n"
-                            f"Статус изменен на: *{get_status_text(status)}*\n\n"
-                            "Используйте команду /my_assigned_orders для просмотра ваших заказов.",
-                            parse_mode="Markdown"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке уведомления мастеру {tech.get('technician_id', '')}: {e}")
-
-            # Отправляем уведомление диспетчеру
-            dispatcher_id = updated_order.get('dispatcher_id', '')
-            if dispatcher_id and dispatcher_id != user_id:
-                try:
-                    bot.send_message(
-                        updated_order.get('dispatcher_id', ''),
+                    enqueue_message(
+                        bot,
+                        tech["technician_id"],
                         f"🔄 *Обновление статуса заказа #{order_id}*\n\n"
                         f"Статус изменен на: *{get_status_text(status)}*\n\n"
-                        "Используйте команду /my_orders для просмотра ваших заказов.",
+                        "Используйте команду /my_assigned_orders для просмотра ваших заказов.",
+                        PRIORITY_NOTIFICATION,
                         parse_mode="Markdown"
                     )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления диспетчеру {dispatcher_id}: {e}")
 
-            # Отправляем уведомление главному администратору (всем администраторам)
-            all_users = get_all_users()
-            for admin_user in all_users:
-                if is_admin(admin_user) and admin_user.get("user_id", "") != user_id:  # Не отправляем тому, кто сам изменил статус
-                    try:
-                        # Создаем клавиатуру с кнопкой перехода к заказу
-                        order_keyboard = InlineKeyboardMarkup()
-                        order_keyboard.add(InlineKeyboardButton("👁️ Посмотреть детали", callback_data=f"order_{order_id}"))
+            # Отправляем уведомление диспетчеру
+            dispatcher_id = updated_order.get('dispatcher_id', '')
+            if dispatcher_id and dispatcher_id != user_id:
+                enqueue_message(
+                    bot,
+                    dispatcher_id,
+                    f"🔄 *Обновление статуса заказа #{order_id}*\n\n"
+                    f"Статус изменен на: *{get_status_text(status)}*\n\n"
+                    "Используйте команду /my_orders для просмотра ваших заказов.",
+                    PRIORITY_NOTIFICATION,
+                    parse_mode="Markdown"
+                )
 
-                        # Отправляем уведомление
-                        bot.send_message(
-                            admin_user["user_id"],
-                            f"🔔 *Обновление статуса заказа #{order_id}*\n\n"
-                            f"Статус изменен на: *{get_status_text(status)}*\n"
-                            f"Клиент: {updated_order.get('client_name', '')}\n"
-                            f"Телефон: {updated_order.get('client_phone', '')}\n"
-                            f"Изменил: {user.get('first_name', '')} {user.get('last_name', '')} ({get_role_name(user.get('role', ''))})",
-                            parse_mode="Markdown",
-                            reply_markup=order_keyboard
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке уведомления администратору {admin_user.get('user_id', '')}: {e}")
+            # Отправляем уведомление главному администратору (всем администраторам)
+            # Рассылка всем администраторам уходит после ответов и адресных уведомлений
+            order_keyboard = InlineKeyboardMarkup()
+            order_keyboard.add(InlineKeyboardButton("👁️ Посмотреть детали", callback_data=f"order_{order_id}"))
+            for admin_user in get_users_by_role('admin'):
+                if admin_user.get("user_id", "") != user_id:  # Не отправляем тому, кто сам изменил статус
+                    enqueue_message(
+                        bot,
+                        admin_user["user_id"],
+                        f"🔔 *Обновление статуса заказа #{order_id}*\n\n"
+                        f"Статус изменен на: *{get_status_text(status)}*\n"
+                        f"Клиент: {updated_order.get('client_name', '')}\n"
+                        f"Телефон: {updated_order.get('client_phone', '')}\n"
+                        f"Изменил: {user.get('first_name', '')} {user.get('last_name', '')} ({get_role_name(user.get('role', ''))})",
+                        PRIORITY_BROADCAST,
+                        parse_mode="Markdown",
+                        reply_markup=order_keyboard
+                    )
     else:
         bot.send_message(
             user_id,
@@ -2555,19 +2576,21 @@ def handle_message(message):
         )
         return
 
+    # Получаем состояние пользователя и ID текущего заказа одним обращением
+    snapshot = get_user_state_snapshot(user_id)
+
     # Сначала проверяем, относится ли сообщение к AI функциям
     try:
         # Импортируем обработчик AI сообщений
         from ai_commands import handle_ai_message_input
 
         # Если сообщение обработано AI модулем, завершаем обработку
-        if handle_ai_message_input(message):
+        if handle_ai_message_input(message, snapshot):
             return
     except Exception as e:
         logger.error(f"Ошибка при обработке AI сообщения: {e}")
 
-    # Получаем текущее состояние пользователя
-    state = get_user_state(user_id)
+    state = snapshot.state if snapshot else None
 
     if not state:
         # Если нет состояния, отправляем общее сообщение
@@ -2596,9 +2619,9 @@ def handle_message(message):
     elif state == "waiting_for_technician_id":
         handle_user_id_input(user_id, text, "technician")
     elif state == "waiting_for_cost":
-        handle_cost_input(user_id, text)
+        handle_cost_input(user_id, text, snapshot.order_id)
     elif state == "waiting_for_description":
-        handle_description_input(user_id, text)
+        handle_description_input(user_id, text, snapshot.order_id)
     else:
         # Неизвестное состояние
         bot.reply_to(
@@ -2613,11 +2636,13 @@ def handle_phone_input(user_id, text):
     """
     Обработка ввода номера телефона
     """
-    # Проверяем формат номера телефона
-    if not validate_phone(text):
+    # Проверяем формат номера телефона и приводим его к E.164
+    phone = normalize_phone(text)
+    if phone is None:
         bot.send_message(
             user_id,
-            "❌ Неверный формат номера телефона. Пожалуйста, введите корректный номер."
+            "❌ Неверный формат номера телефона. Введите номер из 10-15 цифр без букв, "
+            "например +7 900 123-45-67 или 8 (900) 123-45-67."
         )
         return
 
@@ -2625,7 +2650,12 @@ def handle_phone_input(user_id, text):
     if user_id not in user_data:
         user_data[user_id] = {}
 
-    user_data[user_id]['phone'] = text
+    user_data[user_id]['phone'] = phone
+
+    # Если клиент уже обращался, показываем его предыдущие заказы
+    history = get_client_history(phone, limit=CLIENT_HISTORY_SIZE)
+    if history:
+        bot.send_message(user_id, format_client_history(history))
 
     # Запрашиваем имя клиента
     bot.send_message(
@@ -2855,13 +2885,15 @@ def handle_user_id_input(user_id, text, role):
         # Очищаем состояние пользователя
         clear_user_state(user_id)
 
-def handle_cost_input(user_id, text):
+def handle_cost_input(user_id, text, order_id=None):
     """
     Обработка ввода стоимости услуг с расширенной валидацией
     и улучшенной обработкой ошибок
+    (order_id - ID текущего заказа из состояния, уже прочитанного в handle_message)
     """
     # Получаем ID текущего заказа
-    order_id = get_current_order_id(user_id)
+    if order_id is None:
+        order_id = get_current_order_id(user_id)
 
     if not order_id:
         bot.send_message(
@@ -2974,13 +3006,15 @@ def handle_cost_input(user_id, text):
         # Очищаем состояние пользователя
         clear_user_state(user_id)
 
-def handle_description_input(user_id, text):
+def handle_description_input(user_id, text, order_id=None):
     """
     Обработка ввода описания выполненных работ с улучшенной
     валидацией и логированием
+    (order_id - ID текущего заказа из состояния, уже прочитанного в handle_message)
     """
     # Получаем ID текущего заказа
-    order_id = get_current_order_id(user_id)
+    if order_id is None:
+        order_id = get_current_order_id(user_id)
 
     if not order_id:
         bot.send_message(
@@ -3086,13 +3120,13 @@ def handle_activity_logs_callback(user_id, message_id):
         return handle_main_menu_callback(user_id, message_id)
 
     # Получаем первую страницу логов
-    return handle_logs_page_callback(user_id, message_id, 1)
+    return handle_logs_page_callback(user_id, message_id)
 
 
-def handle_logs_page_callback(user_id, message_id, page):
+def handle_logs_page_callback(user_id, message_id, page_key=None, direction=PAGE_OLDER):
     """
-    Обработчик callback-запроса logs_page_{page}
-    Отображает определенную страницу логов активности
+    Обработчик кнопок навигации по логам активности
+    Отображает страницу логов, соседнюю с ключом page_key (None - первая страница)
     """
     # Проверяем, что пользователь - администратор
     user_role = get_user_role(user_id)
@@ -3100,22 +3134,24 @@ def handle_logs_page_callback(user_id, message_id, page):
         bot.send_message(user_id, "У вас нет прав для просмотра логов активности.")
         return handle_main_menu_callback(user_id, message_id)
 
-    # Получаем логи с пагинацией
-    page_size = 10
-    offset = (page - 1) * page_size
-    logs = get_activity_logs(limit=page_size, offset=offset)
+    # Получаем страницу логов по ключу (created_at, log_id), а не по смещению
+    page = get_activity_logs_page(page_key, direction, limit=LOGS_PAGE_SIZE)
+    logs = page.items
 
     # Формируем сообщение с логами
     if not logs:
-        if page == 1:
+        if page_key is None:
             message_text = "📋 Логи активности пусты."
         else:
             message_text = "📋 Больше записей нет."
     else:
         message_text = "📋 <b>Логи активности:</b>\n\n"
         for log in logs:
-            # Форматируем дату и время
-            timestamp = log['created_at'].strftime("%d.%m.%Y %H:%M:%S")
+            # Форматируем дату и время (SQLite возвращает строку)
+            created_at = log['created_at']
+            if not isinstance(created_at, datetime.datetime):
+                created_at = datetime.datetime.fromisoformat(str(created_at))
+            timestamp = created_at.strftime("%d.%m.%Y %H:%M:%S")
 
             # Добавляем запись в лог
             message_text += f"<b>{timestamp}</b>\n"
@@ -3129,13 +3165,7 @@ def handle_logs_page_callback(user_id, message_id, page):
     keyboard = InlineKeyboardMarkup()
 
     # Кнопки навигации
-    nav_row = []
-    if page > 1:
-        nav_row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"logs_page_{page-1}"))
-
-    if len(logs) == page_size:  # Если текущая страница полностью заполнена, значит есть еще записи
-        nav_row.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"logs_page_{page+1}"))
-
+    nav_row = get_page_navigation_row(page, 'logs_page', 'log_id')
     if nav_row:
         keyboard.row(*nav_row)
 
@@ -1,26 +1,27 @@
 """
 Модуль для кэширования данных
 Используется для уменьшения числа обращений к базе данных
+
+Кэш хранится в памяти процесса. Если задана переменная CACHE_BACKEND (mmap или redis),
+загруженные значения также сохраняются в общем хранилище, а удаление записей
+рассылается остальным процессам (см. cache_backends.py).
 """
 
+import sys
 import time
-from typing import Dict, Any, Callable, Tuple, List, Optional
+import atexit
+import bisect
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Iterable, Tuple, List, Optional, Set
 from functools import wraps
 from logger import get_component_logger
 
 # Настройка логирования
 logger = get_component_logger('cache')
 
-# Основной словарь для хранения кэша
-_cache: Dict[str, Dict[str, Any]] = {
-    'users': {},       # Кэш пользователей
-    'orders': {},      # Кэш заказов
-    'technicians': {}, # Кэш мастеров
-    'assignments': {}, # Кэш назначений
-    'stats': {},       # Кэш статистики
-    'misc': {}         # Прочий кэш
-}
-
 # TTL (Time To Live) для различных типов кэша в секундах
 _cache_ttl: Dict[str, int] = {
     'users': 300,       # 5 минут для пользователей (увеличено для снижения нагрузки)
@@ -31,65 +32,601 @@ _cache_ttl: Dict[str, int] = {
     'misc': 300         # 5 минут для прочего кэша (увеличено для снижения нагрузки)
 }
 
-# Метки времени для отслеживания последнего обновления кэша
-_last_update: Dict[str, Dict[str, float]] = {
-    'users': {},
-    'orders': {},
-    'technicians': {},
-    'assignments': {},
-    'stats': {},
-    'misc': {}
+# Максимальное число записей для различных типов кэша
+_cache_max_size: Dict[str, int] = {
+    'users': 10000,
+    'orders': 5000,
+    'technicians': 100,
+    'assignments': 5000,
+    'stats': 200,
+    'misc': 1000
+}
+
+# Сколько устаревших записей удаляется за одну операцию записи
+_SWEEP_BATCH = 32
+
+# Маркер отсутствия значения в кэше: позволяет отличить промах от сохраненного None
+MISSING = object()
+
+
+# Границы интервалов гистограммы времени загрузки, мс
+_LOAD_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class CacheStats:
+    """
+    Счетчики кэша одного типа (изменяются под блокировкой его CacheNamespace).
+
+    Обращение считается попаданием (hits), если значение отдано из локального кэша,
+    и промахом (misses), если нет. Устаревшее значение, отданное на время обновления
+    (stale-while-revalidate), - попадание и учитывается еще и в stale_hits. Устаревшая
+    запись, которую get не отдает, - промах. Значение, полученное из общего хранилища
+    или чужой загрузки после промаха, учитывается в shared_hits и coalesced, но остается
+    промахом, поэтому hits + misses равно числу обращений.
+    """
+
+    COUNTERS = ('hits', 'stale_hits', 'misses', 'coalesced', 'shared_hits', 'loads', 'load_errors',
+                'expirations', 'evictions', 'invalidations')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.load_time_total = 0.0
+        self.load_time_max = 0.0
+        self.load_time_histogram = [0] * (len(_LOAD_TIME_BUCKETS_MS) + 1)
+
+    def record_load(self, elapsed: float) -> None:
+        self.loads += 1
+        self.load_time_total += elapsed
+        self.load_time_max = max(self.load_time_max, elapsed)
+        self.load_time_histogram[bisect.bisect_left(_LOAD_TIME_BUCKETS_MS, elapsed * 1000)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        result = {name: getattr(self, name) for name in self.COUNTERS}
+        lookups = self.hits + self.misses
+        result['hit_ratio'] = round(self.hits / lookups, 4) if lookups else None
+        result['load_time_avg_ms'] = round(self.load_time_total / self.loads * 1000, 3) if self.loads else None
+        result['load_time_max_ms'] = round(self.load_time_max * 1000, 3)
+        labels = [f'<={bound}ms' for bound in _LOAD_TIME_BUCKETS_MS] + [f'>{_LOAD_TIME_BUCKETS_MS[-1]}ms']
+        result['load_time_histogram'] = dict(zip(labels, self.load_time_histogram))
+        return result
+
+
+def _approximate_size(value: Any, depth: int = 0) -> int:
+    """Приблизительный размер значения в байтах (с вложенными словарями, списками и строками)"""
+    size = sys.getsizeof(value)
+    if depth >= 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(_approximate_size(k, depth + 1) + _approximate_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_approximate_size(item, depth + 1) for item in value)
+    return size
+
+
+class CacheEntry:
+    """
+    Запись кэша: значение, момент устаревания, момент, до которого устаревшее
+    значение еще можно отдавать на время его обновления (stale-while-revalidate),
+    и теги данных, от которых зависит значение
+    """
+
+    __slots__ = ('value', 'expires_at', 'stale_until', 'tags')
+
+    def __init__(self, value: Any, expires_at: float, stale_until: Optional[float] = None,
+                 tags: Tuple[str, ...] = ()):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = expires_at if stale_until is None else stale_until
+        self.tags = tags
+
+
+class _Flight:
+    """Загрузка значения, результата которой ждут все запросившие его потоки"""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class CacheNamespace:
+    """
+    Кэш одного типа с ограничением размера и временем жизни записей.
+    Записи хранятся в упорядоченном словаре в порядке использования (для вытеснения давно
+    не использованных при переполнении) и в куче по моменту, после которого запись больше
+    нельзя отдавать. У записей разное время жизни (TTL типа, negative_ttl, stale_ttl),
+    поэтому порядок записи не совпадает с порядком устаревания; из кучи устаревшие записи
+    удаляются за O(log n) каждая. Запись, удаленная или перезаписанная раньше срока,
+    остается в куче и пропускается при очистке; куча перестраивается, когда таких записей
+    становится больше, чем действующих.
+
+    get_or_load загружает отсутствующее значение не более одного раза одновременно:
+    остальные потоки, запросившие тот же ключ, ждут результата этой загрузки.
+
+    Запись может быть помечена тегами (например, order:15 для списка, содержащего заказ 15);
+    invalidate_tags удаляет только записи с указанными тегами.
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()  # Порядок использования
+        # (stale_until, номер записи, ключ, запись) - порядок устаревания
+        self._expiry: List[Tuple[float, int, str, CacheEntry]] = []
+        self._expiry_seq = itertools.count()
+        self._flights: Dict[Tuple[str, int], _Flight] = {}
+        self._tags: Dict[str, Set[str]] = {}  # Тег -> ключи записей с этим тегом
+        # Увеличивается при удалении и очистке: загрузка, начатая до инвалидации, не сохраняется
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _sweep(self, now: float) -> None:
+        """Удаляет записи, срок которых истек раньше всех (вызывается под блокировкой)"""
+        expiry = self._expiry
+        for _ in range(_SWEEP_BATCH):
+            if not expiry or expiry[0][0] > now:
+                return
+            _, _, key, entry = heapq.heappop(expiry)
+            if self._entries.get(key) is entry:
+                self._remove(key)
+                self.stats.expirations += 1
+
+    def _compact_expiry(self) -> None:
+        """Убирает из кучи удаленные и перезаписанные записи (вызывается под блокировкой)"""
+        self._expiry = [item for item in self._expiry if self._entries.get(item[2]) is item[3]]
+        heapq.heapify(self._expiry)
+
+    def _store(self, key: str, value: Any, ttl: Optional[float], stale_ttl: float,
+               tags: Tuple[str, ...] = ()) -> None:
+        """Сохраняет значение (вызывается под блокировкой)"""
+        now = time.monotonic()
+        if key in self._entries:
+            self._remove(key)
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        entry = self._entries[key] = CacheEntry(value, expires_at, expires_at + stale_ttl, tags)
+        heapq.heappush(self._expiry, (entry.stale_until, next(self._expiry_seq), key, entry))
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        self._sweep(now)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+        if len(self._expiry) > 2 * len(self._entries) + _SWEEP_BATCH:
+            self._compact_expiry()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Возвращает неустаревшую запись или None (устаревшие записи не отдаются - промах)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            if entry.expires_at <= now:
+                if entry.stale_until <= now:
+                    self._remove(key)
+                    self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, stale_ttl: float = 0,
+            tags: Iterable[str] = ()) -> None:
+        with self._lock:
+            self._store(key, value, ttl, stale_ttl, tuple(tags))
+
+    @property
+    def generation(self) -> int:
+        """Поколение типа кэша: меняется при каждом удалении и очистке (см. fill)"""
+        return self._generation
+
+    def fill(self, key: str, value: Any, ttl: Optional[float], generation: int) -> bool:
+        """
+        Сохраняет значение, загруженное вне get_or_load, если с момента чтения generation
+        не было инвалидаций; возвращает, сохранено ли значение
+        """
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._store(key, value, ttl, 0)
+            return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._generation += 1
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            self.stats.invalidations += 1
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.stats.invalidations += len(self._entries)
+            self._entries.clear()
+            self._expiry.clear()
+            self._tags.clear()
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Удаляет записи, помеченные любым из тегов; возвращает число удаленных записей"""
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.stats.invalidations += removed
+        return removed
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики, число записей и их приблизительный размер"""
+        with self._lock:
+            result = self.stats.snapshot()
+            values = [entry.value for entry in self._entries.values()]
+            result.update({
+                'entries': len(values),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'tags': len(self._tags),
+                'loading': len(self._flights)
+            })
+        # Размер считается без блокировки: значения в кэше не изменяются
+        result['approx_bytes'] = sum(_approximate_size(value) for value in values)
+        return result
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], stale_ttl: float = 0,
+                    negative_ttl: Optional[float] = None,
+                    tags: Optional[Callable[[Any], Iterable[str]]] = None) -> Any:
+        """
+        Возвращает значение из кэша или загружает его функцией loader.
+        Одновременно выполняется не более одной загрузки ключа. Если stale_ttl > 0, значение,
+        устаревшее не более чем на stale_ttl секунд, возвращается сразу, а обновляется в фоне.
+        Результат None кэшируется на negative_ttl секунд, если он задан, иначе не кэшируется.
+        Функция tags получает загруженное значение и возвращает теги записи.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return entry.value
+                if entry.stale_until > now:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    self.stats.stale_hits += 1
+                    flight_key = (key, self._generation)
+                    if flight_key not in self._flights:
+                        flight = self._flights[flight_key] = _Flight()
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(flight_key, flight, loader, stale_ttl, negative_ttl, tags),
+                            name=f'cache-refresh-{self.name}', daemon=True
+                        ).start()
+                    return entry.value
+                self._remove(key)
+                self.stats.expirations += 1
+
+            self.stats.misses += 1
+            flight_key = (key, self._generation)
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                leader = False
+                self.stats.coalesced += 1
+            else:
+                flight = self._flights[flight_key] = _Flight()
+                leader = True
+
+        if not leader:
+            return flight.wait()
+        return self._run_flight(flight_key, flight, loader, stale_ttl, negative_ttl, tags)
+
+    def _run_flight(self, flight_key: Tuple[str, int], flight: _Flight, loader: Callable[[], Any],
+                    stale_ttl: float, negative_ttl: Optional[float],
+                    tags: Optional[Callable[[Any], Iterable[str]]]) -> Any:
+        key, generation = flight_key
+        entry_tags: Tuple[str, ...] = ()
+        shared_ttl = None  # Оставшееся время жизни значения, полученного из общего хранилища
+        shared_generation = MISSING  # Поколение общего хранилища до загрузки
+        stored_ttl = None
+        load_time = None
+        try:
+            shared = _shared_get(self.name, key)
+            if shared is not None:
+                flight.value, shared_ttl = shared
+            else:
+                shared_generation = _shared_generation(self.name, key)
+                started = time.perf_counter()
+                try:
+                    flight.value = loader()
+                finally:
+                    load_time = time.perf_counter() - started
+            if tags is not None:
+                entry_tags = tuple(tags(flight.value))
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+                if shared_ttl is not None:
+                    self.stats.shared_hits += 1
+                if load_time is not None:
+                    self.stats.record_load(load_time)
+                    if flight.error is not None:
+                        self.stats.load_errors += 1
+                if flight.error is None and generation == self._generation:
+                    if flight.value is not None:
+                        stored_ttl = self.ttl if shared_ttl is None else shared_ttl
+                        self._store(key, flight.value, stored_ttl, stale_ttl, entry_tags)
+                    elif negative_ttl is not None:
+                        stored_ttl = negative_ttl if shared_ttl is None else shared_ttl
+                        self._store(key, None, stored_ttl, 0, entry_tags)
+            flight.done.set()
+        if stored_ttl is not None and shared_ttl is None and shared_generation is not MISSING:
+            # Если за время загрузки другой процесс инвалидировал ключ, значение не сохраняется
+            _shared_set(self.name, key, flight.value, stored_ttl, entry_tags, shared_generation)
+        return flight.value
+
+    def _refresh(self, flight_key: Tuple[str, int], flight: _Flight, loader: Callable[[], Any],
+                 stale_ttl: float, negative_ttl: Optional[float],
+                 tags: Optional[Callable[[Any], Iterable[str]]]) -> None:
+        """Фоновое обновление устаревшего значения"""
+        try:
+            self._run_flight(flight_key, flight, loader, stale_ttl, negative_ttl, tags)
+        except Exception as e:
+            logger.error(f"Ошибка при фоновом обновлении кэша {self.name}, ключ {flight_key[0]}: {e}")
+
+
+# Хранилище кэша по типам
+_cache: Dict[str, CacheNamespace] = {
+    cache_type: CacheNamespace(cache_type, ttl, _cache_max_size[cache_type])
+    for cache_type, ttl in _cache_ttl.items()
 }
 
-def cache_get(cache_type: str, key: str) -> Optional[Any]:
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_cache_backend():
+    """
+    Возвращает общее хранилище кэша, создавая его при первом обращении
+    и подписываясь на инвалидации из других процессов
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                from cache_backends import create_backend_from_env, MemoryBackend, CacheConfigurationError
+                try:
+                    backend = create_backend_from_env()
+                except CacheConfigurationError:
+                    # Кэш только в памяти не получал бы инвалидаций остальных процессов
+                    raise
+                except Exception as e:
+                    logger.error(f"Не удалось подключить общее хранилище кэша: {e}. Используется память процесса")
+                    backend = MemoryBackend()
+                backend.listen(_apply_remote_invalidation)
+                atexit.register(backend.close)
+                _backend = backend
+    return _backend
+
+def init_cache_backend():
+    """
+    Создает общее хранилище кэша при запуске процесса, до приема обновлений.
+    Ошибка настройки (CacheConfigurationError) останавливает запуск, а не проявляется
+    позже в обработчиках при первом обращении к кэшу
+    
+    Raises:
+        CacheConfigurationError: Файл mmap создан с другими размерами
+    """
+    backend = get_cache_backend()
+    logger.info(f"Общее хранилище кэша: {backend.name}")
+    return backend
+
+def _shared_get(cache_type: str, key: str) -> Optional[Tuple[Any, float]]:
+    """Читает значение из общего хранилища; ошибки хранилища считаются промахом"""
+    try:
+        backend = get_cache_backend()
+        if not backend.shared:
+            return None
+        return backend.get(cache_type, key)
+    except Exception as e:
+        logger.warning(f"Ошибка чтения общего кэша {cache_type}, ключ {key}: {e}")
+        return None
+
+def _shared_generation(cache_type: str, key: str) -> Any:
+    """
+    Возвращает поколение ключа в общем хранилище (см. CacheBackend.generation);
+    MISSING, если его не удалось получить - тогда загруженное значение не сохраняется
+    """
+    try:
+        backend = get_cache_backend()
+        if not backend.shared:
+            return None
+        return backend.generation(cache_type, key)
+    except Exception as e:
+        logger.warning(f"Ошибка чтения поколения общего кэша {cache_type}, ключ {key}: {e}")
+        return MISSING
+
+def _shared_generations(cache_type: str, keys: List[str]) -> List[Any]:
+    """Поколения нескольких ключей в общем хранилище (см. _shared_generation)"""
+    try:
+        backend = get_cache_backend()
+        if not backend.shared:
+            return [None] * len(keys)
+        return backend.generations(cache_type, keys)
+    except Exception as e:
+        logger.warning(f"Ошибка чтения поколений общего кэша {cache_type}: {e}")
+        return [MISSING] * len(keys)
+
+def _shared_set(cache_type: str, key: str, value: Any, ttl: float, tags: Tuple[str, ...] = (),
+                generation: Any = None) -> None:
+    """Сохраняет значение в общем хранилище (не сохраняет, если поколение generation устарело)"""
+    try:
+        backend = get_cache_backend()
+        if not backend.shared:
+            return
+        backend.set(cache_type, key, value, ttl, tags, generation)
+    except Exception as e:
+        logger.warning(f"Ошибка записи общего кэша {cache_type}, ключ {key}: {e}")
+
+def _shared_invalidate(op: str, cache_type: Optional[str], key: Optional[str] = None,
+                       tags: Tuple[str, ...] = ()) -> None:
+    """Удаляет записи из общего хранилища и рассылает инвалидацию остальным процессам"""
+    try:
+        backend = get_cache_backend()
+        if not backend.shared:
+            return
+        backend.invalidate(op, cache_type, key, tags)
+    except Exception as e:
+        logger.warning(f"Ошибка инвалидации общего кэша {cache_type}: {e}")
+
+def _apply_remote_invalidation(op: str, cache_type: Optional[str], key: Optional[str],
+                               tags: Tuple[str, ...]) -> None:
+    """Применяет к кэшу процесса инвалидацию, выполненную другим процессом"""
+    if op == 'reset' or (op == 'clear' and cache_type is None):
+        for namespace in _cache.values():
+            namespace.clear()
+        return
+    namespace = _cache.get(cache_type)
+    if namespace is None:
+        return
+    if op == 'delete':
+        namespace.delete(key)
+    elif op == 'clear':
+        namespace.clear()
+    elif op == 'tags':
+        namespace.invalidate_tags(tags)
+
+def cache_get(cache_type: str, key: str, default: Any = None) -> Any:
     """
     Получает значение из кэша
     
     Args:
         cache_type: Тип кэша ('users', 'orders', etc.)
         key: Ключ для доступа к кэшу
+        default: Значение при промахе; MISSING позволяет отличить промах от сохраненного None
         
     Returns:
-        Any: Значение из кэша или None, если его нет или оно устарело
+        Any: Значение из кэша или default, если его нет или оно устарело
     """
-    if cache_type not in _cache:
+    namespace = _cache.get(cache_type)
+    if namespace is None:
         logger.warning(f"Попытка получить данные из несуществующего типа кэша: {cache_type}")
-        return None
+        return default
         
-    # Проверяем, есть ли ключ в кэше данного типа
-    if key not in _cache[cache_type]:
-        return None
+    entry = namespace.get(key)
+    return entry.value if entry is not None else default
+
+def cache_set(cache_type: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+    """
+    Сохраняет значение в кэш
+    
+    Args:
+        cache_type: Тип кэша ('users', 'orders', etc.)
+        key: Ключ для доступа к кэшу
+        value: Значение для сохранения в кэш (в том числе None или пустой список)
+        ttl: Время жизни записи в секундах (по умолчанию - TTL типа кэша)
+    """
+    namespace = _cache.get(cache_type)
+    if namespace is None:
+        logger.warning(f"Попытка сохранить данные в несуществующий тип кэша: {cache_type}")
+        return
         
-    # Проверяем, устарел ли кэш
-    now = time.time()
-    ttl = _cache_ttl.get(cache_type, 60)  # По умолчанию 1 минута
-    last_update = _last_update[cache_type].get(key, 0)
+    namespace.set(key, value, ttl)
+    # Остальные процессы удаляют старое значение и при следующем чтении получат новое
+    _shared_invalidate('delete', cache_type, key)
+    _shared_set(cache_type, key, value, namespace.ttl if ttl is None else ttl)
+
+class CacheFillSnapshot:
+    """Поколения кэша, прочитанные до загрузки значений из БД (см. cache_snapshot)"""
+
+    def __init__(self, generation: int, shared_generations: Dict[str, Any]):
+        self.generation = generation
+        self.shared_generations = shared_generations
+
+def cache_snapshot(cache_type: str, keys: Iterable[str]) -> Optional[CacheFillSnapshot]:
+    """
+    Запоминает поколения типа кэша и ключей в общем хранилище. Вызывается до чтения из БД
+    значений, которые затем сохраняются через cache_fill
     
-    if now - last_update > ttl:
-        # Кэш устарел, удаляем его
-        del _cache[cache_type][key]
-        if key in _last_update[cache_type]:
-            del _last_update[cache_type][key]
-        return None
+    Args:
+        cache_type: Тип кэша ('users', 'orders', etc.)
+        keys: Ключи, значения которых будут загружены
         
-    return _cache[cache_type][key]
+    Returns:
+        Optional[CacheFillSnapshot]: Снимок или None для несуществующего типа кэша
+    """
+    namespace = _cache.get(cache_type)
+    if namespace is None:
+        logger.warning(f"Попытка получить поколение несуществующего типа кэша: {cache_type}")
+        return None
+    # Поколение типа кэша читается первым: инвалидация во время чтения общих поколений
+    # в любом случае отменит сохранение
+    generation = namespace.generation
+    keys = list(keys)
+    return CacheFillSnapshot(generation, dict(zip(keys, _shared_generations(cache_type, keys))))
 
-def cache_set(cache_type: str, key: str, value: Any) -> None:
+def cache_fill(cache_type: str, key: str, value: Any, ttl: Optional[float],
+               snapshot: Optional[CacheFillSnapshot]) -> None:
     """
-    Сохраняет значение в кэш
+    Сохраняет в кэш значение, загруженное из БД (в отличие от cache_set, остальным процессам
+    не рассылается инвалидация: данные не изменились, значение только загружено).
+    Значение не сохраняется, если после cache_snapshot тип кэша или ключ были инвалидированы:
+    загруженное до инвалидации значение могло устареть
     
     Args:
         cache_type: Тип кэша ('users', 'orders', etc.)
         key: Ключ для доступа к кэшу
-        value: Значение для сохранения в кэш
+        value: Загруженное значение (в том числе None - "не найдено")
+        ttl: Время жизни записи в секундах (None - TTL типа кэша)
+        snapshot: Результат cache_snapshot, полученный до загрузки значения
     """
-    if cache_type not in _cache:
+    namespace = _cache.get(cache_type)
+    if namespace is None or snapshot is None:
         logger.warning(f"Попытка сохранить данные в несуществующий тип кэша: {cache_type}")
         return
         
-    # Обновляем кэш
-    _cache[cache_type][key] = value
-    _last_update[cache_type][key] = time.time()
+    if not namespace.fill(key, value, ttl, snapshot.generation):
+        return
+    shared_generation = snapshot.shared_generations.get(key, MISSING)
+    if shared_generation is not MISSING:
+        _shared_set(cache_type, key, value, namespace.ttl if ttl is None else ttl, (), shared_generation)
 
 def cache_delete(cache_type: str, key: str) -> None:
     """
@@ -99,17 +636,13 @@ def cache_delete(cache_type: str, key: str) -> None:
         cache_type: Тип кэша ('users', 'orders', etc.)
         key: Ключ для доступа к кэшу
     """
-    if cache_type not in _cache:
+    namespace = _cache.get(cache_type)
+    if namespace is None:
         logger.warning(f"Попытка удалить данные из несуществующего типа кэша: {cache_type}")
         return
         
-    # Удаляем значение из кэша, если оно есть
-    if key in _cache[cache_type]:
-        del _cache[cache_type][key]
-        
-    # Удаляем метку времени, если она есть
-    if key in _last_update[cache_type]:
-        del _last_update[cache_type][key]
+    namespace.delete(key)
+    _shared_invalidate('delete', cache_type, key)
 
 def cache_clear(cache_type: Optional[str] = None) -> None:
     """
@@ -120,25 +653,74 @@ def cache_clear(cache_type: Optional[str] = None) -> None:
     """
     if cache_type is None:
         # Очищаем весь кэш
-        for cache_key in _cache:
-            _cache[cache_key].clear()
-            _last_update[cache_key].clear()
+        for namespace in _cache.values():
+            namespace.clear()
+        _shared_invalidate('clear', None)
         logger.info("Весь кэш очищен")
     elif cache_type in _cache:
         # Очищаем кэш определенного типа
         _cache[cache_type].clear()
-        _last_update[cache_type].clear()
+        _shared_invalidate('clear', cache_type)
         logger.info(f"Кэш типа {cache_type} очищен")
     else:
         logger.warning(f"Попытка очистить несуществующий тип кэша: {cache_type}")
 
-def cached(cache_type: str, key_func: Callable = None) -> Callable:
+def cache_invalidate_tags(cache_type: str, *tags: str) -> None:
     """
-    Декоратор для кэширования результатов функций
+    Удаляет из кэша записи, помеченные любым из тегов
+    
+    Args:
+        cache_type: Тип кэша ('users', 'orders', etc.)
+        *tags: Теги (например, 'order:15')
+    """
+    namespace = _cache.get(cache_type)
+    if namespace is None:
+        logger.warning(f"Попытка инвалидировать теги в несуществующем типе кэша: {cache_type}")
+        return
+        
+    removed = namespace.invalidate_tags(tags)
+    _shared_invalidate('tags', cache_type, tags=tags)
+    logger.debug(f"Инвалидированы теги {', '.join(tags)} в кэше {cache_type}: записей {removed}")
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Возвращает статистику кэша каждого типа: попадания, промахи, устаревания, вытеснения,
+    инвалидации, время загрузки (среднее, максимум, гистограмма), число и размер записей
+    
+    Returns:
+        Dict[str, Dict[str, Any]]: Тип кэша -> статистика
+    """
+    return {cache_type: namespace.get_stats() for cache_type, namespace in _cache.items()}
+
+def reset_cache_stats() -> None:
+    """Обнуляет счетчики статистики кэша (записи кэша сохраняются)"""
+    for namespace in _cache.values():
+        namespace.reset_stats()
+
+def get_cache_sizes() -> Dict[str, int]:
+    """
+    Возвращает число записей в кэше каждого типа
+    
+    Returns:
+        Dict[str, int]: Тип кэша -> число записей
+    """
+    return {cache_type: len(namespace) for cache_type, namespace in _cache.items()}
+
+def cached(cache_type: str, key_func: Callable = None, stale_while_revalidate: float = 0,
+           negative_ttl: Optional[float] = None, tags: Callable = None) -> Callable:
+    """
+    Декоратор для кэширования результатов функций.
+    Потоки, одновременно запросившие отсутствующий в кэше ключ, ждут одной загрузки
+    вместо того, чтобы каждый выполнял запрос к базе данных.
     
     Args:
         cache_type: Тип кэша
         key_func: Функция для генерации ключа кэша (если не указана, используется первый аргумент)
+        stale_while_revalidate: Сколько секунд после устаревания возвращать старое значение,
+            обновляя его в фоне (0 - не возвращать)
+        negative_ttl: Сколько секунд кэшировать результат None ("не найдено");
+            если не задан, None не кэшируется
+        tags: Функция (результат, *args, **kwargs) -> теги записи для cache_invalidate_tags
         
     Returns:
         Callable: Декорированная функция
@@ -156,19 +738,15 @@ def cached(cache_type: str, key_func: Callable = None) -> Callable:
                 # Если нет аргументов, используем имя функции
                 cache_key = func.__name__
                 
-            # Проверяем, есть ли результат в кэше
-            cached_value = cache_get(cache_type, cache_key)
-            if cached_value is not None:
-                logger.debug(f"Использован кэш для {func.__name__}, ключ: {cache_key}")
-                return cached_value
+            namespace = _cache.get(cache_type)
+            if namespace is None:
+                logger.warning(f"Попытка получить данные из несуществующего типа кэша: {cache_type}")
+                return func(*args, **kwargs)
                 
-            # Выполняем функцию и кэшируем результат
-            result = func(*args, **kwargs)
-            if result is not None:  # Кэшируем только непустые результаты
-                cache_set(cache_type, cache_key, result)
-                logger.debug(f"Добавлен кэш для {func.__name__}, ключ: {cache_key}")
-                
-            return result
+            return namespace.get_or_load(
+                cache_key, lambda: func(*args, **kwargs), stale_while_revalidate, negative_ttl,
+                (lambda result: tags(result, *args, **kwargs)) if tags else None
+            )
         return wrapper
     return decorator
 
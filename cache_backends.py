@@ -0,0 +1,708 @@
+"""
+Общие для нескольких процессов хранилища кэша
+
+Кэш cache.py хранится в памяти процесса. Если запущено несколько процессов (бот, Flask,
+обработчик webhook), хранилище из этого модуля служит общим вторым уровнем кэша:
+значение, загруженное одним процессом, доступно остальным, а удаление записей
+(cache_delete, cache_clear, cache_invalidate_tags) рассылается всем процессам, и они
+удаляют свои локальные копии.
+
+Хранилища:
+    memory - только память процесса (по умолчанию), ничего не хранит и не рассылает
+    mmap   - файл, отображенный в память; для процессов на одной машине
+    redis  - сервер Redis (собственный минимальный клиент протокола RESP, без зависимостей);
+             для проверки без Redis подходит local_redis.py
+
+Значения сериализуются pickle, поэтому общее хранилище должно быть доступно только сервису.
+
+Загрузка значения может закончиться после того, как другой процесс инвалидировал ключ.
+Чтобы такое значение не попало в общее хранилище, перед загрузкой запоминается поколение
+хранилища (generation), и set с этим поколением не сохраняет значение, если с тех пор была
+инвалидация.
+
+Настройки из переменных окружения:
+    CACHE_BACKEND          - memory, mmap или redis
+    CACHE_MMAP_PATH        - файл хранилища mmap (по умолчанию service_bot_cache.mmap во временном каталоге)
+    CACHE_MMAP_SLOTS       - число ячеек хранилища mmap (по умолчанию 4096)
+    CACHE_MMAP_SLOT_SIZE   - размер ячейки в байтах (по умолчанию 4096; большие значения не сохраняются)
+    CACHE_REDIS_URL        - адрес Redis (по умолчанию redis://localhost:6379/0)
+    CACHE_REDIS_PREFIX     - префикс ключей (по умолчанию service_bot:cache:)
+"""
+
+import os
+import json
+import mmap
+import time
+import uuid
+import pickle
+import socket
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from logger import get_component_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками одного процесса
+    fcntl = None
+
+# Настройка логирования
+logger = get_component_logger('cache_backends')
+
+# Идентификатор процесса в сообщениях об инвалидации: свои сообщения не обрабатываются повторно
+INSTANCE_ID = uuid.uuid4().hex
+
+# Обработчик инвалидации из другого процесса: (операция, тип кэша, ключ, теги).
+# Операции: 'delete', 'clear', 'tags', а также 'reset' - сообщения могли быть потеряны,
+# локальный кэш нужно очистить полностью.
+InvalidationHandler = Callable[[str, Optional[str], Optional[str], Tuple[str, ...]], None]
+
+
+class CacheBackendError(Exception):
+    """Ошибка общего хранилища кэша"""
+
+
+class CacheConfigurationError(CacheBackendError):
+    """Настройки хранилища несовместимы с уже используемым хранилищем (процесс не должен запускаться)"""
+
+
+def _encode_message(op: str, namespace: Optional[str], key: Optional[str], tags: Iterable[str]) -> bytes:
+    return json.dumps({
+        'sender': INSTANCE_ID, 'op': op, 'namespace': namespace, 'key': key, 'tags': list(tags)
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def _dispatch_message(data: bytes, handler: InvalidationHandler) -> None:
+    """Разбирает сообщение об инвалидации и передает чужие сообщения обработчику"""
+    try:
+        message = json.loads(data.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.warning(f"Некорректное сообщение об инвалидации кэша: {e}")
+        return
+    if message.get('sender') == INSTANCE_ID:
+        return
+    handler(message.get('op'), message.get('namespace'), message.get('key'), tuple(message.get('tags') or ()))
+
+
+class CacheBackend:
+    """
+    Интерфейс общего хранилища. Базовая реализация (memory) ничего не хранит:
+    кэш остается только в памяти процесса, как в однопроцессном запуске.
+    """
+
+    name = 'memory'
+    shared = False
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """Возвращает (значение, оставшееся время жизни в секундах) или None при промахе"""
+        return None
+
+    def generation(self, namespace: str, key: str) -> Any:
+        """Возвращает поколение ключа: оно меняется при каждой инвалидации, затрагивающей ключ"""
+        return None
+
+    def generations(self, namespace: str, keys: List[str]) -> List[Any]:
+        """Возвращает поколения нескольких ключей (см. generation)"""
+        return [self.generation(namespace, key) for key in keys]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, tags: Tuple[str, ...] = (),
+            generation: Any = None) -> None:
+        """
+        Сохраняет значение на ttl секунд. Если указано generation (результат generation(),
+        полученный до загрузки значения), значение не сохраняется или не будет прочитано,
+        когда ключ с тех пор инвалидирован
+        """
+
+    def invalidate(self, op: str, namespace: Optional[str], key: Optional[str] = None,
+                   tags: Tuple[str, ...] = ()) -> None:
+        """Удаляет записи из хранилища и сообщает об этом остальным процессам"""
+
+    def listen(self, handler: InvalidationHandler) -> None:
+        """Запускает получение сообщений об инвалидации от остальных процессов"""
+
+    def close(self) -> None:
+        """Останавливает получение сообщений и закрывает соединения"""
+
+
+MemoryBackend = CacheBackend
+
+
+class _FileLock:
+    """Блокировка файла между процессами (flock) и между потоками процесса"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, exclusive: bool = True) -> Iterator[None]:
+        with self._thread_lock:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class MmapBackend(CacheBackend):
+    """
+    Хранилище в файле, отображенном в память всеми процессами машины.
+
+    Файл состоит из заголовка, кольцевого журнала сообщений об инвалидации и таблицы
+    ячеек фиксированного размера. Ячейка выбирается по crc32 ключа с пробированием
+    нескольких соседних; при нехватке места перезаписывается первая ячейка цепочки.
+    Процессы читают новые сообщения журнала раз в poll_interval секунд; если процесс
+    отстал больше чем на размер журнала, он очищает свой кэш полностью.
+
+    Поколение хранилища - номер последнего сообщения журнала: set с поколением
+    не сохраняет значение, если после его получения была любая инвалидация.
+
+    Размеры файла задаются при его создании. Процесс с другими размерами не запускается
+    (CacheConfigurationError): файл отображен в память другими процессами, и изменение
+    его размера привело бы к их аварийному завершению (SIGBUS) или чтению обнуленных ячеек.
+    """
+
+    name = 'mmap'
+    shared = True
+
+    MAGIC = b'SBC1'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sIIIIIQ')     # magic, версия, ячеек, размер ячейки, записей журнала, размер записи, номер
+    _MESSAGE_HEADER = struct.Struct('<QH')   # номер сообщения, длина
+    _SLOT_HEADER = struct.Struct('<BdHHI')   # занята, истекает (time.time), длина ключа, длина тегов, длина значения
+    PROBE = 8
+
+    def __init__(self, path: str, slots: int = 4096, slot_size: int = 4096,
+                 ring_size: int = 1024, message_size: int = 512, poll_interval: float = 0.2):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ring_size = ring_size
+        self.message_size = message_size
+        self.poll_interval = poll_interval
+        self._ring_offset = self._HEADER.size
+        self._slots_offset = self._ring_offset + ring_size * message_size
+        self._file_size = self._slots_offset + slots * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = _FileLock(self._fd)
+        try:
+            with self._lock.hold(exclusive=True):
+                self._open_or_initialize()
+                self._last_seq = self._read_seq()
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._stop = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+
+    def _open_or_initialize(self) -> None:
+        """
+        Отображает файл в память, создавая его, если он пуст (вызывается под блокировкой)
+
+        Raises:
+            CacheConfigurationError: если файл создан с другими размерами или другой версией
+        """
+        expected_header = (self.MAGIC, self.VERSION, self.slots, self.slot_size, self.ring_size, self.message_size)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            logger.info(f"Создание файла кэша {self.path} ({self._file_size} байт)")
+            os.ftruncate(self._fd, self._file_size)
+            self._map = mmap.mmap(self._fd, self._file_size)
+            self._HEADER.pack_into(self._map, 0, *expected_header, 0)
+            return
+
+        header = None
+        if size >= self._HEADER.size:
+            with mmap.mmap(self._fd, self._HEADER.size, access=mmap.ACCESS_READ) as header_map:
+                header = self._HEADER.unpack_from(header_map, 0)[:6]
+        if size != self._file_size or header != expected_header:
+            found = 'неизвестный формат' if header is None or header[0] != self.MAGIC else (
+                f"версия {header[1]}, ячеек {header[2]} по {header[3]} байт, журнал {header[4]} x {header[5]}")
+            raise CacheConfigurationError(
+                f"Файл кэша {self.path} ({size} байт, {found}) создан с другими настройками, чем "
+                f"версия {self.VERSION}, ячеек {self.slots} по {self.slot_size} байт, журнал "
+                f"{self.ring_size} x {self.message_size}. Укажите те же CACHE_MMAP_SLOTS и CACHE_MMAP_SLOT_SIZE, "
+                f"что у работающих процессов, или другой CACHE_MMAP_PATH; файл можно удалить, "
+                f"только когда все процессы остановлены"
+            )
+        self._map = mmap.mmap(self._fd, self._file_size)
+
+    def _read_seq(self) -> int:
+        return self._HEADER.unpack_from(self._map, 0)[6]
+
+    @staticmethod
+    def _full_key(namespace: str, key: str) -> bytes:
+        return f'{namespace}\x1f{key}'.encode('utf-8')
+
+    def _slot_chain(self, full_key: bytes) -> List[int]:
+        start = zlib.crc32(full_key) % self.slots
+        return [self._slots_offset + ((start + i) % self.slots) * self.slot_size for i in range(self.PROBE)]
+
+    def _read_slot(self, offset: int) -> Optional[Tuple[float, bytes, Tuple[str, ...], int, int]]:
+        """Возвращает (истекает, ключ, теги, смещение значения, длина значения) занятой ячейки"""
+        used, expires_at, key_len, tags_len, value_len = self._SLOT_HEADER.unpack_from(self._map, offset)
+        if not used:
+            return None
+        position = offset + self._SLOT_HEADER.size
+        full_key = bytes(self._map[position:position + key_len])
+        position += key_len
+        tags = tuple(self._map[position:position + tags_len].decode('utf-8').split('\x1f')) if tags_len else ()
+        return expires_at, full_key, tags, position + tags_len, value_len
+
+    def _free_slot(self, offset: int) -> None:
+        self._map[offset] = 0
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        full_key = self._full_key(namespace, key)
+        now = time.time()
+        with self._lock.hold(exclusive=False):
+            for offset in self._slot_chain(full_key):
+                slot = self._read_slot(offset)
+                if slot is None or slot[1] != full_key:
+                    continue
+                expires_at, _, _, value_offset, value_len = slot
+                if expires_at <= now:
+                    return None
+                data = bytes(self._map[value_offset:value_offset + value_len])
+                return pickle.loads(data), expires_at - now
+        return None
+
+    def generation(self, namespace: str, key: str) -> int:
+        with self._lock.hold(exclusive=False):
+            return self._read_seq()
+
+    def generations(self, namespace: str, keys: List[str]) -> List[int]:
+        # Поколение общее для всех ключей - номер последнего сообщения об инвалидации
+        return [self.generation(namespace, '')] * len(keys) if keys else []
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, tags: Tuple[str, ...] = (),
+            generation: Optional[int] = None) -> None:
+        full_key = self._full_key(namespace, key)
+        tags_data = '\x1f'.join(tags).encode('utf-8')
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        record_size = self._SLOT_HEADER.size + len(full_key) + len(tags_data) + len(data)
+        now = time.time()
+        with self._lock.hold(exclusive=True):
+            if generation is not None and self._read_seq() != generation:
+                # После загрузки значения была инвалидация - значение могло устареть
+                return
+            chain = self._slot_chain(full_key)
+            existing = free = None
+            for offset in chain:
+                slot = self._read_slot(offset)
+                if slot is not None and slot[1] == full_key:
+                    existing = offset
+                    break
+                if free is None and (slot is None or slot[0] <= now):
+                    free = offset
+            if record_size > self.slot_size:
+                # Значение не помещается в ячейку: остается только в памяти процессов
+                if existing is not None:
+                    self._free_slot(existing)
+                return
+            if existing is not None:
+                target = existing
+            else:
+                target = free if free is not None else chain[0]
+            position = target + self._SLOT_HEADER.size
+            for chunk in (full_key, tags_data, data):
+                self._map[position:position + len(chunk)] = chunk
+                position += len(chunk)
+            self._SLOT_HEADER.pack_into(self._map, target, 1, now + ttl, len(full_key), len(tags_data), len(data))
+
+    def _remove_matching(self, predicate: Callable[[bytes, Tuple[str, ...]], bool]) -> None:
+        """Освобождает ячейки, для которых predicate(ключ, теги) истинно (вызывается под блокировкой)"""
+        for index in range(self.slots):
+            offset = self._slots_offset + index * self.slot_size
+            slot = self._read_slot(offset)
+            if slot is not None and predicate(slot[1], slot[2]):
+                self._free_slot(offset)
+
+    def _append_message(self, op: str, namespace: Optional[str], key: Optional[str],
+                        tags: Tuple[str, ...]) -> None:
+        """Добавляет сообщение в журнал (вызывается под блокировкой)"""
+        data = _encode_message(op, namespace, key, tags)
+        if self._MESSAGE_HEADER.size + len(data) > self.message_size:
+            # Слишком длинное сообщение заменяется очисткой всего типа кэша
+            data = _encode_message('clear', namespace, None, ())
+        seq = self._read_seq() + 1
+        offset = self._ring_offset + ((seq - 1) % self.ring_size) * self.message_size
+        self._MESSAGE_HEADER.pack_into(self._map, offset, seq, len(data))
+        position = offset + self._MESSAGE_HEADER.size
+        self._map[position:position + len(data)] = data
+        header = list(self._HEADER.unpack_from(self._map, 0))
+        header[6] = seq
+        self._HEADER.pack_into(self._map, 0, *header)
+
+    def invalidate(self, op: str, namespace: Optional[str], key: Optional[str] = None,
+                   tags: Tuple[str, ...] = ()) -> None:
+        with self._lock.hold(exclusive=True):
+            if op == 'delete':
+                full_key = self._full_key(namespace, key)
+                for offset in self._slot_chain(full_key):
+                    slot = self._read_slot(offset)
+                    if slot is not None and slot[1] == full_key:
+                        self._free_slot(offset)
+            elif op == 'clear':
+                prefix = None if namespace is None else f'{namespace}\x1f'.encode('utf-8')
+                self._remove_matching(lambda full_key, _: prefix is None or full_key.startswith(prefix))
+            elif op == 'tags':
+                prefix = f'{namespace}\x1f'.encode('utf-8')
+                wanted = set(tags)
+                self._remove_matching(lambda full_key, slot_tags: full_key.startswith(prefix)
+                                      and not wanted.isdisjoint(slot_tags))
+            self._append_message(op, namespace, key, tags)
+
+    def _read_messages(self) -> Tuple[Optional[List[bytes]], int]:
+        """Читает новые сообщения журнала; None означает, что часть сообщений потеряна"""
+        with self._lock.hold(exclusive=False):
+            seq = self._read_seq()
+            if seq == self._last_seq:
+                return [], seq
+            if seq - self._last_seq > self.ring_size or seq < self._last_seq:
+                return None, seq
+            messages = []
+            for number in range(self._last_seq + 1, seq + 1):
+                offset = self._ring_offset + ((number - 1) % self.ring_size) * self.message_size
+                record_seq, length = self._MESSAGE_HEADER.unpack_from(self._map, offset)
+                if record_seq != number:
+                    return None, seq
+                position = offset + self._MESSAGE_HEADER.size
+                messages.append(bytes(self._map[position:position + length]))
+            return messages, seq
+
+    def _poll(self, handler: InvalidationHandler) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                messages, seq = self._read_messages()
+                self._last_seq = seq
+                if messages is None:
+                    logger.warning("Пропущены сообщения об инвалидации кэша, локальный кэш будет очищен")
+                    handler('reset', None, None, ())
+                    continue
+                for data in messages:
+                    _dispatch_message(data, handler)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении сообщений об инвалидации кэша: {e}")
+
+    def listen(self, handler: InvalidationHandler) -> None:
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._poll, args=(handler,), name='cache-mmap-listener', daemon=True)
+        self._listener.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+        self._map.close()
+        os.close(self._fd)
+
+
+class RespConnection:
+    """Минимальный клиент протокола Redis (RESP2) поверх одного сокета"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: Optional[float] = 5.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._reader = self._sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    @staticmethod
+    def _pack(args: Iterable[Any]) -> bytes:
+        parts = []
+        items = []
+        for arg in args:
+            if isinstance(arg, bytes):
+                items.append(arg)
+            else:
+                items.append(str(arg).encode('utf-8'))
+        parts.append(b'*%d\r\n' % len(items))
+        for item in items:
+            parts.append(b'$%d\r\n%s\r\n' % (len(item), item))
+        return b''.join(parts)
+
+    def read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise CacheBackendError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise CacheBackendError(f"Неизвестный ответ Redis: {line!r}")
+
+    def send(self, *commands: Tuple[Any, ...]) -> None:
+        self._sock.sendall(b''.join(self._pack(command) for command in commands))
+
+    def pipeline(self, *commands: Tuple[Any, ...]) -> List[Any]:
+        """Отправляет команды одним пакетом и возвращает ответы по порядку"""
+        self.send(*commands)
+        return [self.read_reply() for _ in commands]
+
+    def command(self, *args: Any) -> Any:
+        return self.pipeline(args)[0]
+
+    def set_timeout(self, timeout: Optional[float]) -> None:
+        self._sock.settimeout(timeout)
+
+    def close(self) -> None:
+        # shutdown прерывает чтение, ожидающее в другом потоке (подписка)
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend(CacheBackend):
+    """
+    Хранилище в Redis. Значения хранятся с PX, теги - множествами ключей,
+    сообщения об инвалидации рассылаются через PUBLISH/SUBSCRIBE.
+    После переподключения подписки локальный кэш очищается: сообщения могли быть пропущены.
+
+    Поколение ключа - счетчики INCR всего кэша, типа кэша и самого ключа, которые
+    увеличиваются при очистке всего кэша, типа и при удалении ключа (в том числе по тегу).
+    Значение сохраняется вместе с поколением, полученным до его загрузки, и при чтении
+    значение с устаревшим поколением считается промахом.
+    """
+
+    name = 'redis'
+    shared = True
+
+    # Минимальное время жизни множества ключей тега: оно должно пережить свои записи
+    TAG_SET_MIN_TTL = 3600
+    # Время жизни счетчика поколения ключа; значения живут меньше, чтобы счетчик их пережил
+    GENERATION_TTL = 86400
+
+    def __init__(self, url: str, prefix: str = 'service_bot:cache:'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or '/0').lstrip('/') or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self.channel = prefix + 'invalidate'
+        self._conn: Optional[RespConnection] = None
+        self._conn_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._subscriber: Optional[RespConnection] = None
+
+    def _connect(self, timeout: Optional[float] = 5.0) -> RespConnection:
+        return RespConnection(self.host, self.port, self.db, self.password, timeout)
+
+    def _execute(self, *commands: Tuple[Any, ...]) -> List[Any]:
+        """Выполняет команды на общем соединении, переподключаясь один раз при обрыве"""
+        with self._conn_lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    return self._conn.pipeline(*commands)
+                except (OSError, ConnectionError):
+                    if self._conn is not None:
+                        self._conn.close()
+                        self._conn = None
+                    if attempt:
+                        raise
+        return []
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f'{self.prefix}{namespace}:{key}'
+
+    def _tag_key(self, namespace: str, tag: str) -> str:
+        return f'{self.prefix}tag:{namespace}:{tag}'
+
+    def _generation_key(self, scope: str = '') -> str:
+        """Счетчик поколения: всего кэша (scope пуст), типа кэша или ключа (scope - ключ Redis без префикса)"""
+        return f'{self.prefix}generation:{scope}' if scope else f'{self.prefix}generation'
+
+    def _key_generation_key(self, redis_key: str) -> str:
+        return self._generation_key(redis_key[len(self.prefix):])
+
+    def _generation_keys(self, namespace: str, redis_key: str) -> Tuple[str, str, str]:
+        return self._generation_key(), self._generation_key(namespace), self._key_generation_key(redis_key)
+
+    @staticmethod
+    def _parse_generation(counters: List[Optional[bytes]]) -> Tuple[int, ...]:
+        return tuple(int(counter or 0) for counter in counters)
+
+    def generation(self, namespace: str, key: str) -> Tuple[int, ...]:
+        counters = self._execute(('MGET', *self._generation_keys(namespace, self._key(namespace, key))))[0]
+        return self._parse_generation(counters)
+
+    def generations(self, namespace: str, keys: List[str]) -> List[Tuple[int, ...]]:
+        if not keys:
+            return []
+        replies = self._execute(*[('MGET', *self._generation_keys(namespace, self._key(namespace, key)))
+                                  for key in keys])
+        return [self._parse_generation(counters) for counters in replies]
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        redis_key = self._key(namespace, key)
+        data, pttl, counters = self._execute(
+            ('GET', redis_key), ('PTTL', redis_key), ('MGET', *self._generation_keys(namespace, redis_key))
+        )
+        if data is None:
+            return None
+        generation, value = pickle.loads(data)
+        if tuple(generation) != self._parse_generation(counters):
+            # Значение загружено до инвалидации, завершившейся раньше его записи
+            return None
+        return value, max(pttl, 0) / 1000.0
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, tags: Tuple[str, ...] = (),
+            generation: Optional[Tuple[int, ...]] = None) -> None:
+        redis_key = self._key(namespace, key)
+        if generation is None:
+            generation = self.generation(namespace, key)
+        ttl_ms = max(1, min(int(ttl * 1000), (self.GENERATION_TTL - self.TAG_SET_MIN_TTL) * 1000))
+        data = pickle.dumps((tuple(generation), value), protocol=pickle.HIGHEST_PROTOCOL)
+        commands = [('SET', redis_key, data, 'PX', ttl_ms)]
+        tag_ttl_ms = max(ttl_ms, self.TAG_SET_MIN_TTL * 1000)
+        for tag in tags:
+            tag_key = self._tag_key(namespace, tag)
+            commands.append(('SADD', tag_key, redis_key))
+            commands.append(('PEXPIRE', tag_key, tag_ttl_ms))
+        self._execute(*commands)
+
+    def _scan_delete(self, pattern: str) -> None:
+        """Удаляет ключи по шаблону, кроме счетчиков поколений (их сброс вернул бы старые поколения)"""
+        generation_prefix = self._generation_key().encode('utf-8')
+        cursor = '0'
+        while True:
+            cursor, keys = self._execute(('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500))[0]
+            keys = [key for key in keys if not key.startswith(generation_prefix)]
+            if keys:
+                self._execute(('DEL', *keys))
+            if cursor in (b'0', '0'):
+                return
+
+    def _bump_key_generations(self, redis_keys: Iterable[Any]) -> List[Tuple[Any, ...]]:
+        commands = []
+        for redis_key in redis_keys:
+            if isinstance(redis_key, bytes):
+                redis_key = redis_key.decode('utf-8')
+            generation_key = self._key_generation_key(redis_key)
+            commands.append(('INCR', generation_key))
+            commands.append(('PEXPIRE', generation_key, self.GENERATION_TTL * 1000))
+        return commands
+
+    def invalidate(self, op: str, namespace: Optional[str], key: Optional[str] = None,
+                   tags: Tuple[str, ...] = ()) -> None:
+        # Поколение увеличивается до удаления: значение, загруженное раньше, не будет прочитано,
+        # даже если его запись завершится после удаления
+        if op == 'delete':
+            redis_key = self._key(namespace, key)
+            self._execute(*self._bump_key_generations([redis_key]), ('DEL', redis_key))
+        elif op == 'clear':
+            self._execute(('INCR', self._generation_key(namespace or '')))
+            self._scan_delete(f'{self.prefix}{namespace}:*' if namespace else f'{self.prefix}*')
+            if namespace:
+                self._scan_delete(f'{self.prefix}tag:{namespace}:*')
+        elif op == 'tags':
+            tag_keys = [self._tag_key(namespace, tag) for tag in tags]
+            members = self._execute(*[('SMEMBERS', tag_key) for tag_key in tag_keys])
+            keys = {member for tag_members in members for member in (tag_members or [])}
+            self._execute(*self._bump_key_generations(keys), ('DEL', *tag_keys, *keys))
+        self._execute(('PUBLISH', self.channel, _encode_message(op, namespace, key, tags)))
+
+    def _subscribe_loop(self, handler: InvalidationHandler) -> None:
+        delay = 1
+        first = True
+        while not self._stop.is_set():
+            try:
+                self._subscriber = self._connect(timeout=5.0)
+                self._subscriber.command('SUBSCRIBE', self.channel)
+                self._subscriber.set_timeout(None)
+                delay = 1
+                if not first:
+                    # За время переподключения сообщения могли быть пропущены
+                    handler('reset', None, None, ())
+                first = False
+                while not self._stop.is_set():
+                    reply = self._subscriber.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        _dispatch_message(reply[2], handler)
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                first = False
+                logger.warning(f"Подписка на инвалидацию кэша в Redis прервана: {e}. Повтор через {delay} сек")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                if self._subscriber is not None:
+                    self._subscriber.close()
+                    self._subscriber = None
+
+    def listen(self, handler: InvalidationHandler) -> None:
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._subscribe_loop, args=(handler,),
+                                          name='cache-redis-listener', daemon=True)
+        self._listener.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._subscriber is not None:
+            self._subscriber.close()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_backend_from_env() -> CacheBackend:
+    """Создает хранилище кэша по переменной окружения CACHE_BACKEND"""
+    backend_type = os.environ.get('CACHE_BACKEND', 'memory').lower()
+    if backend_type == 'mmap':
+        path = os.environ.get('CACHE_MMAP_PATH') or os.path.join(tempfile.gettempdir(), 'service_bot_cache.mmap')
+        backend = MmapBackend(
+            path,
+            slots=int(os.environ.get('CACHE_MMAP_SLOTS', 4096)),
+            slot_size=int(os.environ.get('CACHE_MMAP_SLOT_SIZE', 4096))
+        )
+        logger.info(f"Общий кэш в файле {path}")
+        return backend
+    if backend_type == 'redis':
+        url = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        backend = RedisBackend(url, os.environ.get('CACHE_REDIS_PREFIX', 'service_bot:cache:'))
+        logger.info(f"Общий кэш в Redis {backend.host}:{backend.port}/{backend.db}")
+        return backend
+    if backend_type != 'memory':
+        logger.warning(f"Неизвестное хранилище кэша {backend_type}, используется память процесса")
+    return MemoryBackend()
@@ -0,0 +1,261 @@
+"""
+Компактное типизированное кодирование callback_data inline-кнопок
+
+Закодированные данные имеют вид "~" + base64url(байты) без выравнивания "=":
+    байт 0   - версия формата
+    байт 1   - ID действия
+    далее    - поля действия по его схеме
+
+Типы полей:
+    uint    - неотрицательное целое (varint, 1 байт для значений до 127)
+    int     - целое со знаком (zigzag + varint)
+    status  - код статуса заказа (индекс в ORDER_STATUSES, 1 байт)
+    cents   - денежная сумма с точностью до копеек (varint в копейках)
+    str     - строка UTF-8 (длина varint + байты)
+
+ID действий и порядок ORDER_STATUSES нельзя менять: кнопки в уже отправленных
+сообщениях должны декодироваться после обновления бота. Новые действия и статусы
+добавляются только в конец.
+"""
+
+import base64
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Callable, Dict, List, Tuple
+from config import ORDER_STATUSES
+
+# Признак закодированных данных (не встречается в текстовых callback_data)
+MARKER = '~'
+# Текущая версия формата
+VERSION = 1
+# Ограничение Telegram на размер callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+# Алфавит base64url без выравнивания (b64decode с altchars принимает также '+', '/' и '=')
+_PAYLOAD_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+_STATUS_CODES: List[str] = list(ORDER_STATUSES)
+_STATUS_INDEX: Dict[str, int] = {code: index for index, code in enumerate(_STATUS_CODES)}
+
+
+class CallbackDataError(ValueError):
+    """Ошибка кодирования или декодирования callback_data"""
+
+
+def _write_uvarint(value: int, out: bytearray) -> None:
+    if value < 0:
+        raise CallbackDataError(f"Ожидалось неотрицательное число, получено {value}")
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_uvarint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise CallbackDataError("Неожиданный конец данных")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise CallbackDataError("Слишком длинное число")
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CallbackDataError(f"Ожидалось целое число, получено {value!r}")
+
+
+def _encode_uint(value: Any, out: bytearray) -> None:
+    _write_uvarint(_to_int(value), out)
+
+
+def _encode_int(value: Any, out: bytearray) -> None:
+    value = _to_int(value)
+    _write_uvarint(value * 2 if value >= 0 else -value * 2 - 1, out)
+
+
+def _decode_int(data: bytes, pos: int) -> Tuple[int, int]:
+    value, pos = _read_uvarint(data, pos)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+
+
+def _encode_status(value: Any, out: bytearray) -> None:
+    index = _STATUS_INDEX.get(value)
+    if index is None:
+        raise CallbackDataError(f"Неизвестный статус заказа: {value}")
+    out.append(index)
+
+
+def _decode_status(data: bytes, pos: int) -> Tuple[str, int]:
+    if pos >= len(data):
+        raise CallbackDataError("Неожиданный конец данных")
+    index = data[pos]
+    if index >= len(_STATUS_CODES):
+        raise CallbackDataError(f"Неизвестный индекс статуса: {index}")
+    return _STATUS_CODES[index], pos + 1
+
+
+def _encode_cents(value: Any, out: bytearray) -> None:
+    try:
+        cents = (Decimal(str(value)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise CallbackDataError(f"Некорректная сумма: {value!r}")
+    _write_uvarint(int(cents), out)
+
+
+def _decode_cents(data: bytes, pos: int) -> Tuple[float, int]:
+    cents, pos = _read_uvarint(data, pos)
+    return cents / 100, pos
+
+
+def _encode_str(value: Any, out: bytearray) -> None:
+    raw = str(value).encode('utf-8')
+    _write_uvarint(len(raw), out)
+    out.extend(raw)
+
+
+def _decode_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_uvarint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise CallbackDataError("Неожиданный конец данных")
+    try:
+        return data[pos:end].decode('utf-8'), end
+    except UnicodeDecodeError as e:
+        raise CallbackDataError(f"Некорректная строка: {e}")
+
+
+# Тип поля -> (кодировщик, декодировщик)
+FIELD_TYPES: Dict[str, Tuple[Callable, Callable]] = {
+    'uint': (_encode_uint, _read_uvarint),
+    'int': (_encode_int, _decode_int),
+    'status': (_encode_status, _decode_status),
+    'cents': (_encode_cents, _decode_cents),
+    'str': (_encode_str, _decode_str),
+}
+
+
+class CallbackAction:
+    """Схема действия: ID, имя и поля (имя, тип)"""
+
+    def __init__(self, action_id: int, name: str, fields: List[Tuple[str, str]]):
+        self.action_id = action_id
+        self.name = name
+        self.fields = fields
+        # Кодировщики и декодировщики выбираются один раз при регистрации
+        self._encoders = [(field, FIELD_TYPES[type_name][0]) for field, type_name in fields]
+        self._decoders = [(field, FIELD_TYPES[type_name][1]) for field, type_name in fields]
+
+    def encode(self, values: Dict[str, Any]) -> bytes:
+        out = bytearray((VERSION, self.action_id))
+        for field, encoder in self._encoders:
+            if field not in values:
+                raise CallbackDataError(f"Не указано поле {field} для действия {self.name}")
+            encoder(values[field], out)
+        return bytes(out)
+
+    def decode(self, data: bytes, pos: int) -> Dict[str, Any]:
+        values = {}
+        for field, decoder in self._decoders:
+            values[field], pos = decoder(data, pos)
+        if pos != len(data):
+            raise CallbackDataError(f"Лишние данные в callback_data действия {self.name}")
+        return values
+
+
+_actions_by_id: Dict[int, CallbackAction] = {}
+_actions_by_name: Dict[str, CallbackAction] = {}
+
+
+def define_action(action_id: int, name: str, *fields: Tuple[str, str]) -> CallbackAction:
+    """
+    Регистрирует схему действия
+
+    Args:
+        action_id: Постоянный ID действия (0-255)
+        name: Имя действия, по которому маршрутизатор находит обработчик
+        fields: Пары (имя поля, тип поля)
+    """
+    if not 0 <= action_id <= 255:
+        raise CallbackDataError(f"ID действия должен быть в диапазоне 0-255: {action_id}")
+    if action_id in _actions_by_id or name in _actions_by_name:
+        raise CallbackDataError(f"Действие {name} ({action_id}) уже зарегистрировано")
+    for field, type_name in fields:
+        if type_name not in FIELD_TYPES:
+            raise CallbackDataError(f"Неизвестный тип поля {field}: {type_name}")
+    action = CallbackAction(action_id, name, list(fields))
+    _actions_by_id[action_id] = action
+    _actions_by_name[name] = action
+    return action
+
+
+def is_encoded(data: str) -> bool:
+    """Проверяет, закодированы ли callback_data этим модулем"""
+    return data.startswith(MARKER)
+
+
+def encode(name: str, **values: Any) -> str:
+    """
+    Кодирует действие и его поля в callback_data
+
+    Raises:
+        CallbackDataError: если действие неизвестно, поле не указано
+                           или результат длиннее 64 байт
+    """
+    action = _actions_by_name.get(name)
+    if action is None:
+        raise CallbackDataError(f"Неизвестное действие: {name}")
+    payload = base64.urlsafe_b64encode(action.encode(values)).rstrip(b'=').decode('ascii')
+    data = MARKER + payload
+    if len(data) > MAX_CALLBACK_DATA_BYTES:
+        raise CallbackDataError(
+            f"callback_data действия {name} длиннее {MAX_CALLBACK_DATA_BYTES} байт: {len(data)}"
+        )
+    return data
+
+
+def decode(data: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Декодирует callback_data
+
+    Returns:
+        (имя действия, значения полей)
+
+    Raises:
+        CallbackDataError: если данные повреждены, версия или действие неизвестны
+    """
+    if not data.startswith(MARKER):
+        raise CallbackDataError("callback_data не закодированы")
+    payload = data[len(MARKER):]
+    if not _PAYLOAD_PATTERN.fullmatch(payload):
+        raise CallbackDataError("callback_data содержат символы вне алфавита base64url")
+    try:
+        raw = base64.b64decode(payload + '=' * (-len(payload) % 4), altchars=b'-_', validate=True)
+    except ValueError as e:
+        raise CallbackDataError(f"Некорректный base64: {e}")
+    if len(raw) < 2:
+        raise CallbackDataError("Слишком короткие callback_data")
+    if raw[0] != VERSION:
+        raise CallbackDataError(f"Неподдерживаемая версия callback_data: {raw[0]}")
+    action = _actions_by_id.get(raw[1])
+    if action is None:
+        raise CallbackDataError(f"Неизвестный ID действия: {raw[1]}")
+    return action.name, action.decode(raw, 2)
+
+
+# Действия бота (ID не менять)
+define_action(1, 'status', ('order_id', 'uint'), ('status', 'status'))
+define_action(2, 'assign', ('order_id', 'uint'), ('technician_id', 'uint'))
+define_action(3, 'set_cost', ('order_id', 'uint'), ('cost', 'cents'))
+define_action(4, 'orders_page', ('direction', 'uint'), ('created_us', 'uint'), ('order_id', 'uint'))
+define_action(5, 'logs_page', ('direction', 'uint'), ('created_us', 'uint'), ('log_id', 'uint'))
+define_action(6, 'search_page', ('offset', 'uint'), ('query', 'str'))
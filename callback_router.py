@@ -0,0 +1,307 @@
+"""
+Маршрутизатор callback-запросов inline-кнопок
+
+Маршруты описываются шаблонами callback_data, части которых разделены "_":
+    "main_menu"                              - точное совпадение
+    "order_{order_id:int}"                   - параметр с преобразованием типа
+    "status_{order_id:int}_{status:rest}"    - остаток строки целиком (статус может содержать "_")
+
+Шаблоны компилируются в префиксное дерево по частям callback_data, поэтому поиск
+обработчика занимает время, пропорциональное длине callback_data, а не числу маршрутов.
+При неоднозначности точная часть шаблона имеет приоритет над параметром
+("delete_user_menu" раньше "delete_user_{user_id:int}"), параметры проверяются в порядке
+int, float, str, затем rest.
+
+Маршрут может также принимать компактные callback_data из callback_codec: для этого при
+регистрации указывается имя действия кодека, поля которого передаются обработчику
+как параметры.
+"""
+
+import re
+import math
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from logger import get_component_logger
+import callback_codec
+
+# Настройка логирования
+logger = get_component_logger('callback_router')
+
+
+def _to_float(value: str) -> float:
+    result = float(value)
+    if not math.isfinite(result):
+        raise ValueError(f"Недопустимое число: {value}")
+    return result
+
+
+# Типы параметров в порядке проверки
+PARAM_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    'int': int,
+    'float': _to_float,
+    'str': str,
+}
+REST_PARAM = 'rest'
+
+
+class CallbackRouteError(ValueError):
+    """Ошибка в шаблоне маршрута"""
+
+
+class CallbackContext:
+    """Данные callback-запроса, передаваемые обработчику маршрута"""
+
+    def __init__(self, call, data: Optional[str] = None, user: Optional[Dict] = None):
+        self.call = call
+        self.data = call.data if data is None else data
+        self.user_id = call.from_user.id
+        message = getattr(call, 'message', None)
+        self.chat_id = message.chat.id if message is not None else self.user_id
+        self.message_id = message.message_id if message is not None else None
+        self.user = user
+
+
+class RouteStats:
+    """Счетчики вызовов маршрута"""
+
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': round(self.total_time, 6),
+            'max_time': round(self.max_time, 6),
+            'avg_time': round(self.total_time / self.calls, 6) if self.calls else 0.0
+        }
+
+
+class CallbackRoute:
+    """Зарегистрированный маршрут: шаблон, обработчик и счетчики"""
+
+    __slots__ = ('pattern', 'handler', 'stats')
+
+    def __init__(self, pattern: str, handler: Callable):
+        self.pattern = pattern
+        self.handler = handler
+        self.stats = RouteStats()
+
+
+class _Node:
+    """Узел префиксного дерева маршрутов"""
+
+    __slots__ = ('literals', 'params', 'rest', 'route')
+
+    def __init__(self):
+        self.literals: Dict[str, '_Node'] = {}
+        self.params: List[Tuple[str, str, '_Node']] = []  # (тип, имя параметра, узел)
+        self.rest: Optional[Tuple[str, CallbackRoute]] = None
+        self.route: Optional[CallbackRoute] = None
+
+    def param_child(self, type_name: str, name: str) -> '_Node':
+        for existing_type, existing_name, child in self.params:
+            if existing_type == type_name:
+                if existing_name != name:
+                    raise CallbackRouteError(
+                        f"Параметр типа {type_name} в этой позиции уже называется {existing_name}, а не {name}"
+                    )
+                return child
+        child = _Node()
+        self.params.append((type_name, name, child))
+        order = list(PARAM_CONVERTERS)
+        self.params.sort(key=lambda item: order.index(item[0]))
+        return child
+
+
+class CallbackRouter:
+    """Маршрутизатор callback_data на основе префиксного дерева"""
+
+    def __init__(self, separator: str = '_'):
+        self.separator = separator
+        self._root = _Node()
+        self._static: Dict[str, CallbackRoute] = {}  # Шаблоны без параметров
+        self._routes: List[CallbackRoute] = []
+        self._actions: Dict[str, CallbackRoute] = {}  # Имя действия callback_codec -> маршрут
+        self._stats_lock = threading.Lock()
+        self.unmatched = 0
+
+    def _split_pattern(self, pattern: str) -> List[str]:
+        """Делит шаблон на части по разделителю, не разрывая {параметры} с "_" в имени"""
+        parts = ['']
+        for piece in re.split(r'(\{[^{}]*\})', pattern):
+            if piece.startswith('{'):
+                parts[-1] += piece
+                continue
+            chunks = piece.split(self.separator)
+            parts[-1] += chunks[0]
+            parts.extend(chunks[1:])
+        return parts
+
+    def _parse_part(self, part: str) -> Tuple[Optional[str], Optional[str]]:
+        """Возвращает (тип, имя) для параметра или (None, None) для точной части"""
+        if not (part.startswith('{') and part.endswith('}')):
+            if '{' in part or '}' in part:
+                raise CallbackRouteError(f"Некорректная часть шаблона: {part}")
+            return None, None
+        name, _, type_name = part[1:-1].partition(':')
+        type_name = type_name or 'str'
+        if not name.isidentifier():
+            raise CallbackRouteError(f"Некорректное имя параметра: {name}")
+        if type_name not in PARAM_CONVERTERS and type_name != REST_PARAM:
+            raise CallbackRouteError(f"Неизвестный тип параметра: {type_name}")
+        return type_name, name
+
+    def add_route(self, pattern: str, handler: Callable, action: Optional[str] = None) -> CallbackRoute:
+        """
+        Регистрирует обработчик для шаблона callback_data.
+        Обработчик вызывается как handler(ctx, **параметры).
+        Если указано action, тот же обработчик получает закодированные callback_data
+        этого действия callback_codec (поля действия должны совпадать с параметрами шаблона).
+        """
+        route = CallbackRoute(pattern, handler)
+        if action is not None:
+            if action in self._actions:
+                raise CallbackRouteError(f"Действие {action} уже обрабатывается маршрутом {self._actions[action].pattern}")
+            self._actions[action] = route
+        parts = self._split_pattern(pattern)
+        node = self._root
+        has_params = False
+
+        for index, part in enumerate(parts):
+            type_name, name = self._parse_part(part)
+            if type_name is None:
+                node = node.literals.setdefault(part, _Node())
+                continue
+            has_params = True
+            if type_name == REST_PARAM:
+                if index != len(parts) - 1:
+                    raise CallbackRouteError(f"Параметр rest должен быть последним: {pattern}")
+                if node.rest is not None:
+                    raise CallbackRouteError(f"Маршрут {pattern} совпадает с {node.rest[1].pattern}")
+                node.rest = (name, route)
+                break
+            node = node.param_child(type_name, name)
+        else:
+            if node.route is not None:
+                raise CallbackRouteError(f"Маршрут {pattern} совпадает с {node.route.pattern}")
+            node.route = route
+
+        if not has_params:
+            self._static[pattern] = route
+        self._routes.append(route)
+        return route
+
+    def route(self, pattern: str, action: Optional[str] = None) -> Callable:
+        """Декоратор для регистрации обработчика маршрута"""
+        def decorator(handler: Callable) -> Callable:
+            self.add_route(pattern, handler, action)
+            return handler
+        return decorator
+
+    def _match(self, node: _Node, parts: List[str], index: int,
+               params: Dict[str, Any]) -> Optional[CallbackRoute]:
+        if index == len(parts):
+            return node.route
+
+        part = parts[index]
+        child = node.literals.get(part)
+        if child is not None:
+            route = self._match(child, parts, index + 1, params)
+            if route is not None:
+                return route
+
+        for type_name, name, child in node.params:
+            try:
+                params[name] = PARAM_CONVERTERS[type_name](part)
+            except ValueError:
+                continue
+            route = self._match(child, parts, index + 1, params)
+            if route is not None:
+                return route
+            del params[name]
+
+        if node.rest is not None:
+            name, route = node.rest
+            params[name] = self.separator.join(parts[index:])
+            return route
+        return None
+
+    def resolve(self, data: str) -> Optional[Tuple[CallbackRoute, Dict[str, Any]]]:
+        """
+        Находит маршрут для callback_data
+
+        Returns:
+            (маршрут, параметры) или None, если маршрут не найден
+        """
+        route = self._static.get(data)
+        if route is not None:
+            return route, {}
+        if callback_codec.is_encoded(data):
+            try:
+                action, params = callback_codec.decode(data)
+            except callback_codec.CallbackDataError as e:
+                logger.warning(f"Не удалось декодировать callback_data {data!r}: {e}")
+                return None
+            route = self._actions.get(action)
+            return (route, params) if route is not None else None
+        params: Dict[str, Any] = {}
+        route = self._match(self._root, data.split(self.separator), 0, params)
+        if route is None:
+            return None
+        return route, params
+
+    def dispatch(self, ctx: CallbackContext) -> bool:
+        """
+        Вызывает обработчик маршрута для ctx.data
+
+        Returns:
+            bool: True, если маршрут найден, иначе False
+        """
+        resolved = self.resolve(ctx.data)
+        if resolved is None:
+            with self._stats_lock:
+                self.unmatched += 1
+            logger.debug(f"Маршрут для callback_data не найден: {ctx.data}")
+            return False
+
+        route, params = resolved
+        self.call_route(ctx, route, params)
+        return True
+
+    def call_route(self, ctx: CallbackContext, route: CallbackRoute, params: Dict[str, Any]) -> None:
+        """Вызывает обработчик найденного через resolve() маршрута с учетом времени обработки"""
+        started = time.perf_counter()
+        failed = False
+        try:
+            route.handler(ctx, **params)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                stats = route.stats
+                stats.calls += 1
+                stats.total_time += elapsed
+                if elapsed > stats.max_time:
+                    stats.max_time = elapsed
+                if failed:
+                    stats.errors += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики вызовов и время обработки по маршрутам"""
+        with self._stats_lock:
+            return {
+                'unmatched': self.unmatched,
+                'routes': {
+                    route.pattern: route.stats.to_dict()
+                    for route in self._routes if route.stats.calls
+                }
+            }
@@ -1,18 +1,27 @@
 import os
+import re
 import datetime
-import sqlite3
-import psycopg2
-from psycopg2.extras import DictCursor
-from typing import Optional, List, Dict, Any, Callable, Union
+from psycopg2.extras import DictCursor, execute_values
+from typing import Optional, List, Dict, Any, Callable, Union, Iterable, Iterator
 import functools
+import itertools
+import threading
 from logger import get_component_logger, log_function_call
-from cache import cached, invalidate_cache_on_update, cache_clear
+from cache import cached, cache_clear, cache_invalidate_tags, cache_get, cache_fill, cache_snapshot, MISSING
+from db_pool import PostgresConnectionPool, SQLiteConnectionPool
+from models import UserStateSnapshot, Page, OrderView, ClientHistory
+from phone_numbers import normalize_phone
+from migrations import run_migrations
+from activity_log_sink import get_activity_log_sink, flush_activity_logs
 
 # Настройка логирования
 logger = get_component_logger('database')
 
-def is_postgres():
-    """Проверяет, используется ли PostgreSQL"""
+# Путь к файлу базы данных SQLite
+SQLITE_DATABASE_PATH = 'service_bot.db'
+
+def _detect_postgres_environment() -> bool:
+    """Проверяет по переменным окружения, нужно ли использовать PostgreSQL"""
     # Проверяем специальную переменную окружения RENDER, которая есть только в Render
     # В Render она имеет значение 'true'
     if os.environ.get('RENDER') == 'true':
@@ -22,41 +31,145 @@ def is_postgres():
         return True
     return False  # В локальной среде Replit используем SQLite
 
+class DatabaseBackend:
+    """
+    Параметры используемой базы данных, определяемые один раз при запуске:
+    диалект, стиль placeholder, литералы логических значений,
+    способ получения ID вставленной записи и пул соединений
+    """
+
+    def __init__(self, dialect: str, pool):
+        self.dialect = dialect
+        self.pool = pool
+        self.is_postgres = dialect == 'postgresql'
+        self.placeholder = '%s' if self.is_postgres else '?'
+        self.true_literal = 'TRUE' if self.is_postgres else '1'
+        self.false_literal = 'FALSE' if self.is_postgres else '0'
+
+    def placeholders(self, count: int) -> str:
+        """Возвращает список placeholder'ов через запятую для VALUES (...)"""
+        return ', '.join([self.placeholder] * count)
+
+    def insert_returning_id(self, cursor, sql: str, params: tuple, id_column: str) -> Optional[int]:
+        """
+        Выполняет INSERT и возвращает ID созданной записи:
+        в PostgreSQL через RETURNING в том же запросе, в SQLite через cursor.lastrowid
+        """
+        if self.is_postgres:
+            cursor.execute(f"{sql} RETURNING {id_column}", params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+        cursor.execute(sql, params)
+        return cursor.lastrowid
+
+    def upsert(self, cursor, table: str, values: Dict[str, Any], conflict_columns: List[str],
+               update_columns: List[str] = (), update_expressions: Optional[Dict[str, str]] = None,
+               insert_expressions: Optional[Dict[str, str]] = None,
+               returning: Optional[List[str]] = None) -> Optional[tuple]:
+        """
+        Вставляет запись или обновляет существующую одним запросом
+        INSERT ... ON CONFLICT ... DO UPDATE (PostgreSQL и SQLite 3.35+)
+        
+        Args:
+            cursor: Курсор БД
+            table: Таблица
+            values: Столбец -> значение для вставки (передаются параметрами)
+            conflict_columns: Столбцы уникального ключа
+            update_columns: Столбцы, которые при конфликте берут вставляемое значение
+            update_expressions: Столбец -> SQL-выражение, присваиваемое при конфликте
+            insert_expressions: Столбец -> SQL-выражение, вычисляемое при вставке
+                                (например, подзапрос), без параметров
+            returning: Столбцы, возвращаемые из вставленной или обновленной записи
+            
+        Returns:
+            Optional[tuple]: Строка RETURNING, если returning указан
+        """
+        columns = list(values) + list(insert_expressions or {})
+        select_list = [self.placeholder] * len(values) + list((insert_expressions or {}).values())
+        if insert_expressions:
+            # INSERT ... SELECT: в SQLite перед ON CONFLICT обязателен WHERE
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(select_list)} WHERE 1 = 1"
+        else:
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(select_list)})"
+        
+        assignments = [f"{column} = excluded.{column}" for column in update_columns]
+        assignments += [f"{column} = {expression}" for column, expression in (update_expressions or {}).items()]
+        sql += f" ON CONFLICT ({', '.join(conflict_columns)}) "
+        sql += f"DO UPDATE SET {', '.join(assignments)}" if assignments else "DO NOTHING"
+        if returning:
+            sql += f" RETURNING {', '.join(returning)}"
+        
+        cursor.execute(sql, tuple(values.values()))
+        return cursor.fetchone() if returning else None
+
+_backend: Optional[DatabaseBackend] = None
+_backend_lock = threading.Lock()
+
+def _create_backend() -> DatabaseBackend:
+    """Определяет тип базы данных и создает пул соединений"""
+    if _detect_postgres_environment():
+        try:
+            logger.info("Подключение к PostgreSQL в среде Render...")
+            pool = PostgresConnectionPool(
+                os.environ.get('DATABASE_URL'),
+                min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+                max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                health_check_interval=float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+            )
+            return DatabaseBackend('postgresql', pool)
+        except Exception as e:
+            logger.error(f"Ошибка при подключении к базе данных: {e}")
+            # В случае ошибки подключения к PostgreSQL, используем SQLite
+            logger.warning("Использую запасной вариант - SQLite")
+    else:
+        logger.info("Подключение к SQLite в локальной среде...")
+    return DatabaseBackend('sqlite', SQLiteConnectionPool(SQLITE_DATABASE_PATH))
+
+def get_backend() -> DatabaseBackend:
+    """Возвращает параметры базы данных, определяя их при первом обращении"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+def is_postgres():
+    """Проверяет, используется ли PostgreSQL"""
+    return get_backend().is_postgres
+
 def get_placeholder():
     """Возвращает placeholder для SQL параметров в зависимости от типа БД"""
-    global current_connection_is_postgres
-    return '%s' if current_connection_is_postgres else '?'
-
-# Переменная для отслеживания типа текущего подключения
-# True - PostgreSQL, False - SQLite
-current_connection_is_postgres = False
+    return get_backend().placeholder
 
 def get_connection():
-    """Получение соединения с базой данных (PostgreSQL или SQLite)"""
-    global current_connection_is_postgres
-    
+    """
+    Получение соединения с базой данных (PostgreSQL или SQLite) из пула.
+    Вызов close() у полученного соединения возвращает его в пул.
+    """
     try:
-        # Проверяем, нужно ли использовать PostgreSQL
-        if is_postgres():
-            # В Render или если указана переменная DATABASE_URL используем PostgreSQL
-            logger.info("Подключение к PostgreSQL в среде Render...")
-            database_url = os.environ.get('DATABASE_URL')
-            conn = psycopg2.connect(database_url)
-            current_connection_is_postgres = True
-            return conn
-        else:
-            # В локальной среде Replit используем SQLite
-            logger.info("Подключение к SQLite в локальной среде...")
-            conn = sqlite3.connect('service_bot.db')
-            current_connection_is_postgres = False
-            return conn
+        return get_backend().pool.acquire()
     except Exception as e:
         logger.error(f"Ошибка при подключении к базе данных: {e}")
-        # В случае ошибки подключения к PostgreSQL, используем SQLite
-        logger.warning("Использую запасной вариант - SQLite")
-        conn = sqlite3.connect('service_bot.db')
-        current_connection_is_postgres = False
-        return conn
+        raise
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Возвращает метрики пула соединений: размер, занятые и свободные соединения,
+    количество и время ожиданий свободного соединения
+    
+    Returns:
+        Dict: Метрики пула, если он уже создан
+    """
+    if _backend is None:
+        return {}
+    return _backend.pool.get_stats()
+
+def close_connection_pools() -> None:
+    """Закрывает свободные соединения пула (при завершении работы)"""
+    if _backend is not None:
+        _backend.pool.close_all()
         
 def check_database_connection() -> bool:
     """Проверка подключения к базе данных
@@ -68,14 +181,7 @@ def check_database_connection() -> bool:
         conn = get_connection()
         cursor = conn.cursor()
         
-        # Проверяем, какой тип соединения используется - PostgreSQL или SQLite
-        if os.environ.get('DATABASE_URL'):
-            # PostgreSQL использует %s для параметров
-            cursor.execute("SELECT 1")
-        else:
-            # SQLite использует ? для параметров
-            cursor.execute("SELECT 1")
-            
+        cursor.execute("SELECT 1")
         result = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -86,12 +192,74 @@ def check_database_connection() -> bool:
         logger.error(f"Ошибка при проверке подключения к базе данных: {e}")
         return False
 
+# Количество строк, получаемых за одно обращение при потоковом чтении (iter_query)
+STREAM_BATCH_SIZE = int(os.environ.get('DB_STREAM_BATCH_SIZE', 500))
+
+# Счетчик имен серверных курсоров PostgreSQL
+_stream_cursor_ids = itertools.count(1)
+
+def _row_mapper(description) -> Callable[[tuple], Dict]:
+    """
+    Создает функцию преобразования строки результата в словарь.
+    Имена столбцов вычисляются один раз для курсора, а не для каждой строки.
+    """
+    columns = tuple(column[0] for column in description)
+    return lambda row: dict(zip(columns, row))
+
+def _fetch_dicts(cursor) -> List[Dict]:
+    """Возвращает строки результата выполненного запроса в виде словарей"""
+    to_dict = _row_mapper(cursor.description)
+    return [to_dict(row) for row in cursor]
+
+def iter_query(sql: str, params: tuple = (), batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Потоковое чтение результата запроса: строки получаются пачками и отдаются по одной,
+    поэтому память не зависит от размера таблицы. В PostgreSQL используется именованный
+    (серверный) курсор, в SQLite - fetchmany.
+    
+    Соединение занято до конца итерации. Если итерация прерывается досрочно, генератор
+    нужно закрыть (close() или contextlib.closing), чтобы вернуть соединение в пул.
+    
+    Args:
+        sql: Текст запроса
+        params: Параметры запроса
+        batch_size: Размер пачки строк (по умолчанию STREAM_BATCH_SIZE)
+        
+    Yields:
+        Dict: Строка результата
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    backend = get_backend()
+    conn = get_connection()
+    try:
+        if backend.is_postgres:
+            cursor = conn.cursor(name=f"stream_{next(_stream_cursor_ids)}")
+            cursor.itersize = batch_size
+        else:
+            cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchmany(batch_size)
+            # У серверного курсора description доступен только после первого получения строк
+            to_dict = _row_mapper(cursor.description) if rows else None
+            while rows:
+                for row in rows:
+                    yield to_dict(row)
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+    except Exception as e:
+        logger.error(f"Ошибка при потоковом чтении запроса: {e}")
+        raise
+    finally:
+        conn.close()
+
 @log_function_call(logger)
 def initialize_database():
     """Инициализация базы данных"""
     conn = get_connection()
     cursor = conn.cursor()
-    use_postgres = is_postgres()
+    use_postgres = get_backend().is_postgres
 
     # Разный синтаксис для PostgreSQL и SQLite
     if use_postgres:
@@ -225,7 +393,7 @@ def initialize_database():
     """)
 
     # Разные SQL-запросы в зависимости от типа базы данных
-    if is_postgres:
+    if use_postgres:
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS problem_templates (
             template_id SERIAL PRIMARY KEY,
@@ -249,7 +417,7 @@ def initialize_database():
         """)
 
     # Разные SQL-запросы в зависимости от типа базы данных
-    if is_postgres:
+    if use_postgres:
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS activity_logs (
             log_id SERIAL PRIMARY KEY,
@@ -274,51 +442,44 @@ def initialize_database():
         )
         """)
 
-
     conn.commit()
-    conn.close()
+
+    # Таблицы и индексы, добавленные после создания схемы, применяются миграциями
+    try:
+        run_migrations(conn, get_backend())
+    finally:
+        conn.close()
     logger.info("База данных инициализирована")
 
 def save_user(user_id: int, first_name: str, last_name: str = None, username: str = None) -> bool:
-    """Сохранение информации о пользователе"""
+    """
+    Сохранение информации о пользователе одним запросом: новый пользователь создается
+    (первый пользователь в системе - подтвержденным администратором), у существующего
+    обновляются только личные данные, роль и статус подтверждения сохраняются
+    """
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
 
     try:
-        # Проверяем, существует ли пользователь и сохраняем текущие значения
-        cursor.execute(f"""
-        SELECT role, is_approved FROM users WHERE user_id = {placeholder}
-        """, (user_id,))
-        existing_user = cursor.fetchone()
-        
-        if existing_user:
-            # Обновляем только личные данные, сохраняя роль и статус подтверждения
-            cursor.execute(f"""
-            UPDATE users SET username = {placeholder}, first_name = {placeholder}, last_name = {placeholder} 
-            WHERE user_id = {placeholder}
-            """, (username, first_name, last_name, user_id))
-            logger.info(f"Обновлены данные существующего пользователя {user_id} с сохранением роли и статуса")
-        else:
-            # Создаем нового пользователя
-            cursor.execute(f"""
-            INSERT INTO users (user_id, username, first_name, last_name, role, is_approved)
-            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, 'user', FALSE)
-            """, (user_id, username, first_name, last_name))
-            logger.info(f"Создан новый пользователь {user_id}")
-            
-            # Если это первый пользователь, делаем его администратором
-            cursor.execute("SELECT COUNT(*) FROM users")
-            if cursor.fetchone()[0] == 1:
-                cursor.execute(f"""
-                UPDATE users SET role = 'admin', is_approved = TRUE
-                WHERE user_id = {placeholder}
-                """, (user_id,))
-                logger.info(f"Первый пользователь {user_id} назначен администратором")
-
+        row = backend.upsert(
+            cursor, 'users',
+            {'user_id': user_id, 'username': username, 'first_name': first_name, 'last_name': last_name},
+            conflict_columns=['user_id'],
+            update_columns=['username', 'first_name', 'last_name'],
+            # Проверка существования любой строки вместо COUNT(*) по всей таблице
+            insert_expressions={
+                'role': "CASE WHEN EXISTS (SELECT 1 FROM users) THEN 'user' ELSE 'admin' END",
+                'is_approved': "NOT EXISTS (SELECT 1 FROM users)"
+            },
+            returning=['role']
+        )
         conn.commit()
+        role = row[0] if row else None
+        logger.info(f"Сохранены данные пользователя {user_id} (роль {role})")
+        # Список роли пользователя инвалидируется и для нового, и для существующего пользователя
+        invalidate_user_cache(user_id, role)
         return True
     except Exception as e:
         logger.error(f"Ошибка при сохранении пользователя: {e}")
@@ -326,18 +487,54 @@ def save_user(user_id: int, first_name: str, last_name: str = None, username: st
     finally:
         conn.close()
 
-@cached('users')
-def get_user(user_id: int) -> Optional[Dict]:
+# Сколько секунд помнить, что пользователь не зарегистрирован: сообщения незарегистрированных
+# пользователей не приводят к запросу в БД каждый раз. Регистрация сбрасывает эту запись.
+USER_NOT_FOUND_TTL = 30
+
+# Поля пользователя, возвращаемые get_user, get_users_by_role и get_users_many
+_USER_COLUMNS = "user_id, username, first_name, last_name, role, is_approved"
+
+def _user_from_row(row) -> Dict:
+    return {
+        'user_id': row[0],
+        'username': row[1],
+        'first_name': row[2],
+        'last_name': row[3],
+        'role': row[4],
+        'is_approved': bool(row[5])
+    }
+
+def _user_tag(user_id: int) -> str:
+    """Тег кэша, которым помечены запись пользователя и списки, содержащие пользователя"""
+    return f'user:{user_id}'
+
+def _users_role_tag(role: str) -> str:
+    """Тег кэша списка пользователей с ролью"""
+    return f'users_role:{role}'
+
+def invalidate_user_cache(user_id: int, new_role: Optional[str] = None) -> None:
     """
-    Получение информации о пользователе с использованием кэширования.
-    Кэш обновляется автоматически при изменении данных пользователя.
+    Инвалидирует кэш пользователя: его запись, списки по ролям, в которые он входит,
+    и список техников. Если пользователь получил роль (или создан), инвалидируется
+    и список этой роли.
     
     Args:
-        user_id: ID пользователя в Telegram
-        
-    Returns:
-        Dict: Словарь с информацией о пользователе или None, если пользователь не найден
+        user_id: ID измененного пользователя
+        new_role: Новая роль пользователя
     """
+    tags = [_user_tag(user_id)]
+    if new_role:
+        tags.append(_users_role_tag(new_role))
+    cache_invalidate_tags('users', *tags)
+    # Карточки заказов, в которых пользователь - диспетчер или мастер
+    cache_invalidate_tags('orders', _user_tag(user_id))
+    cache_clear('technicians')
+
+# Запись пользователя (и отметка "не найден") помечена тегом пользователя, поэтому
+# invalidate_user_cache сбрасывает ее при любом изменении пользователя
+@cached('users', negative_ttl=USER_NOT_FOUND_TTL, tags=lambda user, user_id: [_user_tag(user_id)])
+def _load_user(user_id: int) -> Optional[Dict]:
+    """Загружает пользователя из БД; ошибки БД пробрасываются, чтобы не кэшировать их как отсутствие пользователя"""
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -346,51 +543,134 @@ def get_user(user_id: int) -> Optional[Dict]:
 
     try:
         cursor.execute(f"""
-        SELECT user_id, username, first_name, last_name, role, is_approved
+        SELECT {_USER_COLUMNS}
         FROM users WHERE user_id = {placeholder}
         """, (user_id,))
 
         user = cursor.fetchone()
         if user:
-            return {
-                'user_id': user[0],
-                'username': user[1],
-                'first_name': user[2],
-                'last_name': user[3],
-                'role': user[4],
-                'is_approved': bool(user[5])
-            }
+            return _user_from_row(user)
         return None
+    finally:
+        conn.close()
+
+def get_user(user_id: int) -> Optional[Dict]:
+    """
+    Получение информации о пользователе с использованием кэширования.
+    Кэш обновляется автоматически при изменении данных пользователя,
+    отсутствие пользователя кэшируется на USER_NOT_FOUND_TTL секунд.
+    
+    Args:
+        user_id: ID пользователя в Telegram
+        
+    Returns:
+        Dict: Словарь с информацией о пользователе или None, если пользователь не найден
+    """
+    try:
+        return _load_user(user_id)
     except Exception as e:
         logger.error(f"Ошибка при получении пользователя {user_id}: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_user_role(user_id: int) -> Optional[str]:
     """Получение роли пользователя"""
     user = get_user(user_id)
     return user['role'] if user else None
 
+@cached('users', lambda role: f'role_{role}',
+        tags=lambda users, role: [_users_role_tag(role)] + [_user_tag(user['user_id']) for user in users])
+def get_users_by_role(role: str) -> List[Dict]:
+    """
+    Получение пользователей с указанной ролью одним запросом (по индексу idx_users_role_approved).
+    Список кэшируется и инвалидируется при изменении роли, подтверждении и удалении
+    входящих в него пользователей.
+    
+    Args:
+        role: Роль пользователя (ROLES['admin'] и т.д.)
+        
+    Returns:
+        List[Dict]: Пользователи с ролью в порядке регистрации
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    backend = get_backend()
+    
+    try:
+        cursor.execute(
+            f"SELECT {_USER_COLUMNS} FROM users WHERE role = {backend.placeholder} ORDER BY created_at, user_id",
+            (role,)
+        )
+        return [_user_from_row(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def get_users_many(user_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Получение нескольких пользователей: найденные в кэше берутся из него,
+    остальные загружаются одним запросом и сохраняются в кэш
+    
+    Args:
+        user_ids: ID пользователей
+        
+    Returns:
+        Dict[int, Dict]: ID пользователя -> информация о нем (ненайденные пропускаются)
+    """
+    users = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        cached_user = cache_get('users', str(user_id), MISSING)
+        if cached_user is MISSING:
+            missing.append(user_id)
+        elif cached_user is not None:
+            users[user_id] = cached_user
+    if not missing:
+        return users
+    
+    # Поколения кэша запоминаются до запроса: значения, загруженные до изменения
+    # пользователя в другом потоке или процессе, не сохраняются
+    snapshot = cache_snapshot('users', [str(user_id) for user_id in missing])
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    backend = get_backend()
+    
+    try:
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            cursor.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE user_id IN ({backend.placeholders(len(chunk))})",
+                tuple(chunk)
+            )
+            for row in cursor.fetchall():
+                users[row[0]] = _user_from_row(row)
+        for user_id in missing:
+            user = users.get(user_id)
+            cache_fill('users', str(user_id), user, None if user is not None else USER_NOT_FOUND_TTL, snapshot)
+        return users
+    except Exception as e:
+        logger.error(f"Ошибка при получении пользователей {missing}: {e}")
+        return users
+    finally:
+        conn.close()
+
 def get_all_users():
     """Получение всех пользователей"""
     conn = get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT * FROM users")
-        users = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        user_list = []
-        for user_data in users:
-            user_dict = {column_names[i]: user_data[i] for i in range(len(column_names))}
-            user_list.append(user_dict)
-        return user_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении всех пользователей: {e}")
         return []
     finally:
         conn.close()
 
+def iter_all_users(batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """Потоковое получение всех пользователей (см. iter_query)"""
+    return iter_query("SELECT * FROM users ORDER BY user_id", (), batch_size)
+
 @cached('technicians')
 def get_technicians():
     """
@@ -403,20 +683,13 @@ def get_technicians():
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT * FROM users WHERE role = 'technician' AND is_approved = TRUE")
-        technicians = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        technician_list = []
-        for technician_data in technicians:
-            technician_dict = {column_names[i]: technician_data[i] for i in range(len(column_names))}
-            technician_list.append(technician_dict)
-        return technician_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении всех техников: {e}")
         return []
     finally:
         conn.close()
 
-@invalidate_cache_on_update('users')
 def update_user_role(user_id: int, role: str) -> bool:
     """
     Обновление роли пользователя с автоматической инвалидацией кэша.
@@ -437,6 +710,7 @@ def update_user_role(user_id: int, role: str) -> bool:
     try:
         cursor.execute(f"UPDATE users SET role = {placeholder} WHERE user_id = {placeholder}", (role, user_id))
         conn.commit()
+        invalidate_user_cache(user_id, role)
         logger.info(f"Роль пользователя {user_id} успешно обновлена на {role}")
         return True
     except Exception as e:
@@ -450,15 +724,12 @@ def approve_user(user_id: int) -> bool:
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
     
     try:
-        if is_postgres():
-            cursor.execute(f"UPDATE users SET is_approved = TRUE WHERE user_id = {placeholder}", (user_id,))
-        else:
-            cursor.execute(f"UPDATE users SET is_approved = 1 WHERE user_id = {placeholder}", (user_id,))
+        cursor.execute(f"UPDATE users SET is_approved = {backend.true_literal} WHERE user_id = {backend.placeholder}", (user_id,))
         conn.commit()
+        invalidate_user_cache(user_id)
         return True
     except Exception as e:
         logger.error(f"Ошибка при подтверждении пользователя: {e}")
@@ -477,6 +748,7 @@ def reject_user(user_id: int) -> bool:
     try:
         cursor.execute(f"DELETE FROM users WHERE user_id = {placeholder}", (user_id,))
         conn.commit()
+        invalidate_user_cache(user_id)
         return True
     except Exception as e:
         logger.error(f"Ошибка при отклонении пользователя: {e}")
@@ -496,18 +768,10 @@ def is_user_approved(user_id: int) -> bool:
         cursor.execute(f"SELECT is_approved FROM users WHERE user_id = {placeholder}", (user_id,))
         approved = cursor.fetchone()
         
-        # В PostgreSQL и SQLite логические значения представлены по-разному
-        if approved:
-            if is_postgres():
-                # В PostgreSQL логические значения уже преобразованы в bool
-                result = approved[0]
-            else:
-                # В SQLite логические значения хранятся как 0 и 1
-                result = bool(approved[0])
-        else:
-            result = False
+        # В SQLite логические значения хранятся как 0 и 1, в PostgreSQL уже преобразованы в bool
+        result = bool(approved[0]) if approved else False
             
-        logger.info(f"Проверка подтверждения пользователя {user_id}: {result}, raw_data: {approved}")
+        logger.debug(f"Проверка подтверждения пользователя {user_id}: {result}, raw_data: {approved}")
         return result
     except Exception as e:
         logger.error(f"Ошибка при проверке, подтвержден ли пользователь {user_id}: {e}")
@@ -520,28 +784,49 @@ def get_unapproved_users():
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        # В PostgreSQL логические значения используются по-другому
-        if is_postgres():
-            cursor.execute("SELECT * FROM users WHERE is_approved = FALSE")
-        else:
-            cursor.execute("SELECT * FROM users WHERE is_approved = 0")
+        # В PostgreSQL и SQLite логические значения записываются по-разному
+        cursor.execute(f"SELECT * FROM users WHERE is_approved = {get_backend().false_literal}")
             
-        users = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        user_list = []
-        for user_data in users:
-            user_dict = {column_names[i]: user_data[i] for i in range(len(column_names))}
-            user_list.append(user_dict)
-        return user_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении неподтвержденных пользователей: {e}")
         return []
     finally:
         conn.close()
 
+def _order_tag(order_id: int) -> str:
+    """Тег кэша, которым помечены все записи, содержащие заказ"""
+    return f'order:{order_id}'
+
+def _orders_list_tag(status: Optional[str] = None) -> str:
+    """Тег кэша списка заказов со статусом (или всех заказов)"""
+    return f'orders_list:{status or "all"}'
+
+def invalidate_order_cache(order_id: Optional[int] = None, new_status: Optional[str] = None) -> None:
+    """
+    Инвалидирует кэш заказа: сам заказ и списки, в которые он входит.
+    Если заказ получил новый статус, инвалидируется и список этого статуса,
+    в который заказ теперь должен попасть. Остальные записи кэша заказов сохраняются.
+    
+    Args:
+        order_id: ID измененного заказа
+        new_status: Новый статус заказа (или статус созданного заказа)
+    """
+    tags = []
+    if order_id is not None:
+        tags.append(_order_tag(order_id))
+    if new_status:
+        tags.append(_orders_list_tag(new_status))
+        tags.append(_orders_list_tag())
+    if tags:
+        cache_invalidate_tags('orders', *tags)
+
 def save_order(dispatcher_id: int, client_phone: str, client_name: str, problem_description: str, client_address: str, scheduled_datetime: str = None) -> Optional[int]:
     """
-    Сохранение заказа с инвалидацией кэша всех заказов
+    Сохранение заказа. Телефон сохраняется и в формате E.164, а в той же транзакции
+    клиент с этим телефоном добавляется в таблицу clients или обновляется (последние
+    имя и адрес, число заказов). После записи по тегам инвалидируются только списки
+    заказов, в которые попадает новый заказ: общий список и список новых заказов
     
     Args:
         dispatcher_id: ID диспетчера, создавшего заказ
@@ -557,32 +842,34 @@ def save_order(dispatcher_id: int, client_phone: str, client_name: str, problem_
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Определяем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
+    
+    phone_e164 = normalize_phone(client_phone)
     
     try:
-        # Если используется PostgreSQL, то для получения ID созданной записи нужно использовать RETURNING
-        if is_postgres():
-            cursor.execute(f"""
-            INSERT INTO orders (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime)
-            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
-            RETURNING order_id
-            """, (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime))
-            # В PostgreSQL order_id возвращается из запроса RETURNING
-            result = cursor.fetchone()
-            order_id = result[0] if result else None
-        else:
-            # SQLite
-            cursor.execute(f"""
-            INSERT INTO orders (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime)
-            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
-            """, (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime))
-            order_id = cursor.lastrowid
-            
+        order_id = backend.insert_returning_id(
+            cursor,
+            f"""
+            INSERT INTO orders (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime,
+                                status_updated_at, client_phone_e164)
+            VALUES ({backend.placeholders(6)}, CURRENT_TIMESTAMP, {backend.placeholder})
+            """,
+            (dispatcher_id, client_phone, client_name, problem_description, client_address, scheduled_datetime, phone_e164),
+            'order_id'
+        )
+        if phone_e164:
+            backend.upsert(
+                cursor, 'clients',
+                {'phone_e164': phone_e164, 'client_name': client_name, 'client_address': client_address,
+                 'orders_count': 1},
+                ['phone_e164'],
+                update_columns=['client_name', 'client_address'],
+                update_expressions={'orders_count': 'clients.orders_count + 1', 'last_order_at': 'CURRENT_TIMESTAMP'}
+            )
         conn.commit()
         
-        # Инвалидируем кэш всех заказов
-        cache_clear('orders')
+        # Новый заказ попадает в общий список и в список новых заказов
+        invalidate_order_cache(new_status='new')
         return order_id
     except Exception as e:
         logger.error(f"Ошибка при сохранении заказа: {e}")
@@ -590,7 +877,6 @@ def save_order(dispatcher_id: int, client_phone: str, client_name: str, problem_
     finally:
         conn.close()
 
-@invalidate_cache_on_update('orders')
 def update_order_status(order_id: int, new_status: int) -> bool:
     """
     Обновляет статус заказа
@@ -602,17 +888,19 @@ def update_order_status(order_id: int, new_status: int) -> bool:
     Returns:
         bool: True в случае успеха, False в случае ошибки
     """
+    conn = get_connection()
+    placeholder = get_placeholder()
     try:
-        conn = get_connection()
-        conn.execute("""
+        cursor = conn.cursor()
+        cursor.execute(f"""
             UPDATE orders 
-            SET status = ? 
-            WHERE order_id = ?
+            SET status = {placeholder}, status_updated_at = CURRENT_TIMESTAMP
+            WHERE order_id = {placeholder}
         """, (new_status, order_id))
         conn.commit()
         
-        # Инвалидируем кэш всех заказов
-        cache_clear('orders')
+        # Инвалидируем заказ, списки с ним и список нового статуса
+        invalidate_order_cache(order_id, new_status)
         return True
     except Exception as e:
         logger.error(f"Ошибка при обновлении статуса заказа: {e}")
@@ -620,7 +908,6 @@ def update_order_status(order_id: int, new_status: int) -> bool:
     finally:
         conn.close()
 
-@invalidate_cache_on_update('orders')
 def update_order(order_id: int, data=None, status: str = None, service_cost: float = None, service_description: str = None, scheduled_datetime: str = None) -> bool:
     """
     Обновление заказа с автоматической инвалидацией кэша.
@@ -679,11 +966,16 @@ def update_order(order_id: int, data=None, status: str = None, service_cost: flo
                 update_values.append(scheduled_datetime)
 
         if update_fields:
+            if f"status = {placeholder}" in update_fields:
+                update_fields.append("status_updated_at = CURRENT_TIMESTAMP")
             sql = f"UPDATE orders SET {', '.join(update_fields)} WHERE order_id = {placeholder}"
             update_values.append(order_id)
             cursor.execute(sql, tuple(update_values))
             conn.commit()
             
+            new_status = data.get('status') if data and isinstance(data, dict) else status
+            invalidate_order_cache(order_id, new_status)
+            
             # Логируем информацию об обновлении для отладки
             logger.info(f"Заказ {order_id} успешно обновлен: {', '.join(update_fields)}")
             return True
@@ -694,7 +986,79 @@ def update_order(order_id: int, data=None, status: str = None, service_cost: flo
     finally:
         conn.close()
 
-@cached('orders')
+# Столбцы диспетчера и мастера, добавляемые к o.* в get_order_view (ключ в OrderView, выражение)
+_ORDER_VIEW_DISPATCHER_COLUMNS = [
+    ('user_id', 'd.user_id'), ('first_name', 'd.first_name'), ('last_name', 'd.last_name'),
+    ('username', 'd.username'), ('role', 'd.role'),
+]
+_ORDER_VIEW_TECHNICIAN_COLUMNS = [
+    ('user_id', 't.user_id'), ('first_name', 't.first_name'), ('last_name', 't.last_name'),
+    ('username', 't.username'), ('assigned_at', 'ot.assigned_at'),
+]
+
+def _order_view_tags(view: Optional[OrderView], order_id: int) -> List[str]:
+    """Теги карточки заказа: сам заказ, его диспетчер и мастера"""
+    tags = [_order_tag(order_id)]
+    if view is not None:
+        if view.dispatcher:
+            tags.append(_user_tag(view.dispatcher['user_id']))
+        tags.extend(_user_tag(technician['user_id']) for technician in view.technicians)
+    return tags
+
+@cached('orders', lambda order_id: f'view_{order_id}', tags=_order_view_tags)
+def get_order_view(order_id: int) -> Optional[OrderView]:
+    """
+    Получение заказа вместе с диспетчером и назначенными мастерами одним запросом
+    (по строке на мастера). Результат кэшируется и инвалидируется при изменении заказа,
+    назначений, а также данных диспетчера и мастеров.
+    
+    Args:
+        order_id: ID заказа
+        
+    Returns:
+        Optional[OrderView]: Карточка заказа или None, если заказ не найден
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    extra_columns = _ORDER_VIEW_DISPATCHER_COLUMNS + _ORDER_VIEW_TECHNICIAN_COLUMNS
+    
+    try:
+        cursor.execute(f"""
+            SELECT o.*, {', '.join(expression for _, expression in extra_columns)}
+            FROM orders o
+            LEFT JOIN users d ON d.user_id = o.dispatcher_id
+            LEFT JOIN order_technicians ot ON ot.order_id = o.order_id
+            LEFT JOIN users t ON t.user_id = ot.technician_id
+            WHERE o.order_id = {get_placeholder()}
+            ORDER BY ot.assigned_at, ot.assignment_id
+        """, (order_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        
+        # Столбцы заказа идут первыми, за ними - столбцы диспетчера и мастера
+        order_columns = [column[0] for column in cursor.description][:-len(extra_columns)]
+        dispatcher_start = len(order_columns)
+        technician_start = dispatcher_start + len(_ORDER_VIEW_DISPATCHER_COLUMNS)
+        
+        first = rows[0]
+        order = dict(zip(order_columns, first))
+        dispatcher = None
+        if first[dispatcher_start] is not None:
+            dispatcher = dict(zip((key for key, _ in _ORDER_VIEW_DISPATCHER_COLUMNS), first[dispatcher_start:technician_start]))
+        technicians = [
+            dict(zip((key for key, _ in _ORDER_VIEW_TECHNICIAN_COLUMNS), row[technician_start:]))
+            for row in rows if row[technician_start] is not None
+        ]
+        return OrderView(order, dispatcher, technicians)
+    except Exception as e:
+        logger.error(f"Ошибка при получении карточки заказа {order_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+@cached('orders', tags=lambda order, order_id: [_order_tag(order_id)])
 def get_order(order_id: int) -> Optional[Dict]:
     """
     Получение заказа с использованием кэширования.
@@ -716,9 +1080,7 @@ def get_order(order_id: int) -> Optional[Dict]:
         cursor.execute(f"SELECT * FROM orders WHERE order_id = {placeholder}", (order_id,))
         order = cursor.fetchone()
         if order:
-            column_names = [desc[0] for desc in cursor.description]
-            order_dict = {column_names[i]: order[i] for i in range(len(column_names))}
-            return order_dict
+            return _row_mapper(cursor.description)(order)
         return None
     except Exception as e:
         logger.error(f"Ошибка при получении заказа: {e}")
@@ -736,19 +1098,20 @@ def get_orders_by_user(user_id: int) -> List[Dict]:
     
     try:
         cursor.execute(f"SELECT * FROM orders WHERE dispatcher_id = {placeholder}", (user_id,))
-        orders = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        order_list = []
-        for order_data in orders:
-            order_dict = {column_names[i]: order_data[i] for i in range(len(column_names))}
-            order_list.append(order_dict)
-        return order_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении заказов пользователя: {e}")
         return []
     finally:
         conn.close()
 
+def iter_orders_by_user(user_id: int, batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """Потоковое получение заказов пользователя (см. iter_query)"""
+    return iter_query(
+        f"SELECT * FROM orders WHERE dispatcher_id = {get_placeholder()} ORDER BY created_at, order_id",
+        (user_id,), batch_size
+    )
+
 def get_assigned_orders(technician_id: int) -> List[Dict]:
     """Получение назначенных заказов"""
     conn = get_connection()
@@ -763,20 +1126,143 @@ def get_assigned_orders(technician_id: int) -> List[Dict]:
             JOIN order_technicians a ON o.order_id = a.order_id
             WHERE a.technician_id = {placeholder}
         """, (technician_id,))
-        orders = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        order_list = []
-        for order_data in orders:
-            order_dict = {column_names[i]: order_data[i] for i in range(len(column_names))}
-            order_list.append(order_dict)
-        return order_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении назначенных заказов: {e}")
         return []
     finally:
         conn.close()
 
-@cached('orders', lambda status=None: f'all_orders_{status or "all"}')
+def iter_assigned_orders(technician_id: int, batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """Потоковое получение назначенных мастеру заказов (см. iter_query)"""
+    return iter_query(f"""
+        SELECT o.* FROM orders o
+        JOIN order_technicians a ON o.order_id = a.order_id
+        WHERE a.technician_id = {get_placeholder()}
+        ORDER BY o.created_at, o.order_id
+    """, (technician_id,), batch_size)
+
+# Направления курсорной пагинации (значения передаются в callback_data, не менять)
+PAGE_OLDER = 0
+PAGE_NEWER = 1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _timestamp_to_micros(value) -> int:
+    """
+    Приводит created_at из БД к числу микросекунд от эпохи для ключа страницы
+    (SQLite возвращает строку, PostgreSQL - datetime)
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _micros_to_timestamp(micros: int, backend: DatabaseBackend):
+    """Обратное преобразование ключа страницы в значение created_at для сравнения в запросе"""
+    value = _EPOCH + datetime.timedelta(microseconds=micros)
+    if backend.is_postgres:
+        return value
+    # В SQLite CURRENT_TIMESTAMP хранится строкой "YYYY-MM-DD HH:MM:SS"
+    return value.isoformat(sep=' ', timespec='microseconds' if value.microsecond else 'seconds')
+
+def _fetch_keyset_page(cursor, backend: DatabaseBackend, select_sql: str, created_column: str, id_column: str,
+                       conditions: List[str], params: List, page_key: Optional[tuple], direction: int,
+                       limit: int) -> Page:
+    """
+    Выполняет выборку страницы по ключу (created_at, id) вместо LIMIT/OFFSET:
+    время запроса не зависит от номера страницы, а вставка новых записей не сдвигает страницы.
+    
+    Args:
+        cursor: Курсор БД
+        backend: Параметры базы данных
+        select_sql: SELECT ... FROM ... без WHERE
+        created_column, id_column: Столбцы ключа сортировки
+        conditions, params: Условия фильтрации и их параметры
+        page_key: Ключ (микросекунды created_at, ID) записи, от которой строится страница,
+                  None - первая (самая новая) страница
+        direction: PAGE_OLDER - записи старше ключа, PAGE_NEWER - новее ключа
+        limit: Количество записей на странице
+    """
+    conditions = list(conditions)
+    params = list(params)
+    newer = page_key is not None and direction == PAGE_NEWER
+    if page_key is not None:
+        conditions.append(f"({created_column}, {id_column}) {'>' if newer else '<'} "
+                          f"({backend.placeholder}, {backend.placeholder})")
+        params.extend([_micros_to_timestamp(page_key[0], backend), page_key[1]])
+    
+    sql = select_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    order = 'ASC' if newer else 'DESC'
+    # Лишняя запись показывает, есть ли еще страница в этом направлении
+    sql += f" ORDER BY {created_column} {order}, {id_column} {order} LIMIT {backend.placeholder}"
+    params.append(limit + 1)
+    
+    cursor.execute(sql, tuple(params))
+    rows = _fetch_dicts(cursor)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    
+    if not rows:
+        return Page([])
+    
+    id_key = id_column.rsplit('.', 1)[-1]
+    first_key = (_timestamp_to_micros(rows[0]['created_at']), rows[0][id_key])
+    last_key = (_timestamp_to_micros(rows[-1]['created_at']), rows[-1][id_key])
+    has_older = has_more if not newer else True
+    has_newer = has_more if newer else page_key is not None
+    return Page(rows, last_key if has_older else None, first_key if has_newer else None)
+
+def get_orders_page(page_key: Optional[tuple] = None, direction: int = PAGE_OLDER, limit: int = 10,
+                    status: str = None, dispatcher_id: int = None) -> Page:
+    """
+    Получение страницы заказов от новых к старым с курсорной пагинацией по (created_at, order_id)
+    
+    Args:
+        page_key: Ключ Page.older или Page.newer предыдущей страницы (None - первая страница)
+        direction: PAGE_OLDER или PAGE_NEWER
+        limit: Количество заказов на странице
+        status: Опциональный фильтр по статусу заказа
+        dispatcher_id: Опциональный фильтр по диспетчеру
+        
+    Returns:
+        Page: Заказы страницы и ключи соседних страниц
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    backend = get_backend()
+    
+    try:
+        conditions = []
+        params = []
+        if status:
+            conditions.append(f"status = {backend.placeholder}")
+            params.append(status)
+        if dispatcher_id:
+            conditions.append(f"dispatcher_id = {backend.placeholder}")
+            params.append(dispatcher_id)
+        page = _fetch_keyset_page(cursor, backend, "SELECT * FROM orders", "created_at", "order_id",
+                                  conditions, params, page_key, direction, limit)
+        if not page.items and direction == PAGE_NEWER and page_key is not None:
+            # Более новые записи удалены - показываем первую страницу
+            page = _fetch_keyset_page(cursor, backend, "SELECT * FROM orders", "created_at", "order_id",
+                                      conditions, params, None, PAGE_OLDER, limit)
+        return page
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы заказов: {e}")
+        return Page([])
+    finally:
+        conn.close()
+
+@cached('orders', lambda status=None: f'all_orders_{status or "all"}',
+        tags=lambda orders, status=None: [_orders_list_tag(status)] + [_order_tag(order['order_id']) for order in orders])
 def get_all_orders(status: str = None) -> List[Dict]:
     """
     Получение всех заказов с использованием кэширования.
@@ -798,41 +1284,176 @@ def get_all_orders(status: str = None) -> List[Dict]:
             cursor.execute(f"SELECT * FROM orders WHERE status = {placeholder}", (status,))
         else:
             cursor.execute("SELECT * FROM orders")
-        orders = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        order_list = []
-        for order_data in orders:
-            order_dict = {column_names[i]: order_data[i] for i in range(len(column_names))}
-            order_list.append(order_dict)
-        return order_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении всех заказов: {e}")
         return []
     finally:
         conn.close()
 
+def iter_all_orders(status: str = None, batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Потоковое получение всех заказов без кэширования (для выгрузок и обхода всей таблицы,
+    см. iter_query)
+    
+    Args:
+        status: Опциональный фильтр по статусу заказа
+        batch_size: Размер пачки строк
+    """
+    if status:
+        return iter_query(
+            f"SELECT * FROM orders WHERE status = {get_placeholder()} ORDER BY created_at, order_id",
+            (status,), batch_size
+        )
+    return iter_query("SELECT * FROM orders ORDER BY created_at, order_id", (), batch_size)
+
+def get_client_history(phone: str, limit: int = 5) -> Optional[ClientHistory]:
+    """
+    Получение клиента по номеру телефона и его последних заказов. Клиент ищется по
+    уникальному индексу clients.phone_e164, заказы - по индексу idx_orders_client_phone,
+    поэтому время ответа не зависит от общего числа заказов.
+    
+    Args:
+        phone: Номер телефона в любом формате (нормализуется normalize_phone)
+        limit: Максимум последних заказов
+        
+    Returns:
+        Optional[ClientHistory]: Клиент и его заказы или None, если заказов с этим номером не было
+    """
+    phone_e164 = normalize_phone(phone)
+    if not phone_e164:
+        return None
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    placeholder = get_placeholder()
+    
+    try:
+        cursor.execute(f"SELECT * FROM clients WHERE phone_e164 = {placeholder}", (phone_e164,))
+        clients = _fetch_dicts(cursor)
+        if not clients:
+            return None
+        cursor.execute(f"""
+            SELECT * FROM orders WHERE client_phone_e164 = {placeholder}
+            ORDER BY created_at DESC, order_id DESC LIMIT {placeholder}
+        """, (phone_e164, limit))
+        return ClientHistory(clients[0], _fetch_dicts(cursor))
+    except Exception as e:
+        logger.error(f"Ошибка при получении истории клиента {phone_e164}: {e}")
+        return None
+    finally:
+        conn.close()
+
+# Максимум слов в поисковом запросе
+MAX_SEARCH_TERMS = 8
+# Номер телефона в запросе с разделителями между цифрами: "+7 (999) 123-45-67"
+_SEARCH_PHONE_PATTERN = re.compile(r'\+?\d[\d\s\-().]{5,}\d')
+
+def _collapse_phone(match) -> str:
+    digits = re.sub(r'\D', '', match.group())
+    return digits if len(digits) >= 7 else match.group()
+
+def normalize_search_query(query: str) -> str:
+    """
+    Приводит поисковый запрос к словам, по которым ищет search_orders: слова в нижнем
+    регистре через пробел, номер телефона - последними 10 цифрами без разделителей
+    (как он хранится в поисковом индексе). Повторная нормализация не меняет результат.
+    
+    Returns:
+        str: Нормализованный запрос (пустая строка, если в запросе нет слов)
+    """
+    query = _SEARCH_PHONE_PATTERN.sub(_collapse_phone, query or '')
+    terms = []
+    for term in re.findall(r'[^\W_]+', query.lower()):
+        if term.isdigit() and len(term) > 10:
+            term = term[-10:]
+        if term not in terms:
+            terms.append(term)
+    return ' '.join(terms[:MAX_SEARCH_TERMS])
+
+def search_orders(query: str, limit: int = 10, offset: int = 0, status: str = None,
+                  dispatcher_id: int = None) -> List[Dict]:
+    """
+    Полнотекстовый поиск заказов по телефону, имени и адресу клиента и описанию проблемы
+    (FTS5 в SQLite, tsvector с GIN-индексом в PostgreSQL, см. миграцию 5). Каждое слово
+    запроса ищется по префиксу, заказ должен содержать все слова. Совпадения в телефоне
+    и имени клиента важнее совпадений в адресе, а в адресе - важнее, чем в описании.
+    
+    Args:
+        query: Поисковый запрос (нормализуется normalize_search_query)
+        limit: Количество заказов
+        offset: Сколько первых результатов пропустить
+        status: Опциональный фильтр по статусу заказа
+        dispatcher_id: Опциональный фильтр по диспетчеру
+        
+    Returns:
+        List[Dict]: Заказы от наиболее к наименее релевантным
+    """
+    terms = normalize_search_query(query).split()
+    if not terms:
+        return []
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    backend = get_backend()
+    placeholder = backend.placeholder
+    
+    try:
+        conditions = []
+        params = []
+        if backend.is_postgres:
+            sql = (f"SELECT o.* FROM order_search s JOIN orders o ON o.order_id = s.order_id, "
+                   f"to_tsquery('simple', {placeholder}) q WHERE s.document @@ q")
+            params.append(' & '.join(f"{term}:*" for term in terms))
+            rank = "ts_rank(s.document, q) DESC"
+        else:
+            sql = (f"SELECT o.* FROM orders_fts JOIN orders o ON o.order_id = orders_fts.rowid "
+                   f"WHERE orders_fts MATCH {placeholder}")
+            params.append(' '.join(f'"{term}"*' for term in terms))
+            # Веса столбцов в порядке migrations.SEARCH_COLUMNS
+            rank = "bm25(orders_fts, 10.0, 5.0, 2.0, 1.0)"
+        if status:
+            conditions.append(f"o.status = {placeholder}")
+            params.append(status)
+        if dispatcher_id:
+            conditions.append(f"o.dispatcher_id = {placeholder}")
+            params.append(dispatcher_id)
+        for condition in conditions:
+            sql += f" AND {condition}"
+        sql += f" ORDER BY {rank}, o.order_id DESC LIMIT {placeholder} OFFSET {placeholder}"
+        params.extend([limit, offset])
+        
+        cursor.execute(sql, tuple(params))
+        return _fetch_dicts(cursor)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске заказов по запросу '{query}': {e}")
+        return []
+    finally:
+        conn.close()
+
 def assign_order(order_id: int, technician_id: int, assigned_by: int) -> Optional[int]:
     """Назначение заказа"""
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
     
     try:
         # Для назначения используем правильное имя таблицы order_technicians
-        cursor.execute(f"""
+        assignment_id = backend.insert_returning_id(
+            cursor,
+            f"""
             INSERT INTO order_technicians (order_id, technician_id, assigned_by)
-            VALUES ({placeholder}, {placeholder}, {placeholder})
-        """, (order_id, technician_id, assigned_by))
+            VALUES ({backend.placeholders(3)})
+            """,
+            (order_id, technician_id, assigned_by),
+            'assignment_id'
+        )
         conn.commit()
-        
-        # Для PostgreSQL и SQLite получение ID последней вставленной записи отличается
-        if is_postgres():
-            cursor.execute("SELECT lastval()")
-            return cursor.fetchone()[0]
-        else:
-            return cursor.lastrowid
+        invalidate_order_cache(order_id)
+        return assignment_id
     except Exception as e:
         logger.error(f"Ошибка при назначении заказа: {e}")
         return None
@@ -853,13 +1474,7 @@ def get_order_technicians(order_id: int) -> List[Dict]:
             JOIN order_technicians a ON u.user_id = a.technician_id
             WHERE a.order_id = {placeholder}
         """, (order_id,))
-        technicians = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        technician_list = []
-        for technician_data in technicians:
-            technician_dict = {column_names[i]: technician_data[i] for i in range(len(column_names))}
-            technician_list.append(technician_dict)
-        return technician_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении техников заказа: {e}")
         return []
@@ -879,6 +1494,7 @@ def unassign_order(order_id: int, technician_id: int) -> bool:
             DELETE FROM order_technicians WHERE order_id = {placeholder} AND technician_id = {placeholder}
         """, (order_id, technician_id))
         conn.commit()
+        invalidate_order_cache(order_id)
         return True
     except Exception as e:
         logger.error(f"Ошибка при отмене назначения заказа: {e}")
@@ -891,26 +1507,16 @@ def set_user_state(user_id: int, state: str, order_id: Optional[int] = None) ->
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
     
     try:
-        # Для PostgreSQL используем другой синтаксис вместо INSERT OR REPLACE
-        if is_postgres():
-            # Сначала пробуем удалить существующую запись
-            cursor.execute(f"DELETE FROM user_states WHERE user_id = {placeholder}", (user_id,))
-            # Затем делаем вставку
-            cursor.execute(f"""
-                INSERT INTO user_states (user_id, state, order_id)
-                VALUES ({placeholder}, {placeholder}, {placeholder})
-            """, (user_id, state, order_id))
-        else:
-            # Для SQLite используем INSERT OR REPLACE
-            cursor.execute(f"""
-                INSERT OR REPLACE INTO user_states (user_id, state, order_id)
-                VALUES ({placeholder}, {placeholder}, {placeholder})
-            """, (user_id, state, order_id))
-        
+        backend.upsert(
+            cursor, 'user_states',
+            {'user_id': user_id, 'state': state, 'order_id': order_id},
+            conflict_columns=['user_id'],
+            update_columns=['state', 'order_id'],
+            update_expressions={'updated_at': 'CURRENT_TIMESTAMP'}
+        )
         conn.commit()
         return True
     except Exception as e:
@@ -955,6 +1561,50 @@ def get_current_order_id(user_id: int) -> Optional[int]:
     finally:
         conn.close()
 
+def get_user_state_snapshot(user_id: int) -> Optional[UserStateSnapshot]:
+    """
+    Получение состояния пользователя, ID текущего заказа и времени изменения одним запросом
+    
+    Returns:
+        UserStateSnapshot или None, если состояние не задано
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    placeholder = get_placeholder()
+    
+    try:
+        cursor.execute(
+            f"SELECT state, order_id, updated_at FROM user_states WHERE user_id = {placeholder}",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return UserStateSnapshot(row[0], row[1], UserStateSnapshot.parse_timestamp(row[2]))
+    except Exception as e:
+        logger.error(f"Ошибка при получении состояния пользователя: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_all_user_states() -> Dict[int, UserStateSnapshot]:
+    """Получение сохраненных состояний всех пользователей"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT user_id, state, order_id, updated_at FROM user_states")
+        return {
+            row[0]: UserStateSnapshot(row[1], row[2], UserStateSnapshot.parse_timestamp(row[3]))
+            for row in cursor.fetchall()
+        }
+    except Exception as e:
+        logger.error(f"Ошибка при получении состояний пользователей: {e}")
+        return {}
+    finally:
+        conn.close()
+
 def clear_user_state(user_id: int) -> bool:
     """Очистка состояния пользователя"""
     conn = get_connection()
@@ -978,22 +1628,20 @@ def save_problem_template(title: str, description: str, created_by: int) -> Opti
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
     
     try:
-        cursor.execute(f"""
+        template_id = backend.insert_returning_id(
+            cursor,
+            f"""
             INSERT INTO problem_templates (title, description, created_by)
-            VALUES ({placeholder}, {placeholder}, {placeholder})
-        """, (title, description, created_by))
+            VALUES ({backend.placeholders(3)})
+            """,
+            (title, description, created_by),
+            'template_id'
+        )
         conn.commit()
-        
-        # Для PostgreSQL и SQLite получение ID последней вставленной записи отличается
-        if is_postgres():
-            cursor.execute("SELECT lastval()")
-            return cursor.fetchone()[0]
-        else:
-            return cursor.lastrowid
+        return template_id
     except Exception as e:
         logger.error(f"Ошибка при сохранении шаблона проблемы: {e}")
         return None
@@ -1047,9 +1695,7 @@ def get_problem_template(template_id: int) -> Optional[Dict]:
         cursor.execute(f"SELECT * FROM problem_templates WHERE template_id = {placeholder}", (template_id,))
         template = cursor.fetchone()
         if template:
-            column_names = [desc[0] for desc in cursor.description]
-            template_dict = {column_names[i]: template[i] for i in range(len(column_names))}
-            return template_dict
+            return _row_mapper(cursor.description)(template)
         return None
     except Exception as e:
         logger.error(f"Ошибка при получении шаблона проблемы: {e}")
@@ -1080,13 +1726,7 @@ def get_problem_templates(created_by: int = None, active_only: bool = True) -> L
             sql += " WHERE " + " AND ".join(conditions)
 
         cursor.execute(sql, tuple(params))
-        templates = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        template_list = []
-        for template_data in templates:
-            template_dict = {column_names[i]: template_data[i] for i in range(len(column_names))}
-            template_list.append(template_dict)
-        return template_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении шаблонов проблем: {e}")
         return []
@@ -1122,8 +1762,8 @@ def delete_user(user_id: int) -> bool:
     try:
         cursor.execute(f"DELETE FROM users WHERE user_id = {placeholder}", (user_id,))
         conn.commit()
-        # Очищаем кэш пользователей
-        cache_clear('users')
+        # Инвалидируем кэш пользователя и списков, в которые он входил
+        invalidate_user_cache(user_id)
         logger.info(f"Пользователь {user_id} успешно удален, кэш очищен")
         return True
     except Exception as e:
@@ -1149,12 +1789,16 @@ def delete_order(order_id: int) -> bool:
     placeholder = get_placeholder()
     
     try:
+        cursor.execute(f"""
+            UPDATE clients SET orders_count = orders_count - 1
+            WHERE phone_e164 = (SELECT client_phone_e164 FROM orders WHERE order_id = {placeholder})
+              AND orders_count > 0
+        """, (order_id,))
         cursor.execute(f"DELETE FROM orders WHERE order_id = {placeholder}", (order_id,))
         conn.commit()
         
-        # Инвалидируем кэш заказа и списков заказов
-        # используем cache_clear, так как cache_delete может быть не определена
-        cache_clear('orders')  # Очищаем весь кэш заказов
+        # Инвалидируем кэш заказа и списков, в которые он входил
+        invalidate_order_cache(order_id)
         
         logger.info(f"Заказ {order_id} успешно удален, кэш очищен")
         return True
@@ -1164,35 +1808,61 @@ def delete_order(order_id: int) -> bool:
     finally:
         conn.close()
 
-def add_activity_log(user_id: int, action_type: str, action_description: str, related_order_id: int = None, related_user_id: int = None) -> Optional[int]:
-    """Добавление лога активности"""
+def add_activity_log(user_id: int, action_type: str, action_description: str, related_order_id: int = None, related_user_id: int = None) -> bool:
+    """
+    Добавление лога активности. Запись ставится в буфер и записывается в БД фоновым
+    потоком пачкой вместе с другими (см. activity_log_sink). Выборки логов перед чтением
+    записывают буфер, поэтому запись видна в них сразу после добавления.
+    
+    Returns:
+        bool: True, если запись принята, False если буфер переполнен
+    """
+    try:
+        return get_activity_log_sink().add(user_id, action_type, action_description, related_order_id, related_user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении лога активности: {e}")
+        return False
+
+def insert_activity_logs(entries: List) -> None:
+    """
+    Записывает пачку логов активности одной транзакцией: в PostgreSQL многострочным
+    INSERT (execute_values), в SQLite через executemany
+    
+    Args:
+        entries: Записи ActivityLogEntry
+        
+    Raises:
+        Exception: при ошибке БД (пачка не записана)
+    """
+    if not entries:
+        return
     conn = get_connection()
     cursor = conn.cursor()
     
-    # Получаем placeholder в зависимости от типа БД
-    placeholder = get_placeholder()
+    backend = get_backend()
+    columns = "user_id, action_type, action_description, related_order_id, related_user_id, created_at"
     
     try:
-        cursor.execute(f"""
-            INSERT INTO activity_logs (user_id, action_type, action_description, related_order_id, related_user_id)
-            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
-        """, (user_id, action_type, action_description, related_order_id, related_user_id))
-        conn.commit()
-        
-        # Для PostgreSQL и SQLite получение ID последней вставленной записи отличается
-        if is_postgres():
-            cursor.execute("SELECT lastval()")
-            return cursor.fetchone()[0]
+        if backend.is_postgres:
+            # timestamptz приводится к TIMESTAMP в часовом поясе сессии, как CURRENT_TIMESTAMP
+            execute_values(cursor, f"INSERT INTO activity_logs ({columns}) VALUES %s",
+                           list(entries), page_size=len(entries))
         else:
-            return cursor.lastrowid
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении лога активности: {e}")
-        return None
+            # В SQLite CURRENT_TIMESTAMP хранится строкой UTC "YYYY-MM-DD HH:MM:SS"
+            cursor.executemany(
+                f"INSERT INTO activity_logs ({columns}) VALUES ({backend.placeholders(6)})",
+                [tuple(entry[:5]) + (entry.created_at.strftime('%Y-%m-%d %H:%M:%S'),) for entry in entries]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
 def get_activity_logs(limit: int = 50, offset: int = 0, user_id: int = None, action_type: str = None, related_order_id: int = None, related_user_id: int = None) -> List[Dict]:
     """Получение логов активности"""
+    flush_activity_logs()
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -1200,42 +1870,89 @@ def get_activity_logs(limit: int = 50, offset: int = 0, user_id: int = None, act
     placeholder = get_placeholder()
     
     try:
-        conditions = []
-        params = []
-
-        if user_id:
-            conditions.append(f"user_id = {placeholder}")
-            params.append(user_id)
-        if action_type:
-            conditions.append(f"action_type = {placeholder}")
-            params.append(action_type)
-        if related_order_id:
-            conditions.append(f"related_order_id = {placeholder}")
-            params.append(related_order_id)
-        if related_user_id:
-            conditions.append(f"related_user_id = {placeholder}")
-            params.append(related_user_id)
-
-        sql = "SELECT * FROM activity_logs"
-        if conditions:
-            sql += " WHERE " + " AND ".join(conditions)
-        sql += f" LIMIT {placeholder} OFFSET {placeholder}"
+        sql, params = _activity_logs_query(placeholder, user_id, action_type, related_order_id, related_user_id)
+        sql += f" ORDER BY created_at DESC, log_id DESC LIMIT {placeholder} OFFSET {placeholder}"
         params.extend([limit, offset])
 
         cursor.execute(sql, tuple(params))
-        logs = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        log_list = []
-        for log_data in logs:
-            log_dict = {column_names[i]: log_data[i] for i in range(len(column_names))}
-            log_list.append(log_dict)
-        return log_list
+        return _fetch_dicts(cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении логов активности: {e}")
         return []
     finally:
         conn.close()
 
+def _activity_logs_query(placeholder: str, user_id: int = None, action_type: str = None,
+                         related_order_id: int = None, related_user_id: int = None) -> tuple:
+    """Возвращает SELECT логов активности с условиями фильтрации и список параметров"""
+    conditions = []
+    params = []
+    for column, value in (('user_id', user_id), ('action_type', action_type),
+                          ('related_order_id', related_order_id), ('related_user_id', related_user_id)):
+        if value:
+            conditions.append(f"{column} = {placeholder}")
+            params.append(value)
+
+    sql = "SELECT * FROM activity_logs"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, params
+
+def iter_activity_logs(user_id: int = None, action_type: str = None, related_order_id: int = None,
+                       related_user_id: int = None, batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """Потоковое получение логов активности от старых к новым с фильтрацией (см. iter_query)"""
+    flush_activity_logs()
+    sql, params = _activity_logs_query(get_placeholder(), user_id, action_type, related_order_id, related_user_id)
+    return iter_query(sql + " ORDER BY created_at, log_id", tuple(params), batch_size)
+
+def get_activity_logs_page(page_key: Optional[tuple] = None, direction: int = PAGE_OLDER, limit: int = 10,
+                           user_id: int = None, action_type: str = None, related_order_id: int = None) -> Page:
+    """
+    Получение страницы логов активности от новых к старым с курсорной пагинацией
+    по (created_at, log_id). Записи дополнены именем, username и ролью пользователя.
+    
+    Args:
+        page_key: Ключ Page.older или Page.newer предыдущей страницы (None - первая страница)
+        direction: PAGE_OLDER или PAGE_NEWER
+        limit: Количество записей на странице
+        user_id, action_type, related_order_id: Опциональные фильтры
+        
+    Returns:
+        Page: Записи страницы и ключи соседних страниц
+    """
+    # Только что добавленные записи еще могут быть в буфере
+    flush_activity_logs()
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    backend = get_backend()
+    select_sql = """
+        SELECT l.*, u.first_name, u.last_name, u.username, u.role
+        FROM activity_logs l
+        LEFT JOIN users u ON u.user_id = l.user_id
+    """
+    
+    try:
+        conditions = []
+        params = []
+        for column, value in (('user_id', user_id), ('action_type', action_type),
+                              ('related_order_id', related_order_id)):
+            if value:
+                conditions.append(f"l.{column} = {backend.placeholder}")
+                params.append(value)
+        page = _fetch_keyset_page(cursor, backend, select_sql, "l.created_at", "l.log_id",
+                                  conditions, params, page_key, direction, limit)
+        if not page.items and direction == PAGE_NEWER and page_key is not None:
+            # Более новые записи удалены - показываем первую страницу
+            page = _fetch_keyset_page(cursor, backend, select_sql, "l.created_at", "l.log_id",
+                                      conditions, params, None, PAGE_OLDER, limit)
+        return page
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы логов активности: {e}")
+        return Page([])
+    finally:
+        conn.close()
+
 def get_admin_activity_summary(days: int = 7) -> Dict:
     """Получение сводки активности админа"""
     # This function requires multiple queries and aggregation, which is better suited for more advanced databases.
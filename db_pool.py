@@ -0,0 +1,434 @@
+"""
+Модуль пула соединений с базой данных
+Используется для повторного использования соединений вместо открытия нового на каждый запрос
+"""
+
+import time
+import sqlite3
+import threading
+import weakref
+from typing import Any, Dict, List, Tuple
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('db_pool')
+
+
+class PoolTimeoutError(Exception):
+    """Истекло время ожидания свободного соединения в пуле"""
+
+
+class NestedTransactionError(Exception):
+    """Вложенная выдача соединения SQLite, пока на нем открыта транзакция внешнего вызова"""
+
+
+class PoolStats:
+    """Счетчики пула соединений"""
+
+    def __init__(self):
+        self.created = 0                # Открыто физических соединений
+        self.discarded = 0              # Закрыто соединений (сбой проверки, ошибка)
+        self.checkouts = 0              # Выдано соединений из пула
+        self.checkins = 0               # Возвращено соединений в пул
+        self.waits = 0                  # Сколько раз пришлось ждать свободного соединения
+        self.timeouts = 0               # Сколько раз ожидание завершилось ошибкой
+        self.health_check_failures = 0  # Соединений, не прошедших проверку при выдаче
+        self.total_wait_time = 0.0      # Суммарное время ожидания, сек
+        self.max_wait_time = 0.0        # Максимальное время ожидания, сек
+
+    def record_wait(self, wait_time: float) -> None:
+        """Учитывает время ожидания соединения"""
+        self.waits += 1
+        self.total_wait_time += wait_time
+        if wait_time > self.max_wait_time:
+            self.max_wait_time = wait_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Преобразует счетчики в словарь"""
+        return {
+            'created': self.created,
+            'discarded': self.discarded,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+            'health_check_failures': self.health_check_failures,
+            'total_wait_time': round(self.total_wait_time, 6),
+            'max_wait_time': round(self.max_wait_time, 6),
+            'avg_wait_time': round(self.total_wait_time / self.waits, 6) if self.waits else 0.0
+        }
+
+
+class PooledConnection:
+    """
+    Обертка над соединением из пула.
+    Все атрибуты делегируются исходному соединению, а close() возвращает соединение в пул
+    вместо его закрытия, поэтому существующий код вида conn = get_connection() ... conn.close()
+    работает без изменений.
+    """
+
+    def __init__(self, pool, raw_connection):
+        self._pool = pool
+        self._connection = raw_connection
+        self._released = False
+
+    @property
+    def raw_connection(self):
+        """Исходное соединение драйвера"""
+        return self._connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """Возвращает соединение в пул (повторный вызов ничего не делает)"""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            try:
+                self._connection.rollback()
+            except Exception:
+                pass
+        self.close()
+
+    def __del__(self):
+        # Защита от утечек: соединение, которое забыли закрыть, возвращается в пул
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class PostgresConnectionPool:
+    """
+    Ограниченный пул соединений PostgreSQL.
+    Если все соединения заняты, запрос ждет освобождения соединения не дольше timeout секунд.
+    Соединение, простаивавшее дольше health_check_interval, проверяется запросом SELECT 1 перед выдачей.
+    """
+
+    dialect = 'postgresql'
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 10.0, health_check_interval: float = 30.0):
+        self.dsn = dsn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.stats = PoolStats()
+
+        self._idle: List[Tuple[Any, float]] = []  # (соединение, время возврата в пул)
+        self._size = 0                            # Всего открытых соединений (занятых и свободных)
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+        for _ in range(self.min_size):
+            connection = self._connect()
+            self._size += 1
+            self._idle.append((connection, time.monotonic()))
+
+    def _connect(self):
+        """Открывает новое физическое соединение"""
+        import psycopg2
+        connection = psycopg2.connect(self.dsn)
+        self.stats.created += 1
+        return connection
+
+    def _discard(self, connection) -> None:
+        """Закрывает соединение, исключенное из пула"""
+        self.stats.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, connection, idle_since: float) -> bool:
+        """Проверяет соединение перед выдачей"""
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Соединение PostgreSQL не прошло проверку и будет пересоздано: {e}")
+            return False
+
+    def acquire(self) -> PooledConnection:
+        """
+        Выдает соединение из пула
+
+        Raises:
+            PoolTimeoutError: если свободное соединение не появилось за timeout секунд
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        connection = None
+        idle_since = 0.0
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Резервируем место под новое соединение, открываем его вне блокировки
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле PostgreSQL (max_size={self.max_size}) за {self.timeout} сек"
+                    )
+                waited = True
+                self._condition.wait(remaining)
+
+        if waited:
+            self.stats.record_wait(time.monotonic() - started)
+
+        try:
+            if connection is not None and not self._is_healthy(connection, idle_since):
+                self.stats.health_check_failures += 1
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            # Освобождаем зарезервированное место, чтобы пул не "усыхал" после ошибок подключения
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._in_use += 1
+            self.stats.checkouts += 1
+        return PooledConnection(self, connection)
+
+    def release(self, connection) -> None:
+        """Возвращает соединение в пул, откатывая незавершенную транзакцию"""
+        healthy = not connection.closed
+        if healthy:
+            try:
+                import psycopg2.extensions
+                if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception as e:
+                logger.warning(f"Не удалось сбросить состояние соединения PostgreSQL: {e}")
+                healthy = False
+
+        with self._condition:
+            self._in_use -= 1
+            self.stats.checkins += 1
+            if healthy:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._size -= 1
+            self._condition.notify()
+
+        if not healthy:
+            self._discard(connection)
+
+    def close_all(self) -> None:
+        """Закрывает все свободные соединения пула"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает размер пула и счетчики"""
+        with self._condition:
+            result = {
+                'dialect': self.dialect,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle)
+            }
+        result.update(self.stats.to_dict())
+        return result
+
+
+class _ThreadConnection:
+    """Соединение SQLite, закрепленное за потоком"""
+
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+        self.depth = 0  # Глубина вложенных выдач в одном потоке
+        self.foreign_releases = 0  # Возвраты из других потоков, которые применит поток-владелец
+
+    def __del__(self):
+        # Вызывается при завершении потока: закрываем его соединение
+        try:
+            self.connection.close()
+            self.pool._on_thread_connection_closed()
+        except Exception:
+            pass
+
+
+class SQLiteConnectionPool:
+    """
+    Пул соединений SQLite: одно переиспользуемое соединение на поток.
+    Повторная выдача в том же потоке (вложенные вызовы, например запросы внутри цикла
+    по iter_query) возвращает то же соединение: отдельное соединение ждало бы блокировки
+    файла, которую держит чтение внешнего вызова. Поэтому вложенная выдача, пока у внешнего
+    вызова открыта транзакция, запрещена - commit или rollback вложенного вызова завершили бы
+    и чужие изменения. Незавершенная транзакция откатывается, только когда соединение
+    возвращено на всех уровнях. Соединение, возвращенное из другого потока, не закрывается:
+    возврат учитывается потоком-владельцем при его следующем обращении к пулу.
+    """
+
+    dialect = 'sqlite'
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        # id соединения -> его поток-владелец (для возврата из другого потока)
+        self._owners: 'weakref.WeakValueDictionary[int, _ThreadConnection]' = weakref.WeakValueDictionary()
+
+    def _connect(self):
+        """Открывает новое соединение для текущего потока"""
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        with self._lock:
+            self._open += 1
+            self.stats.created += 1
+        return connection
+
+    def _on_thread_connection_closed(self) -> None:
+        with self._lock:
+            self._open -= 1
+
+    @staticmethod
+    def _is_healthy(connection) -> bool:
+        try:
+            # Обращение к закрытому соединению вызывает ProgrammingError
+            connection.total_changes
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> PooledConnection:
+        """
+        Выдает соединение текущего потока
+
+        Raises:
+            NestedTransactionError: если соединение уже выдано в этом потоке
+                                    и на нем открыта транзакция
+        """
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None:
+            self._apply_foreign_releases(holder)
+        if holder is not None and holder.depth == 0 and not self._is_healthy(holder.connection):
+            with self._lock:
+                self.stats.health_check_failures += 1
+                self.stats.discarded += 1
+            self._local.holder = None  # __del__ закроет соединение и уменьшит счетчик
+            holder = None
+        if holder is not None and holder.depth > 0 and holder.connection.in_transaction:
+            raise NestedTransactionError(
+                "Соединение SQLite уже выдано в этом потоке и на нем открыта транзакция: "
+                "завершите ее (commit или rollback) до вложенного обращения к БД"
+            )
+        if holder is None:
+            holder = _ThreadConnection(self, self._connect())
+            self._local.holder = holder
+            with self._lock:
+                self._owners[id(holder.connection)] = holder
+
+        if holder.depth == 0:
+            with self._lock:
+                self._in_use += 1
+        holder.depth += 1
+        with self._lock:
+            self.stats.checkouts += 1
+        return PooledConnection(self, holder.connection)
+
+    def release(self, connection) -> None:
+        """Возвращает соединение текущего потока"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder.connection is not connection:
+            with self._lock:
+                owner = self._owners.get(id(connection))
+                owned = owner is not None and owner.connection is connection
+                if owned:
+                    owner.foreign_releases += 1
+            if owned:
+                # Поток-владелец продолжает пользоваться соединением: закрыть или откатить
+                # его отсюда нельзя, возврат применит сам владелец
+                logger.warning("Соединение SQLite возвращено в пул из другого потока: "
+                               "возврат будет учтен потоком-владельцем")
+                return
+            # Соединение после пересоздания уже не выдается ни одному потоку - закрываем
+            try:
+                connection.close()
+            except Exception:
+                pass
+            return
+
+        self._apply_foreign_releases(holder)
+        self._checkin(holder)
+
+    def _apply_foreign_releases(self, holder: _ThreadConnection) -> None:
+        """Учитывает возвраты соединения текущего потока, выполненные из других потоков"""
+        with self._lock:
+            count, holder.foreign_releases = holder.foreign_releases, 0
+        for _ in range(count):
+            if holder.depth > 0:
+                self._checkin(holder)
+
+    def _checkin(self, holder: _ThreadConnection) -> None:
+        """Уменьшает глубину выдачи соединения текущего потока, на нулевой сбрасывает транзакцию"""
+        connection = holder.connection
+        holder.depth -= 1
+        with self._lock:
+            self.stats.checkins += 1
+            if holder.depth == 0:
+                self._in_use -= 1
+        if holder.depth == 0:
+            try:
+                if connection.in_transaction:
+                    connection.rollback()
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось сбросить состояние соединения SQLite: {e}")
+                self._local.holder = None
+
+    def close_all(self) -> None:
+        """Закрывает соединение текущего потока"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None and holder.depth == 0:
+            self._local.holder = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает число соединений и счетчики"""
+        with self._lock:
+            result = {
+                'dialect': self.dialect,
+                'max_size': None,
+                'size': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use
+            }
+        result.update(self.stats.to_dict())
+        return result
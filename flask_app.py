@@ -5,7 +5,11 @@ Flask приложение для запуска на порту 5001
 
 import os
 import logging
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, abort
+from webhook_receiver import (
+    WEBHOOK_PATH, SECRET_HEADER, MAX_BODY_BYTES, get_webhook_receiver, is_webhook_mode, verify_secret_token
+)
+from cache import init_cache_backend
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,6 +20,12 @@ logger = logging.getLogger(__name__)
 
 # Создаем экземпляр Flask
 app = Flask(__name__)
+# Тело запроса без Content-Length (chunked) тоже не читается больше этого размера
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+
+# Общее хранилище кэша создается при загрузке приложения (в том числе WSGI-сервером):
+# ошибка его настройки останавливает запуск, а не проявляется в обработчиках
+init_cache_backend()
 
 # Определяем порт (по умолчанию 5001)
 PORT = int(os.environ.get('FLASK_PORT', 5001))
@@ -49,6 +59,25 @@ def get_orders():
         {'id': 2, 'client': 'Петр Петров', 'problem': 'Медленная работа', 'status': 'в работе'},
     ])
 
+# Прием обновлений Telegram через webhook
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Принимает обновление от Telegram и ставит его в очередь обработки"""
+    if not is_webhook_mode():
+        abort(404)
+    # Токен и размер проверяются до создания приемника: запрос без токена не запускает
+    # потоки обработки обновлений
+    if not verify_secret_token(request.headers.get(SECRET_HEADER)):
+        logger.warning("Запрос webhook с неверным секретным токеном отклонен")
+        return jsonify({'ok': False, 'description': 'Forbidden'}), 403
+    if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+        return jsonify({'ok': False, 'description': 'Payload Too Large'}), 413
+    status, description = get_webhook_receiver().handle(
+        request.headers.get(SECRET_HEADER),
+        request.get_data(cache=False)
+    )
+    return jsonify({'ok': status == 200, 'description': description}), status
+
 # Обработка ошибок
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Локальная замена сервера Redis для проверки общего кэша без установленного Redis
+
+Поддерживает только команды, которые использует RedisBackend из cache_backends:
+PING, AUTH, SELECT, GET, MGET, SET (PX/EX), INCR, DEL, PTTL, PEXPIRE, SADD, SMEMBERS, SCAN,
+PUBLISH, SUBSCRIBE.
+Данные хранятся в памяти процесса и не сохраняются.
+
+Запуск:
+    python local_redis.py [порт]
+    CACHE_BACKEND=redis CACHE_REDIS_URL=redis://localhost:6390/0 python bot.py
+"""
+
+import time
+import fnmatch
+import threading
+import socketserver
+from typing import Any, Dict, List, Optional, Set
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('local_redis')
+
+DEFAULT_PORT = 6390
+
+
+def _encode(value: Any) -> bytes:
+    """Кодирует ответ в формате RESP2"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode('utf-8')
+    if isinstance(value, Exception):
+        return b'-ERR %s\r\n' % str(value).encode('utf-8')
+    if isinstance(value, (list, tuple, set)):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class _Store:
+    """Данные сервера: строки, множества и сроки истечения"""
+
+    def __init__(self):
+        self.values: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.subscribers: Dict[bytes, Set['_RedisHandler']] = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key: bytes) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    def execute(self, args: List[bytes]) -> Any:
+        command = args[0].upper()
+        with self.lock:
+            if command in (b'PING', b'AUTH', b'SELECT'):
+                return 'PONG' if command == b'PING' else 'OK'
+            if command == b'GET':
+                return self.values.get(args[1]) if self._alive(args[1]) else None
+            if command == b'MGET':
+                return [self.values.get(key) if self._alive(key) else None for key in args[1:]]
+            if command == b'INCR':
+                value = int(self.values[args[1]]) + 1 if self._alive(args[1]) else 1
+                self.values[args[1]] = str(value).encode('utf-8')
+                return value
+            if command == b'SET':
+                key = args[1]
+                self.values[key] = args[2]
+                self.expires.pop(key, None)
+                options = [arg.upper() for arg in args[3:]]
+                if b'PX' in options:
+                    self.expires[key] = time.monotonic() + int(args[3 + options.index(b'PX') + 1]) / 1000
+                elif b'EX' in options:
+                    self.expires[key] = time.monotonic() + int(args[3 + options.index(b'EX') + 1])
+                return 'OK'
+            if command == b'DEL':
+                removed = 0
+                for key in args[1:]:
+                    if self._alive(key):
+                        removed += 1
+                    self.values.pop(key, None)
+                    self.expires.pop(key, None)
+                return removed
+            if command == b'PTTL':
+                if not self._alive(args[1]):
+                    return -2
+                expires_at = self.expires.get(args[1])
+                return -1 if expires_at is None else int((expires_at - time.monotonic()) * 1000)
+            if command == b'PEXPIRE':
+                if not self._alive(args[1]):
+                    return 0
+                self.expires[args[1]] = time.monotonic() + int(args[2]) / 1000
+                return 1
+            if command == b'SADD':
+                if not self._alive(args[1]):
+                    self.values[args[1]] = set()
+                members = self.values[args[1]]
+                before = len(members)
+                members.update(args[2:])
+                return len(members) - before
+            if command == b'SMEMBERS':
+                return sorted(self.values.get(args[1], ())) if self._alive(args[1]) else []
+            if command == b'SCAN':
+                options = [arg.upper() for arg in args[2:]]
+                pattern = args[2 + options.index(b'MATCH') + 1].decode('utf-8') if b'MATCH' in options else '*'
+                keys = [key for key in list(self.values)
+                        if self._alive(key) and fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern)]
+                return [b'0', keys]
+            if command == b'PUBLISH':
+                receivers = list(self.subscribers.get(args[1], ()))
+            else:
+                return ValueError(f"unknown command '{command.decode('utf-8', 'replace')}'")
+        # Рассылка выполняется без блокировки хранилища
+        for receiver in receivers:
+            receiver.push([b'message', args[1], args[2]])
+        return len(receivers)
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    """Соединение клиента: читает команды RESP и отправляет ответы"""
+
+    def setup(self) -> None:
+        super().setup()
+        self._write_lock = threading.Lock()
+        self._channels: Set[bytes] = set()
+
+    def push(self, value: Any) -> None:
+        try:
+            with self._write_lock:
+                self.wfile.write(_encode(value))
+                self.wfile.flush()
+        except OSError:
+            pass
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self) -> None:
+        store: _Store = self.server.store
+        try:
+            while True:
+                args = self._read_command()
+                if args is None:
+                    return
+                if not args:
+                    continue
+                if args[0].upper() == b'SUBSCRIBE':
+                    with store.lock:
+                        for channel in args[1:]:
+                            store.subscribers.setdefault(channel, set()).add(self)
+                            self._channels.add(channel)
+                    for index, channel in enumerate(args[1:], 1):
+                        self.push([b'subscribe', channel, index])
+                    continue
+                self.push(store.execute(args))
+        except (OSError, ValueError, IndexError) as e:
+            logger.debug(f"Соединение закрыто: {e}")
+        finally:
+            with store.lock:
+                for channel in self._channels:
+                    store.subscribers.get(channel, set()).discard(self)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """Сервер, совместимый с Redis в объеме, нужном общему кэшу"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        super().__init__((host, port), _RedisHandler)
+        self.store = _Store()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+    def start_background(self) -> threading.Thread:
+        """Запускает сервер в фоновом потоке"""
+        thread = threading.Thread(target=self.serve_forever, name='local-redis', daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    import sys
+    server = LocalRedisServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
+    logger.info(f"Локальный Redis запущен: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Локальный Redis остановлен")
@@ -0,0 +1,320 @@
+"""
+Модуль версионированных миграций схемы базы данных
+
+Каждая миграция имеет номер версии и применяется один раз: номера примененных
+миграций хранятся в таблице schema_version. run_migrations вызывается при каждом
+запуске из initialize_database и применяет только недостающие миграции, поэтому
+повторный запуск ничего не меняет. Одновременный запуск нескольких процессов
+защищен блокировкой (advisory lock в PostgreSQL, BEGIN IMMEDIATE в SQLite).
+
+Новые миграции добавляются в конец списка MIGRATIONS со следующим номером версии,
+уже примененные миграции не изменяются.
+"""
+
+from typing import Callable, List, NamedTuple
+from logger import get_component_logger
+from phone_numbers import normalize_phone
+
+# Настройка логирования
+logger = get_component_logger('migrations')
+
+# Ключ advisory lock PostgreSQL, под которым применяются миграции
+MIGRATIONS_LOCK_KEY = 7305001
+
+
+class Migration(NamedTuple):
+    """Миграция схемы: версия, описание и функция apply(cursor, backend)"""
+    version: int
+    description: str
+    apply: Callable
+
+
+def _create_order_technicians(cursor, backend) -> None:
+    """Создает таблицу назначений order_technicians и переносит в нее назначения из assignments"""
+    if backend.is_postgres:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_technicians (
+            assignment_id SERIAL PRIMARY KEY,
+            order_id INTEGER NOT NULL REFERENCES orders(order_id) ON DELETE CASCADE,
+            technician_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            assigned_by BIGINT,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (order_id, technician_id)
+        )
+        """)
+    else:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_technicians (
+            assignment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL REFERENCES orders(order_id) ON DELETE CASCADE,
+            technician_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            assigned_by INTEGER,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (order_id, technician_id)
+        )
+        """)
+
+    # Назначения из старой таблицы assignments (повторы и ссылки на удаленные записи пропускаются)
+    cursor.execute("""
+    INSERT INTO order_technicians (order_id, technician_id, assigned_by, assigned_at)
+    SELECT a.order_id, a.technician_id, MIN(a.assigned_by), MIN(a.assigned_at)
+    FROM assignments a
+    WHERE a.order_id IN (SELECT order_id FROM orders)
+      AND a.technician_id IN (SELECT user_id FROM users)
+      AND NOT EXISTS (
+          SELECT 1 FROM order_technicians ot
+          WHERE ot.order_id = a.order_id AND ot.technician_id = a.technician_id
+      )
+    GROUP BY a.order_id, a.technician_id
+    """)
+
+
+def _create_hot_path_indexes(cursor, backend) -> None:
+    """Создает индексы для частых выборок заказов, назначений, логов и пользователей"""
+    statements = [
+        # get_orders_by_user
+        "CREATE INDEX IF NOT EXISTS idx_orders_dispatcher ON orders (dispatcher_id, created_at)",
+        # get_all_orders(status)
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at)",
+        # get_assigned_orders (UNIQUE (order_id, technician_id) покрывает get_order_technicians)
+        "CREATE INDEX IF NOT EXISTS idx_order_technicians_technician ON order_technicians (technician_id, order_id)",
+        # get_activity_logs по фильтрам и по времени
+        "CREATE INDEX IF NOT EXISTS idx_activity_logs_user ON activity_logs (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_activity_logs_action ON activity_logs (action_type, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_activity_logs_order ON activity_logs (related_order_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_activity_logs_created ON activity_logs (created_at)",
+        # get_technicians и get_users_by_role
+        "CREATE INDEX IF NOT EXISTS idx_users_role_approved ON users (role, is_approved)",
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _create_keyset_indexes(cursor, backend) -> None:
+    """Создает индексы по ключу курсорной пагинации (created_at, id) заказов и логов"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at, order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_created_id ON activity_logs (created_at, log_id)")
+    cursor.execute("DROP INDEX IF EXISTS idx_activity_logs_created")
+
+
+def _add_status_updated_at(cursor, backend) -> None:
+    """Добавляет в заказы время последнего изменения статуса"""
+    cursor.execute("ALTER TABLE orders ADD COLUMN status_updated_at TIMESTAMP")
+    cursor.execute("UPDATE orders SET status_updated_at = created_at")
+
+
+# Столбцы заказа в поисковом индексе в порядке весов ранжирования search_orders
+SEARCH_COLUMNS = ('client_phone', 'client_name', 'client_address', 'problem_description')
+
+
+def _sqlite_search_values(row: str) -> str:
+    """
+    Выражения значений столбцов поискового индекса SQLite для строки new или old триггера.
+    Телефон индексируется только цифрами: полным номером и последними 10 цифрами
+    (номер находится и с 8, и с +7)
+    """
+    digits = f"{row}.client_phone"
+    for separator in ('+', ' ', '-', '(', ')', '.'):
+        digits = f"REPLACE({digits}, '{separator}', '')"
+    phone = f"{digits} || ' ' || SUBSTR({digits}, -10)"
+    return ', '.join([phone] + [f"{row}.{column}" for column in SEARCH_COLUMNS[1:]])
+
+
+def _create_order_search(cursor, backend) -> None:
+    """
+    Создает полнотекстовый индекс заказов (FTS5 в SQLite, tsvector с GIN в PostgreSQL).
+    Индекс обновляется триггерами в той же транзакции, что и изменение заказа
+    """
+    columns = ', '.join(SEARCH_COLUMNS)
+    if backend.is_postgres:
+        # Отдельная таблица, чтобы tsvector не попадал в SELECT * FROM orders
+        cursor.execute(r"""
+        CREATE OR REPLACE FUNCTION order_search_document(phone TEXT, name TEXT, address TEXT, problem TEXT)
+        RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('simple', regexp_replace(coalesce(phone, ''), '\D', '', 'g') || ' ' ||
+                                                   right(regexp_replace(coalesce(phone, ''), '\D', '', 'g'), 10)), 'A')
+                || setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+                || setweight(to_tsvector('simple', coalesce(address, '')), 'B')
+                || setweight(to_tsvector('simple', coalesce(problem, '')), 'C')
+        $$ LANGUAGE SQL IMMUTABLE
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_search (
+            order_id INTEGER PRIMARY KEY REFERENCES orders(order_id) ON DELETE CASCADE,
+            document tsvector NOT NULL
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_search_document ON order_search USING GIN (document)")
+        cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION order_search_refresh() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO order_search (order_id, document)
+            VALUES (NEW.order_id, order_search_document({', '.join(f'NEW.{column}' for column in SEARCH_COLUMNS)}))
+            ON CONFLICT (order_id) DO UPDATE SET document = EXCLUDED.document;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("DROP TRIGGER IF EXISTS orders_search_refresh ON orders")
+        cursor.execute(f"""
+        CREATE TRIGGER orders_search_refresh AFTER INSERT OR UPDATE OF {columns} ON orders
+        FOR EACH ROW EXECUTE PROCEDURE order_search_refresh()
+        """)
+        cursor.execute(f"""
+        INSERT INTO order_search (order_id, document)
+        SELECT order_id, order_search_document({columns}) FROM orders
+        ON CONFLICT (order_id) DO NOTHING
+        """)
+        return
+
+    # Индекс без копии текста (content=''): записи удаляются командой 'delete' с прежними значениями
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        {columns}, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    insert = f"INSERT INTO orders_fts (rowid, {columns}) VALUES (new.order_id, {_sqlite_search_values('new')});"
+    delete = (f"INSERT INTO orders_fts (orders_fts, rowid, {columns}) "
+              f"VALUES ('delete', old.order_id, {_sqlite_search_values('old')});")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN {insert} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN {delete} END")
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_update AFTER UPDATE OF {columns} ON orders
+    BEGIN {delete} {insert} END
+    """)
+    cursor.execute(f"""
+    INSERT INTO orders_fts (rowid, {columns})
+    SELECT new.order_id, {_sqlite_search_values('new')} FROM orders new
+    """)
+
+
+def _create_clients(cursor, backend) -> None:
+    """
+    Добавляет в заказы телефон клиента в формате E.164 с индексом и создает таблицу
+    клиентов clients, заполняя ее по уже созданным заказам
+    """
+    cursor.execute("ALTER TABLE orders ADD COLUMN client_phone_e164 TEXT")
+    cursor.execute("SELECT order_id, client_phone FROM orders")
+    phones = [(normalize_phone(phone), order_id) for order_id, phone in cursor.fetchall()]
+    cursor.executemany(
+        f"UPDATE orders SET client_phone_e164 = {backend.placeholder} WHERE order_id = {backend.placeholder}",
+        [row for row in phones if row[0] is not None]
+    )
+    # Последние заказы клиента читаются по индексу без сортировки
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_client_phone ON orders (client_phone_e164, created_at, order_id)")
+
+    client_id = "SERIAL PRIMARY KEY" if backend.is_postgres else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS clients (
+        client_id {client_id},
+        phone_e164 TEXT NOT NULL UNIQUE,
+        client_name TEXT,
+        client_address TEXT,
+        orders_count INTEGER NOT NULL DEFAULT 0,
+        first_order_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_order_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Имя и адрес клиента берутся из его последнего заказа
+    cursor.execute("""
+    INSERT INTO clients (phone_e164, client_name, client_address, orders_count, first_order_at, last_order_at)
+    SELECT o.client_phone_e164, o.client_name, o.client_address, g.orders_count, g.first_order_at, g.last_order_at
+    FROM (
+        SELECT client_phone_e164, COUNT(*) AS orders_count, MIN(created_at) AS first_order_at,
+               MAX(created_at) AS last_order_at, MAX(order_id) AS last_order_id
+        FROM orders
+        WHERE client_phone_e164 IS NOT NULL
+        GROUP BY client_phone_e164
+    ) g
+    JOIN orders o ON o.order_id = g.last_order_id
+    """)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Таблица назначений order_technicians", _create_order_technicians),
+    Migration(2, "Индексы для частых выборок", _create_hot_path_indexes),
+    Migration(3, "Индексы для курсорной пагинации", _create_keyset_indexes),
+    Migration(4, "Время изменения статуса заказа", _add_status_updated_at),
+    Migration(5, "Полнотекстовый поиск заказов", _create_order_search),
+    Migration(6, "Телефоны клиентов в формате E.164 и таблица клиентов", _create_clients),
+]
+
+
+def _ensure_version_table(conn) -> None:
+    """Создает таблицу schema_version, если ее нет"""
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+
+def _lock(cursor, backend) -> None:
+    """Начинает транзакцию миграций, блокируя их применение другими процессами до commit"""
+    if backend.is_postgres:
+        cursor.execute(f"SELECT pg_advisory_xact_lock({MIGRATIONS_LOCK_KEY})")
+    else:
+        cursor.execute("BEGIN IMMEDIATE")
+
+
+def get_schema_version(conn) -> int:
+    """
+    Возвращает номер последней примененной миграции
+
+    Args:
+        conn: Соединение с базой данных
+
+    Returns:
+        int: Версия схемы (0, если миграции не применялись)
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def run_migrations(conn, backend) -> List[int]:
+    """
+    Применяет недостающие миграции в одной транзакции: при ошибке не применяется ни одна
+
+    Args:
+        conn: Соединение с базой данных
+        backend: Параметры базы данных (DatabaseBackend)
+
+    Returns:
+        List[int]: Версии примененных миграций (пустой список, если схема актуальна)
+    """
+    _ensure_version_table(conn)
+
+    cursor = conn.cursor()
+    try:
+        _lock(cursor, backend)
+        # Версии читаются под блокировкой: другой процесс мог успеть применить миграции
+        cursor.execute("SELECT version FROM schema_version")
+        applied_versions = {row[0] for row in cursor.fetchall()}
+
+        applied = []
+        for migration in MIGRATIONS:
+            if migration.version in applied_versions:
+                continue
+            logger.info(f"Применение миграции {migration.version}: {migration.description}")
+            migration.apply(cursor, backend)
+            cursor.execute(
+                f"INSERT INTO schema_version (version, description) VALUES ({backend.placeholders(2)})",
+                (migration.version, migration.description)
+            )
+            applied.append(migration.version)
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при применении миграций: {e}")
+        raise
+
+    if applied:
+        logger.info(f"Схема обновлена до версии {applied[-1]}")
+    return applied
@@ -1,7 +1,8 @@
 """
 Модели данных для работы с БД
 """
-from typing import Dict, Optional, List
+import datetime
+from typing import Any, Dict, Optional, List, NamedTuple, Tuple
 from config import ORDER_STATUSES
 
 
@@ -362,4 +363,74 @@ class ProblemTemplate:
             'created_by': self.created_by,
             'is_active': self.is_active,
             'created_at': self.created_at
-        }
\ No newline at end of file
+        }
+
+
+class Page(NamedTuple):
+    """
+    Страница выборки с курсорной (keyset) пагинацией: записи в порядке от новых к старым
+    и ключи (created_at в микросекундах, ID) для перехода к соседним страницам
+    (None, если в этом направлении записей нет)
+    """
+    items: List[Dict]
+    older: Optional[Tuple[int, int]] = None
+    newer: Optional[Tuple[int, int]] = None
+
+
+class OrderView(NamedTuple):
+    """
+    Заказ для карточки заказа, прочитанный одним запросом: данные заказа (включая время
+    последнего изменения статуса status_updated_at), диспетчер и назначенные мастера
+    """
+    order: Dict[str, Any]
+    dispatcher: Optional[Dict[str, Any]] = None
+    technicians: List[Dict[str, Any]] = []
+
+    @property
+    def order_id(self) -> int:
+        return self.order['order_id']
+
+    @property
+    def status_changed_at(self) -> Optional[datetime.datetime]:
+        """Время последнего изменения статуса"""
+        return UserStateSnapshot.parse_timestamp(self.order.get('status_updated_at'))
+
+    def is_assigned_to(self, user_id: int) -> bool:
+        """Проверяет, назначен ли заказ мастеру"""
+        return any(technician['user_id'] == user_id for technician in self.technicians)
+
+
+class ClientHistory(NamedTuple):
+    """
+    Клиент из таблицы clients (телефон E.164, последние имя и адрес, число заказов)
+    и его последние заказы от новых к старым
+    """
+    client: Dict[str, Any]
+    orders: List[Dict[str, Any]] = []
+
+    @property
+    def orders_count(self) -> int:
+        return self.client.get('orders_count') or 0
+
+
+class UserStateSnapshot(NamedTuple):
+    """
+    Состояние диалога пользователя, прочитанное за одно обращение:
+    состояние, ID текущего заказа и время последнего изменения
+    """
+    state: str
+    order_id: Optional[int] = None
+    updated_at: Optional[datetime.datetime] = None
+
+    @staticmethod
+    def parse_timestamp(value: Any) -> Optional[datetime.datetime]:
+        """
+        Приводит значение updated_at из БД к datetime
+        (SQLite возвращает строку, PostgreSQL - datetime)
+        """
+        if value is None or isinstance(value, datetime.datetime):
+            return value
+        try:
+            return datetime.datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
@@ -0,0 +1,391 @@
+"""
+Очередь исходящих сообщений Telegram с ограничением скорости
+
+Сообщения ставятся в очередь и отправляются фоновыми потоками, поэтому обработчик,
+рассылающий уведомления, не ждет ответов Telegram. Скорость отправки ограничивается
+двумя корзинами токенов: общей для бота и отдельной для каждого чата (лимиты Telegram -
+около 30 сообщений в секунду всего и около 1 сообщения в секунду в один чат).
+Сообщения отправляются по приоритетам: ответы пользователю, затем уведомления, затем
+рассылки. Сообщения одного чата уходят по порядку.
+
+При ответе 429 сообщение повторяется через указанное Telegram время retry_after, а чат
+до этого момента не получает других сообщений. Сетевые ошибки повторяются с растущей
+задержкой, ошибки запроса (чат не найден, бот заблокирован) не повторяются.
+
+Настройки из переменных окружения:
+    OUTBOUND_WORKERS       - число потоков отправки (по умолчанию 4)
+    OUTBOUND_GLOBAL_RATE   - сообщений в секунду для всего бота (по умолчанию 25)
+    OUTBOUND_CHAT_RATE     - сообщений в секунду в один чат (по умолчанию 1)
+    OUTBOUND_CHAT_BURST    - сколько сообщений можно отправить в чат подряд (по умолчанию 3)
+    OUTBOUND_QUEUE_SIZE    - максимум сообщений в очереди (по умолчанию 10000)
+    OUTBOUND_MAX_ATTEMPTS  - максимум попыток отправки одного сообщения (по умолчанию 5)
+"""
+
+import os
+import time
+import atexit
+import itertools
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from logger import get_component_logger
+
+try:
+    from telebot.apihelper import ApiTelegramException
+except ImportError:
+    ApiTelegramException = None
+
+# Настройка логирования
+logger = get_component_logger('outbound_queue')
+
+# Приоритеты (чем меньше значение, тем раньше отправка)
+# Обработчики отвечают пользователю синхронно; PRIORITY_REPLY - для ответов, поставленных
+# в очередь, чтобы они обгоняли уведомления и рассылки
+PRIORITY_REPLY = 0         # Ответ пользователю на его действие
+PRIORITY_NOTIFICATION = 1  # Уведомление о событии (новый заказ, смена статуса)
+PRIORITY_BROADCAST = 2     # Рассылка многим пользователям
+PRIORITIES = (PRIORITY_REPLY, PRIORITY_NOTIFICATION, PRIORITY_BROADCAST)
+
+# Чатов, после которого из словаря удаляются корзины неактивных чатов
+_BUCKETS_PRUNE_THRESHOLD = 10000
+# Предел задержки повтора при сетевых ошибках, сек
+_MAX_BACKOFF = 60.0
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity накопленных"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд осталось до появления токена (0, если токен есть)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        """Забирает токен (вызывается после проверки wait_time)"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundMessage:
+    """Сообщение в очереди отправки"""
+
+    __slots__ = ('chat_id', 'text', 'kwargs', 'priority', 'seq', 'attempts', 'callback')
+
+    def __init__(self, chat_id: Hashable, text: str, kwargs: Dict[str, Any], priority: int,
+                 seq: int, callback: Optional[Callable[[Any, Optional[Exception]], None]] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        self.callback = callback
+
+
+def _get_retry_after(error: Exception) -> Optional[float]:
+    """Возвращает retry_after из ответа 429 Telegram или None для других ошибок"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result_json = getattr(error, 'result_json', None) or {}
+    parameters = result_json.get('parameters') or {}
+    try:
+        return max(float(parameters.get('retry_after', 1)), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _is_permanent_error(error: Exception) -> bool:
+    """Ошибки запроса, повтор которых не поможет (400, 403 и т.п.)"""
+    if ApiTelegramException is not None and isinstance(error, ApiTelegramException):
+        return error.error_code != 429 and error.error_code < 500
+    error_code = getattr(error, 'error_code', None)
+    return isinstance(error_code, int) and error_code != 429 and error_code < 500
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих сообщений с приоритетами и ограничением скорости.
+    Поток отправки выбирает первое по приоритету сообщение, чат которого не занят
+    другой отправкой, не ждет retry_after и имеет токен в своей корзине.
+    """
+
+    def __init__(self, bot, workers: Optional[int] = None, global_rate: Optional[float] = None,
+                 chat_rate: Optional[float] = None, chat_burst: Optional[float] = None,
+                 max_size: Optional[int] = None, max_attempts: Optional[int] = None):
+        self.bot = bot
+        self.workers = workers or int(os.environ.get('OUTBOUND_WORKERS', 4))
+        self.global_rate = global_rate or float(os.environ.get('OUTBOUND_GLOBAL_RATE', 25))
+        self.chat_rate = chat_rate or float(os.environ.get('OUTBOUND_CHAT_RATE', 1))
+        self.chat_burst = chat_burst or float(os.environ.get('OUTBOUND_CHAT_BURST', 3))
+        self.max_size = max_size or int(os.environ.get('OUTBOUND_QUEUE_SIZE', 10000))
+        self.max_attempts = max_attempts or int(os.environ.get('OUTBOUND_MAX_ATTEMPTS', 5))
+
+        self._lanes: Dict[int, Deque[OutboundMessage]] = {priority: deque() for priority in PRIORITIES}
+        self._global_bucket = TokenBucket(self.global_rate, max(1.0, self.global_rate))
+        self._chat_buckets: Dict[Hashable, TokenBucket] = {}
+        self._blocked_until: Dict[Hashable, float] = {}  # Чаты, ожидающие retry_after/повтора
+        self._busy: set = set()                           # Чаты, сообщение которых сейчас отправляется
+        self._size = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._stopping = False
+
+        # Счетчики
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        """Запускает потоки отправки"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._stopping = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'outbound-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Запущена очередь отправки: потоков {self.workers}, "
+                    f"{self.global_rate}/сек всего, {self.chat_rate}/сек в чат")
+
+    def enqueue(self, chat_id: Hashable, text: str, priority: int = PRIORITY_NOTIFICATION,
+                callback: Optional[Callable[[Any, Optional[Exception]], None]] = None,
+                **kwargs: Any) -> bool:
+        """
+        Ставит сообщение в очередь отправки и сразу возвращает управление
+
+        Args:
+            chat_id: ID чата получателя
+            text: Текст сообщения
+            priority: PRIORITY_REPLY, PRIORITY_NOTIFICATION или PRIORITY_BROADCAST
+            callback: Функция (результат, ошибка), вызываемая после отправки или отказа от нее
+            **kwargs: Параметры bot.send_message (parse_mode, reply_markup и т.д.)
+
+        Returns:
+            bool: True, если сообщение принято, False если очередь заполнена
+        """
+        if priority not in self._lanes:
+            raise ValueError(f"Неизвестный приоритет сообщения: {priority}")
+        with self._lock:
+            if self._size >= self.max_size:
+                self.rejected += 1
+                logger.warning(f"Очередь отправки заполнена, сообщение в чат {chat_id} отклонено")
+                return False
+            self._lanes[priority].append(OutboundMessage(chat_id, text, kwargs, priority, next(self._seq), callback))
+            self._size += 1
+            self.enqueued += 1
+            self._changed.notify()
+        return True
+
+    def _take_next(self, now: float) -> Tuple[Optional[OutboundMessage], Optional[float]]:
+        """
+        Выбирает сообщение для отправки (вызывается под блокировкой)
+
+        Returns:
+            (сообщение или None, через сколько секунд проверить очередь снова или None)
+        """
+        if self._size == 0:
+            return None, None
+        wait = self._global_bucket.wait_time(now)
+        if wait > 0:
+            return None, wait
+
+        wait = None
+        skipped = set()  # Чаты, пропущенные в этом проходе: их более поздние сообщения тоже ждут
+        for priority in PRIORITIES:
+            lane = self._lanes[priority]
+            for index, message in enumerate(lane):
+                chat_id = message.chat_id
+                if chat_id in skipped:
+                    continue
+                if chat_id in self._busy:
+                    skipped.add(chat_id)
+                    continue
+                blocked_until = self._blocked_until.get(chat_id)
+                if blocked_until is not None:
+                    if blocked_until > now:
+                        skipped.add(chat_id)
+                        wait = min(wait, blocked_until - now) if wait is not None else blocked_until - now
+                        continue
+                    del self._blocked_until[chat_id]
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+                chat_wait = bucket.wait_time(now)
+                if chat_wait > 0:
+                    skipped.add(chat_id)
+                    wait = min(wait, chat_wait) if wait is not None else chat_wait
+                    continue
+
+                del lane[index]
+                self._size -= 1
+                self._global_bucket.consume(now)
+                bucket.consume(now)
+                self._busy.add(chat_id)
+                return message, None
+        return None, wait
+
+    def _prune_buckets(self, now: float) -> None:
+        """Удаляет корзины чатов, которые давно ничего не получали (вызывается под блокировкой)"""
+        if len(self._chat_buckets) < _BUCKETS_PRUNE_THRESHOLD:
+            return
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._busy and bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                while True:
+                    message, wait = self._take_next(time.monotonic())
+                    if message is not None:
+                        break
+                    if self._stopping and self._size == 0:
+                        return
+                    self._changed.wait(wait)
+            self._send(message)
+
+    def _send(self, message: OutboundMessage) -> None:
+        message.attempts += 1
+        result = None
+        error = None
+        try:
+            result = self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+        except Exception as e:
+            error = e
+
+        finished = True
+        with self._lock:
+            self._busy.discard(message.chat_id)
+            now = time.monotonic()
+            if error is None:
+                self.sent += 1
+            else:
+                retry_after = _get_retry_after(error)
+                if retry_after is not None:
+                    self.rate_limited += 1
+                    delay = retry_after
+                elif not _is_permanent_error(error):
+                    delay = min(2 ** (message.attempts - 1), _MAX_BACKOFF)
+                else:
+                    delay = None
+
+                if delay is not None and message.attempts < self.max_attempts:
+                    # Сообщение возвращается на свое место: остальные сообщения чата ждут его
+                    finished = False
+                    self.retried += 1
+                    self._blocked_until[message.chat_id] = now + delay
+                    self._lanes[message.priority].appendleft(message)
+                    self._size += 1
+                    logger.warning(f"Повтор отправки в чат {message.chat_id} через {delay:.1f} сек "
+                                   f"(попытка {message.attempts}): {error}")
+                else:
+                    self.dropped += 1
+                    logger.error(f"Не удалось отправить сообщение в чат {message.chat_id} "
+                                 f"(попыток: {message.attempts}): {error}")
+            self._prune_buckets(now)
+            self._changed.notify_all()
+            if self._size == 0 and not self._busy:
+                self._idle.notify_all()
+
+        if finished and message.callback is not None:
+            try:
+                message.callback(result, error)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике результата отправки в чат {message.chat_id}: {e}")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет отправки всех сообщений
+
+        Returns:
+            bool: True, если очередь опустела, False если истекло время ожидания
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._size == 0 and not self._busy, timeout)
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Пытается отправить оставшиеся сообщения и останавливает потоки"""
+        if not self._running:
+            return
+        if not self.join(timeout):
+            logger.warning(f"При остановке не отправлено сообщений: {self._size}")
+        with self._lock:
+            self._running = False
+            self._stopping = True
+            # Неотправленные сообщения отбрасываются, чтобы потоки завершились
+            for lane in self._lanes.values():
+                self.dropped += len(lane)
+                lane.clear()
+            self._size = 0
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает размер очереди по приоритетам и счетчики отправки"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._size,
+                'queued_by_priority': {priority: len(lane) for priority, lane in self._lanes.items()},
+                'in_flight': len(self._busy),
+                'blocked_chats': len(self._blocked_until),
+                'enqueued': self.enqueued,
+                'sent': self.sent,
+                'retried': self.retried,
+                'rate_limited': self.rate_limited,
+                'dropped': self.dropped,
+                'rejected': self.rejected
+            }
+
+
+_queue: Optional[OutboundQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_outbound_queue(bot) -> OutboundQueue:
+    """Возвращает очередь отправки, создавая и запуская ее при первом обращении"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                outbound = OutboundQueue(bot)
+                outbound.start()
+                atexit.register(outbound.stop)
+                _queue = outbound
+    return _queue
+
+
+def enqueue_message(bot, chat_id: Hashable, text: str, priority: int = PRIORITY_NOTIFICATION,
+                    **kwargs: Any) -> bool:
+    """Ставит сообщение в общую очередь отправки (см. OutboundQueue.enqueue)"""
+    return get_outbound_queue(bot).enqueue(chat_id, text, priority, **kwargs)
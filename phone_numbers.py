@@ -0,0 +1,59 @@
+"""
+Нормализация номеров телефонов клиентов к формату E.164 (+<код страны><номер>)
+
+Номер без кода страны (10 цифр) и российский номер с 8 в начале приводятся к коду
+страны по умолчанию. Номер с "+" или международным префиксом 00 считается уже
+содержащим код страны.
+
+Настройки из переменных окружения:
+    PHONE_DEFAULT_COUNTRY_CODE - код страны для номеров без него (по умолчанию 7)
+"""
+
+import os
+import re
+from typing import Optional
+
+# Код страны для номеров, введенных без него
+DEFAULT_COUNTRY_CODE = os.environ.get('PHONE_DEFAULT_COUNTRY_CODE', '7')
+
+# Допустимое количество цифр номера вместе с кодом страны (E.164 - не более 15)
+MIN_PHONE_DIGITS = 10
+MAX_PHONE_DIGITS = 15
+
+# Разделители, допустимые между цифрами номера
+_PHONE_SEPARATORS = re.compile(r'[\s\-().]')
+
+
+def normalize_phone(phone: Optional[str], country_code: Optional[str] = None) -> Optional[str]:
+    """
+    Приводит номер телефона к формату E.164
+
+    Args:
+        phone: Номер в произвольном формате ("8 (999) 123-45-67", "+7 999 1234567", ...)
+        country_code: Код страны для номеров без него (по умолчанию DEFAULT_COUNTRY_CODE)
+
+    Returns:
+        Optional[str]: Номер вида +79991234567 или None, если строка не является номером
+    """
+    if not phone:
+        return None
+    country_code = country_code or DEFAULT_COUNTRY_CODE
+
+    number = _PHONE_SEPARATORS.sub('', phone.strip())
+    international = number.startswith('+')
+    if international:
+        number = number[1:]
+    elif number.startswith('00'):
+        international = True
+        number = number[2:]
+    if not number.isdigit() or not MIN_PHONE_DIGITS <= len(number) <= MAX_PHONE_DIGITS:
+        return None
+
+    if not international:
+        if len(number) == 10:
+            number = country_code + number
+        elif len(number) == 11 and number.startswith('8') and country_code == '7':
+            number = country_code + number[1:]
+    if len(number) > MAX_PHONE_DIGITS:
+        return None
+    return '+' + number
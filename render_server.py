@@ -8,6 +8,9 @@ import threading
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
 import traceback
+from webhook_receiver import (
+    WEBHOOK_PATH, SECRET_HEADER, MAX_BODY_BYTES, get_webhook_receiver, is_webhook_mode, verify_secret_token
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,6 +22,10 @@ logger = logging.getLogger('render_server')
 # Определяем порт из переменной окружения Render или используем порт по умолчанию
 PORT = int(os.environ.get('PORT', 10000))
 
+# Заголовок с токеном для /cache-stats. Токен задается переменной CACHE_STATS_TOKEN;
+# без нее статистика кэша не отдается (ключи и размеры кэша видны только с токеном)
+CACHE_STATS_TOKEN_HEADER = 'X-Cache-Stats-Token'
+
 # Простой обработчик HTTP-запросов
 class BotStatusHandler(BaseHTTPRequestHandler):
     """Простой обработчик HTTP запросов для статуса бота"""
@@ -38,7 +45,7 @@ class BotStatusHandler(BaseHTTPRequestHandler):
                 'status': 'running',
                 'service': 'telegram_bot',
                 'uptime': get_uptime(),
-                'message': 'Бот работает в режиме polling'
+                'message': 'Бот работает в режиме webhook' if is_webhook_mode() else 'Бот работает в режиме polling'
             }
             self.wfile.write(json.dumps(response).encode())
         elif self.path == '/health':
@@ -46,12 +53,52 @@ class BotStatusHandler(BaseHTTPRequestHandler):
             self._set_headers()
             response = {'status': 'ok'}
             self.wfile.write(json.dumps(response).encode())
+        elif self.path == '/cache-stats':
+            # Статистика кэша по типам для подбора TTL и размеров
+            token = os.environ.get('CACHE_STATS_TOKEN')
+            if not token:
+                self._set_headers(404)
+                self.wfile.write(json.dumps({'error': 'Not Found'}).encode())
+                return
+            if not verify_secret_token(self.headers.get(CACHE_STATS_TOKEN_HEADER), token):
+                logger.warning('Запрос статистики кэша с неверным токеном отклонен')
+                self._set_headers(403)
+                self.wfile.write(json.dumps({'error': 'Forbidden'}).encode())
+                return
+            from cache import cache_stats
+            self._set_headers()
+            self.wfile.write(json.dumps(cache_stats(), ensure_ascii=False).encode())
         else:
             # Неизвестный путь
             self._set_headers(404)
             response = {'error': 'Not Found'}
             self.wfile.write(json.dumps(response).encode())
     
+    def do_POST(self):
+        """Обрабатывает POST запросы (webhook Telegram)"""
+        if self.path != WEBHOOK_PATH or not is_webhook_mode():
+            self._set_headers(404)
+            self.wfile.write(json.dumps({'error': 'Not Found'}).encode())
+            return
+        
+        # Токен проверяется до создания приемника: запрос без токена не запускает потоки обработки
+        if not verify_secret_token(self.headers.get(SECRET_HEADER)):
+            logger.warning('Запрос webhook с неверным секретным токеном отклонен')
+            self._set_headers(403)
+            self.wfile.write(json.dumps({'ok': False, 'description': 'Forbidden'}).encode())
+            return
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self._set_headers(413)
+            self.wfile.write(json.dumps({'ok': False, 'description': 'Payload Too Large'}).encode())
+            return
+        
+        body = self.rfile.read(length)
+        status, description = get_webhook_receiver().handle(self.headers.get(SECRET_HEADER), body)
+        self._set_headers(status)
+        self.wfile.write(json.dumps({'ok': status == 200, 'description': description}).encode())
+    
     def log_message(self, format, *args):
         """Переопределяем логирование, чтобы использовать наш логгер"""
         logger.info("%s - %s" % (self.address_string(), format % args))
@@ -86,8 +133,34 @@ def run_http_server():
         logger.error(f'Ошибка HTTP сервера: {e}')
         logger.error(traceback.format_exc())
 
+def run_webhook_bot():
+    """
+    Запускает бота в режиме webhook: регистрирует webhook в Telegram и ждет завершения,
+    обновления принимает HTTP сервер. Задержки на сброс webhook и ожидание polling не нужны.
+    """
+    import time
+    logger.info('Запуск Telegram бота в режиме webhook...')
+    receiver = get_webhook_receiver()
+    try:
+        receiver.set_webhook()
+    except Exception as e:
+        logger.error(f'Ошибка при регистрации webhook: {e}')
+        logger.error(traceback.format_exc())
+        return
+    
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info('Получен сигнал завершения, останавливаем обработку обновлений...')
+        receiver.stop()
+
 def run_telegram_bot():
     """Запускает Telegram бот через render_bot.py"""
+    if is_webhook_mode():
+        run_webhook_bot()
+        return
+    
     logger.info('Запуск Telegram бота...')
     
     # Проверяем, не запущен ли уже бот с этим токеном
@@ -156,6 +229,10 @@ def run_telegram_bot():
 def main():
     """Основная функция для запуска бота и веб-сервера в разных потоках"""
     try:
+        # Ошибка настройки общего кэша останавливает запуск до приема обновлений
+        from cache import init_cache_backend
+        init_cache_backend()
+        
         # Запускаем HTTP сервер в отдельном потоке
         http_thread = threading.Thread(target=run_http_server)
         http_thread.daemon = True  # Поток завершится, когда завершится основной
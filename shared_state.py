@@ -6,6 +6,8 @@ from typing import Optional
 import os
 import telebot
 from logger import get_component_logger, log_function_call
+from state_store import get_state_store
+from models import UserStateSnapshot
 
 # Настройка логирования
 logger = get_component_logger('shared_state')
@@ -34,27 +36,23 @@ def set_user_state(user_id: int, state: str, order_id: Optional[int] = None) ->
     """
     Устанавливает состояние пользователя
     """
-    from database import set_user_state as db_set_user_state
     logger.debug(f"Установка состояния для пользователя {user_id}: {state}, order_id={order_id}")
-    # Передаём order_id как есть, в database.py уже предусмотрен параметр по умолчанию None
-    db_set_user_state(user_id, state, order_id)
+    get_state_store().set_state(user_id, state, order_id)
 
 @log_function_call(logger)
 def clear_user_state(user_id: int) -> None:
     """
     Очищает состояние пользователя
     """
-    from database import clear_user_state as db_clear_user_state
     logger.debug(f"Очистка состояния для пользователя {user_id}")
-    db_clear_user_state(user_id)
+    get_state_store().clear_state(user_id)
 
 @log_function_call(logger)
 def get_user_state(user_id: int) -> Optional[str]:
     """
     Возвращает текущее состояние пользователя
     """
-    from database import get_user_state as db_get_user_state
-    state = db_get_user_state(user_id)
+    state = get_state_store().get_state(user_id)
     logger.debug(f"Получено состояние пользователя {user_id}: {state}")
     return state
 
@@ -63,7 +61,15 @@ def get_current_order_id(user_id: int) -> Optional[int]:
     """
     Возвращает ID текущего заказа пользователя
     """
-    from database import get_current_order_id as db_get_current_order_id
-    order_id = db_get_current_order_id(user_id)
+    order_id = get_state_store().get_order_id(user_id)
     logger.debug(f"Получен текущий order_id для пользователя {user_id}: {order_id}")
-    return order_id
\ No newline at end of file
+    return order_id
+
+@log_function_call(logger)
+def get_user_state_snapshot(user_id: int) -> Optional[UserStateSnapshot]:
+    """
+    Возвращает состояние пользователя, ID текущего заказа и время изменения за одно обращение
+    """
+    snapshot = get_state_store().get_snapshot(user_id)
+    logger.debug(f"Получен снимок состояния пользователя {user_id}: {snapshot}")
+    return snapshot
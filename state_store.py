@@ -0,0 +1,255 @@
+"""
+Хранилище состояний диалога пользователей (FSM)
+
+Поддерживаются два варианта, выбираемые переменной окружения USER_STATE_STORE:
+- memory (по умолчанию) - состояния хранятся в словаре в памяти процесса и
+  асинхронно записываются в таблицу user_states (write-behind) для восстановления
+  после перезапуска; при старте состояния загружаются из таблицы
+- database - каждое обращение идет напрямую в таблицу user_states
+
+Хранилище в памяти рассчитано на один процесс бота: несколько процессов
+(например, процесс webhook flask_app и процесс polling) не видят изменения состояний
+друг друга. Поэтому процесс, создающий хранилище в памяти, берет блокировку файла
+USER_STATE_LOCK_PATH; если ее уже держит другой процесс этой машины, используется
+хранилище database. Процессы на разных машинах блокировка не обнаруживает - для них
+нужно явно задать USER_STATE_STORE=database.
+"""
+
+import os
+import atexit
+import datetime
+import tempfile
+import threading
+from typing import Dict, Optional
+from logger import get_component_logger
+from models import UserStateSnapshot
+
+# Настройка логирования
+logger = get_component_logger('state_store')
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+# Маркер удаления состояния в очереди записи
+_DELETED = object()
+
+
+class DatabaseStateStore:
+    """Состояния пользователей, хранящиеся только в таблице user_states"""
+
+    def load(self) -> int:
+        """Загрузка не требуется - данные читаются из таблицы при каждом обращении"""
+        return 0
+
+    def get_snapshot(self, user_id: int) -> Optional[UserStateSnapshot]:
+        from database import get_user_state_snapshot
+        return get_user_state_snapshot(user_id)
+
+    def get_state(self, user_id: int) -> Optional[str]:
+        from database import get_user_state
+        return get_user_state(user_id)
+
+    def get_order_id(self, user_id: int) -> Optional[int]:
+        from database import get_current_order_id
+        return get_current_order_id(user_id)
+
+    def set_state(self, user_id: int, state: str, order_id: Optional[int] = None) -> None:
+        from database import set_user_state
+        set_user_state(user_id, state, order_id)
+
+    def clear_state(self, user_id: int) -> None:
+        from database import clear_user_state
+        clear_user_state(user_id)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore:
+    """
+    Состояния пользователей в памяти процесса.
+    Если write_behind включен, изменения записываются в user_states фоновым потоком:
+    несколько изменений одного пользователя между записями объединяются в одну запись.
+    Если выключен, запись выполняется синхронно, а чтение все равно идет из памяти.
+    """
+
+    def __init__(self, write_behind: bool = True, flush_interval: float = 0.5):
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._states: Dict[int, UserStateSnapshot] = {}
+        self._pending: Dict[int, object] = {}  # user_id -> UserStateSnapshot или _DELETED
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Не допускает параллельной записи одного пользователя
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+        if self.write_behind:
+            self._writer = threading.Thread(target=self._writer_loop, name='user-state-writer', daemon=True)
+            self._writer.start()
+
+    def load(self) -> int:
+        """
+        Загружает сохраненные состояния из таблицы user_states
+
+        Returns:
+            int: Количество загруженных состояний
+        """
+        from database import get_all_user_states
+        rows = get_all_user_states()
+        with self._lock:
+            for user_id, snapshot in rows.items():
+                # Изменения, сделанные до загрузки, новее сохраненных
+                if user_id not in self._pending:
+                    self._states[user_id] = snapshot
+        logger.info(f"Загружено состояний пользователей: {len(rows)}")
+        return len(rows)
+
+    def get_snapshot(self, user_id: int) -> Optional[UserStateSnapshot]:
+        return self._states.get(user_id)
+
+    def get_state(self, user_id: int) -> Optional[str]:
+        snapshot = self._states.get(user_id)
+        return snapshot.state if snapshot else None
+
+    def get_order_id(self, user_id: int) -> Optional[int]:
+        snapshot = self._states.get(user_id)
+        return snapshot.order_id if snapshot else None
+
+    def set_state(self, user_id: int, state: str, order_id: Optional[int] = None) -> None:
+        # Время в UTC, как CURRENT_TIMESTAMP в таблице user_states
+        updated_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        entry = UserStateSnapshot(state, order_id, updated_at)
+        with self._lock:
+            self._states[user_id] = entry
+            if self.write_behind:
+                self._pending[user_id] = entry
+        if self.write_behind:
+            self._wakeup.set()
+        else:
+            self._write(user_id, entry)
+
+    def clear_state(self, user_id: int) -> None:
+        with self._lock:
+            self._states.pop(user_id, None)
+            if self.write_behind:
+                self._pending[user_id] = _DELETED
+        if self.write_behind:
+            self._wakeup.set()
+        else:
+            self._write(user_id, _DELETED)
+
+    @staticmethod
+    def _write(user_id: int, entry) -> bool:
+        """Записывает одно изменение в таблицу user_states"""
+        from database import set_user_state, clear_user_state
+        try:
+            if entry is _DELETED:
+                return clear_user_state(user_id)
+            return set_user_state(user_id, entry.state, entry.order_id)
+        except Exception as e:
+            logger.error(f"Ошибка при записи состояния пользователя {user_id}: {e}")
+            return False
+
+    def flush(self) -> None:
+        """Записывает все накопленные изменения в таблицу user_states"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            failed = {}
+            for user_id, entry in pending.items():
+                if not self._write(user_id, entry):
+                    failed[user_id] = entry
+
+            if failed:
+                logger.warning(f"Не удалось записать состояния {len(failed)} пользователей, повтор при следующей записи")
+                with self._lock:
+                    for user_id, entry in failed.items():
+                        # Более новое изменение, появившееся за время записи, не перезаписываем
+                        self._pending.setdefault(user_id, entry)
+
+    def _writer_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Небольшая задержка позволяет объединить несколько изменений в одну запись
+            self._stopped.wait(self.flush_interval)
+            self.flush()
+
+    def close(self) -> None:
+        """Останавливает фоновую запись и сохраняет оставшиеся изменения"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        self.flush()
+
+
+_store = None
+_store_lock = threading.Lock()
+_process_lock_fd: Optional[int] = None  # Файл блокировки, открытый до завершения процесса
+
+
+def _acquire_process_lock() -> bool:
+    """
+    Берет блокировку файла USER_STATE_LOCK_PATH, подтверждающую, что состояния в памяти
+    хранит только этот процесс машины
+
+    Returns:
+        bool: False, если блокировку держит другой процесс
+    """
+    global _process_lock_fd
+    if fcntl is None or _process_lock_fd is not None:
+        return True
+    path = os.environ.get('USER_STATE_LOCK_PATH') or os.path.join(tempfile.gettempdir(), 'service_bot_user_states.lock')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _process_lock_fd = fd
+    return True
+
+
+def _create_store():
+    """Создает хранилище по настройкам из переменных окружения"""
+    store_type = os.environ.get('USER_STATE_STORE', 'memory').lower()
+    if store_type == 'database':
+        logger.info("Состояния пользователей хранятся в базе данных")
+        return DatabaseStateStore()
+    if not _acquire_process_lock():
+        logger.warning("Состояния пользователей в памяти уже хранит другой процесс бота: "
+                       "используется хранилище database, чтобы процессы не расходились")
+        return DatabaseStateStore()
+
+    write_behind = os.environ.get('USER_STATE_WRITE_BEHIND', 'true').lower() not in ('0', 'false', 'no')
+    store = MemoryStateStore(
+        write_behind=write_behind,
+        flush_interval=float(os.environ.get('USER_STATE_FLUSH_INTERVAL', 0.5))
+    )
+    try:
+        store.load()
+    except Exception as e:
+        logger.error(f"Не удалось загрузить состояния пользователей: {e}")
+    atexit.register(store.close)
+    logger.info(f"Состояния пользователей хранятся в памяти (write-behind: {write_behind})")
+    return store
+
+
+def get_state_store():
+    """Возвращает хранилище состояний, создавая его при первом обращении"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
@@ -0,0 +1,26 @@
+"""
+Общие фикстуры тестов
+"""
+
+import pytest
+
+
+@pytest.fixture
+def sqlite_database(monkeypatch, tmp_path):
+    """
+    Модуль database, работающий с новой базой SQLite во временном каталоге.
+    database импортирует psycopg2, поэтому без него тест пропускается.
+    """
+    pytest.importorskip('psycopg2')
+    import cache
+    import database
+    from db_pool import SQLiteConnectionPool
+
+    pool = SQLiteConnectionPool(str(tmp_path / 'bot.db'))
+    monkeypatch.setattr(database, '_backend', database.DatabaseBackend('sqlite', pool))
+    cache.cache_clear()
+    database.initialize_database()
+    yield database
+    database.flush_activity_logs()
+    cache.cache_clear()
+    pool.close_all()
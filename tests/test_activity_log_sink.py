@@ -0,0 +1,241 @@
+"""
+Тесты буферизованной записи логов активности: переполнение буфера, запись пачками,
+повтор при ошибке БД и сброс при завершении процесса
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import activity_log_sink
+from activity_log_sink import OVERFLOW_BLOCK, OVERFLOW_DROP, ActivityLogSink, flush_activity_logs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingWriter:
+    """Запоминает записанные пачки; первые failures вызовов завершаются ошибкой"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.batches = []
+
+    def __call__(self, entries):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("database is locked")
+        self.batches.append([entry.action_type for entry in entries])
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_drop_policy_rejects_entries_over_limit():
+    sink = ActivityLogSink(RecordingWriter(), max_size=2, overflow=OVERFLOW_DROP)
+    assert sink.add(1, 'a', 'first')
+    assert sink.add(1, 'b', 'second')
+    started = time.monotonic()
+    assert not sink.add(1, 'c', 'third')
+    # Политика drop не ждет места в буфере
+    assert time.monotonic() - started < 0.5
+    stats = sink.get_stats()
+    assert stats['buffered'] == 2 and stats['added'] == 2 and stats['dropped'] == 1
+
+
+def test_block_policy_waits_for_space_then_drops_after_timeout():
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=2, flush_interval=60, max_size=2,
+                           overflow=OVERFLOW_BLOCK, block_timeout=0.1)
+    sink.add(1, 'a', 'first')
+    sink.add(1, 'b', 'second')
+
+    # Поток записи не запущен: место не освобождается до истечения block_timeout
+    started = time.monotonic()
+    assert not sink.add(1, 'c', 'third')
+    assert time.monotonic() - started >= 0.1
+    assert sink.get_stats()['dropped'] == 1
+
+    sink.block_timeout = 5
+    result = []
+    adder = threading.Thread(target=lambda: result.append(sink.add(1, 'd', 'fourth')))
+    adder.start()
+    time.sleep(0.05)
+    assert adder.is_alive()
+    # Поток записи забирает полную пачку и освобождает место
+    sink.start()
+    adder.join(5)
+    assert result == [True]
+    sink.stop()
+    assert writer.batches == [['a', 'b'], ['d']]
+
+
+def test_full_batch_is_written_without_waiting_for_interval():
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=3, flush_interval=60)
+    sink.start()
+    try:
+        for action in ('a', 'b', 'c', 'd'):
+            sink.add(1, action, action)
+        assert _wait_for(lambda: sink.get_stats()['written'] == 3)
+        assert writer.batches == [['a', 'b', 'c']]
+        assert sink.get_stats()['buffered'] == 1
+
+        # Неполная пачка записывается по flush, не дожидаясь интервала
+        assert sink.flush(timeout=5)
+        assert writer.batches == [['a', 'b', 'c'], ['d']]
+        assert sink.get_stats()['batches'] == 2
+    finally:
+        sink.stop()
+
+
+def test_partial_batch_is_written_after_interval():
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=100, flush_interval=0.05)
+    sink.start()
+    try:
+        sink.add(1, 'a', 'first')
+        assert _wait_for(lambda: writer.batches == [['a']])
+    finally:
+        sink.stop()
+
+
+def test_failed_write_is_retried():
+    writer = RecordingWriter(failures=2)
+    sink = ActivityLogSink(writer, batch_size=10, flush_interval=0.01)
+    sink.start()
+    try:
+        sink.add(1, 'a', 'first')
+        assert sink.flush(timeout=5)
+        assert writer.batches == [['a']]
+        stats = sink.get_stats()
+        assert stats['write_errors'] == 2 and stats['written'] == 1 and stats['dropped'] == 0
+    finally:
+        sink.stop()
+
+
+def test_batch_is_dropped_after_max_attempts():
+    writer = RecordingWriter(failures=100)
+    sink = ActivityLogSink(writer, batch_size=10, flush_interval=0.01)
+    sink.start()
+    try:
+        sink.add(1, 'a', 'first')
+        sink.add(1, 'b', 'second')
+        assert sink.flush(timeout=5)
+        stats = sink.get_stats()
+        assert writer.calls == activity_log_sink._MAX_WRITE_ATTEMPTS
+        assert stats['write_errors'] == activity_log_sink._MAX_WRITE_ATTEMPTS
+        assert stats['dropped'] == 2 and stats['written'] == 0
+    finally:
+        sink.stop()
+
+
+def test_stop_writes_remaining_entries():
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=2, flush_interval=60)
+    sink.start()
+    for action in ('a', 'b', 'c'):
+        sink.add(1, action, action)
+    sink.stop()
+    assert [action for batch in writer.batches for action in batch] == ['a', 'b', 'c']
+    assert sink.get_stats()['buffered'] == 0
+
+
+def test_flush_before_read_writes_buffered_entries(monkeypatch):
+    # Без созданного буфера сбрасывать нечего
+    monkeypatch.setattr(activity_log_sink, '_sink', None)
+    assert flush_activity_logs()
+
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=100, flush_interval=60)
+    sink.start()
+    monkeypatch.setattr(activity_log_sink, '_sink', sink)
+    try:
+        sink.add(1, 'a', 'first')
+        assert flush_activity_logs()
+        assert writer.batches == [['a']]
+    finally:
+        sink.stop()
+
+
+def test_entries_are_written_at_exit(tmp_path):
+    output = tmp_path / 'written.txt'
+    # В дочернем процессе database заменен модулем, записывающим логи в файл
+    script = textwrap.dedent(f"""
+        import sys, types
+
+        def insert_activity_logs(entries):
+            with open({str(output)!r}, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(entry.action_type + '\\n')
+
+        sys.modules['database'] = types.SimpleNamespace(insert_activity_logs=insert_activity_logs)
+
+        from activity_log_sink import get_activity_log_sink
+        sink = get_activity_log_sink()
+        for action in ('a', 'b', 'c'):
+            sink.add(1, action, action)
+    """)
+    env = dict(os.environ, ACTIVITY_LOG_FLUSH_INTERVAL='60', ACTIVITY_LOG_BATCH_SIZE='100')
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True, timeout=30)
+    assert output.read_text(encoding='utf-8').split() == ['a', 'b', 'c']
+
+
+def test_entries_added_after_stop_are_written_immediately():
+    writer = RecordingWriter()
+    sink = ActivityLogSink(writer, batch_size=100, flush_interval=60)
+    sink.start()
+    sink.add(1, 'a', 'first')
+    sink.stop()
+    assert writer.batches == [['a']]
+
+    # Поток записи завершен: запись не остается в буфере, а пишется сразу
+    assert sink.add(1, 'b', 'second')
+    assert writer.batches == [['a'], ['b']]
+    stats = sink.get_stats()
+    assert stats['buffered'] == 0 and stats['added'] == stats['written'] == 2
+
+    failing = ActivityLogSink(RecordingWriter(failures=1), batch_size=100, flush_interval=60)
+    failing.start()
+    failing.stop()
+    assert not failing.add(1, 'c', 'third')
+    assert failing.get_stats()['dropped'] == 1
+
+
+def test_concurrent_stop_calls_are_safe():
+    sink = ActivityLogSink(RecordingWriter(), batch_size=100, flush_interval=60)
+    sink.start()
+    sink.add(1, 'a', 'first')
+    threads = [threading.Thread(target=sink.stop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert sink.get_stats()['written'] == 1
+    sink.stop()
+
+
+def test_read_flush_waits_only_read_timeout(monkeypatch):
+    release = threading.Event()
+    sink = ActivityLogSink(lambda entries: release.wait(5), batch_size=100, flush_interval=60)
+    sink.start()
+    monkeypatch.setattr(activity_log_sink, '_sink', sink)
+    monkeypatch.setattr(activity_log_sink, 'READ_FLUSH_TIMEOUT', 0.05)
+    try:
+        sink.add(1, 'a', 'first')
+        started = time.monotonic()
+        # БД не отвечает: выборка ждет не дольше READ_FLUSH_TIMEOUT
+        assert not flush_activity_logs()
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        sink.stop()
@@ -0,0 +1,47 @@
+"""
+Тесты асинхронного доступа к функциям database.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import async_database  # noqa: E402
+
+
+def test_database_functions_are_available_as_coroutines(sqlite_database):
+    sqlite_database.save_user(1, 'Администратор')
+
+    async def main():
+        user, missing = await asyncio.gather(async_database.get_user(1), async_database.get_user(2))
+        return user, missing
+
+    try:
+        user, missing = asyncio.run(main())
+    finally:
+        async_database.shutdown()
+    assert user['first_name'] == 'Администратор' and user['role'] == 'admin'
+    assert missing is None
+    # Обертка создается один раз и сохраняет имя функции
+    assert async_database.get_user is async_database.get_user
+    assert async_database.get_user.__name__ == 'get_user'
+
+
+def test_calls_run_in_database_threads():
+    async def main():
+        return await async_database.run_db(lambda: threading.current_thread().name)
+
+    try:
+        assert asyncio.run(main()).startswith('async-db')
+    finally:
+        async_database.shutdown()
+    assert async_database._executor is None
+
+
+@pytest.mark.parametrize('name', ['_create_backend', 'SQLITE_DATABASE_PATH', 'no_such_function'])
+def test_private_and_non_callable_names_are_not_exported(name):
+    with pytest.raises(AttributeError):
+        getattr(async_database, name)
@@ -0,0 +1,117 @@
+"""
+Тесты асинхронного запуска: обновления передаются в UpdateDispatcher с сохранением
+порядка внутри чата и ограничением числа обновлений в обработке
+"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import async_runner  # noqa: E402
+from async_runner import AsyncUpdateRunner  # noqa: E402
+
+
+def _update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, message=SimpleNamespace(chat=SimpleNamespace(id=chat_id)))
+
+
+class FakeBot:
+    """Бот, который запоминает обработанные обновления и отдает заданные пачки getUpdates"""
+
+    token = 'test-token'
+
+    def __init__(self, batches=(), on_process=None):
+        self.threaded = True
+        self.batches = list(batches)
+        self.offsets = []
+        self.on_process = on_process
+        self.processed = []
+        self._lock = threading.Lock()
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            if self.on_process is not None:
+                self.on_process(update)
+            with self._lock:
+                self.processed.append((update.message.chat.id, update.update_id))
+
+    def get_updates(self, offset=None, **kwargs):
+        self.offsets.append(offset)
+        if self.batches:
+            return self.batches.pop(0)
+        time.sleep(0.01)
+        return []
+
+
+@pytest.fixture(autouse=True)
+def sync_client(monkeypatch):
+    # Обновления получаются синхронным клиентом FakeBot
+    monkeypatch.setattr(async_runner, 'AsyncTeleBot', None)
+
+
+def test_run_keeps_chat_order_and_advances_offset():
+    batches = [
+        [_update(1, 'a'), _update(2, 'b'), _update(3, 'a')],
+        [_update(4, 'b'), _update(5, 'a')],
+    ]
+
+    def on_process(update):
+        # Первое обновление чата a обрабатывается дольше следующих
+        if update.update_id == 1:
+            time.sleep(0.05)
+
+    bot = FakeBot(batches, on_process)
+    runner = AsyncUpdateRunner(bot, workers=4, max_pending=10)
+    # Обработчики выполняются в потоках диспетчера, а не в пуле telebot
+    assert bot.threaded is False
+
+    async def main():
+        stop = asyncio.Event()
+        task = asyncio.create_task(runner.run(stop))
+        while len(bot.offsets) < 3:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(main())
+    assert [update_id for chat, update_id in bot.processed if chat == 'a'] == [1, 3, 5]
+    assert [update_id for chat, update_id in bot.processed if chat == 'b'] == [2, 4]
+    assert bot.offsets[:3] == [None, 4, 6]
+    stats = runner.get_stats()
+    assert stats['processed'] == 5 and stats['pending'] == 0
+
+
+def test_submit_waits_when_updates_in_processing_reach_limit():
+    release = threading.Event()
+    bot = FakeBot(on_process=lambda update: release.wait(5))
+    runner = AsyncUpdateRunner(bot, workers=2, max_pending=2)
+    runner.dispatcher.start()
+
+    async def main():
+        await runner.submit(_update(1, 'a'))
+        await runner.submit(_update(2, 'b'))
+        third = asyncio.create_task(runner.submit(_update(3, 'c')))
+        # Ожидание места не блокирует цикл событий
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks == 10 and not third.done()
+        assert runner.get_stats()['pending'] == 2
+
+        release.set()
+        await asyncio.wait_for(third, 5)
+
+    try:
+        asyncio.run(main())
+        assert runner.dispatcher.join(timeout=5)
+    finally:
+        release.set()
+        runner.dispatcher.stop()
+    stats = runner.get_stats()
+    assert stats['processed'] == 3 and stats['backpressure_waits'] == 1 and stats['rejected'] == 0
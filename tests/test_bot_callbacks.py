@@ -0,0 +1,95 @@
+"""
+Тесты маршрутов callback-запросов бота: callback_data кнопок, отправленных до перехода
+на CallbackRouter, попадают в те же обработчики с теми же аргументами, что и в прежней
+цепочке if/elif handle_callback_query
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telebot')
+pytest.importorskip('psycopg2')
+pytest.importorskip('openai')
+
+import ai_commands  # noqa: E402
+import bot  # noqa: E402
+from callback_router import CallbackContext  # noqa: E402
+
+USER_ID = 10
+CHAT_ID = 20
+MESSAGE_ID = 30
+
+# callback_data -> (модуль, обработчик, аргументы) по прежней цепочке if/elif
+LEGACY_CALLBACKS = [
+    ("main_menu", bot, "handle_main_menu_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("help", bot, "handle_help_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("new_order", bot, "handle_new_order_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("my_orders", bot, "handle_my_orders_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("my_assigned_orders", bot, "handle_my_assigned_orders_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("all_orders", bot, "handle_all_orders_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("manage_users", bot, "handle_manage_users_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("list_users", bot, "handle_list_users_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("approval_requests", bot, "handle_approval_requests_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("approve_5", bot, "handle_approve_user_callback", (USER_ID, MESSAGE_ID, 5, CHAT_ID)),
+    ("reject_5", bot, "handle_reject_user_callback", (USER_ID, MESSAGE_ID, 5, CHAT_ID)),
+    ("add_admin", bot, "handle_add_admin_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("add_dispatcher", bot, "handle_add_dispatcher_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("add_technician", bot, "handle_add_technician_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("set_admin_5", bot, "handle_set_role_callback", (USER_ID, MESSAGE_ID, 5, "admin", CHAT_ID)),
+    ("set_dispatcher_5", bot, "handle_set_role_callback", (USER_ID, MESSAGE_ID, 5, "dispatcher", CHAT_ID)),
+    ("set_technician_5", bot, "handle_set_role_callback", (USER_ID, MESSAGE_ID, 5, "technician", CHAT_ID)),
+    ("manage_templates", bot, "handle_manage_templates_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("view_templates", bot, "handle_view_templates_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("add_template", bot, "handle_add_template_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("use_template_3", bot, "handle_use_template_callback", (USER_ID, MESSAGE_ID, 3, CHAT_ID)),
+    ("edit_template_3", bot, "handle_edit_template_callback", (USER_ID, MESSAGE_ID, 3, CHAT_ID)),
+    ("delete_template_3", bot, "handle_delete_template_callback", (USER_ID, MESSAGE_ID, 3, CHAT_ID)),
+    ("order_7", bot, "handle_order_detail_callback", (USER_ID, MESSAGE_ID, 7, CHAT_ID)),
+    ("change_status_7", bot, "handle_change_status_callback", (USER_ID, MESSAGE_ID, 7, CHAT_ID)),
+    ("status_7_new", bot, "handle_update_status_callback", (USER_ID, MESSAGE_ID, 7, "new", CHAT_ID)),
+    ("status_7_in_progress", bot, "handle_update_status_callback",
+     (USER_ID, MESSAGE_ID, 7, "in_progress", CHAT_ID)),
+    ("assign_technician_7", bot, "handle_assign_technician_callback", (USER_ID, MESSAGE_ID, 7)),
+    ("assign_7_5", bot, "handle_assign_order_callback", (USER_ID, MESSAGE_ID, 7, 5)),
+    ("add_cost_7", bot, "handle_add_cost_callback", (USER_ID, MESSAGE_ID, 7)),
+    ("add_description_7", bot, "handle_add_description_callback", (USER_ID, MESSAGE_ID, 7)),
+    ("delete_user_menu", bot, "handle_delete_user_menu_callback", (USER_ID, MESSAGE_ID)),
+    ("delete_user_5", bot, "handle_delete_user_callback", (USER_ID, MESSAGE_ID, 5)),
+    ("confirm_delete_user_5", bot, "handle_confirm_delete_user_callback", (USER_ID, MESSAGE_ID, 5)),
+    ("manage_orders", bot, "handle_manage_orders_callback", (USER_ID, MESSAGE_ID, CHAT_ID)),
+    ("delete_order_7", bot, "handle_delete_order_callback", (USER_ID, MESSAGE_ID, 7, CHAT_ID)),
+    ("confirm_delete_order_7", bot, "handle_confirm_delete_order_callback", (USER_ID, MESSAGE_ID, 7, CHAT_ID)),
+    ("activity_logs", bot, "handle_activity_logs_callback", (USER_ID, MESSAGE_ID)),
+    # Номер страницы больше не передается: старые кнопки открывают первую страницу
+    ("logs_page_2", bot, "handle_logs_page_callback", (USER_ID, MESSAGE_ID)),
+    ("logs_filter_user", bot, "handle_logs_filter_callback", (USER_ID, MESSAGE_ID, "user")),
+    ("ai_analyze_problem", ai_commands, "handle_ai_analyze_problem_callback", (USER_ID, MESSAGE_ID)),
+    ("ai_suggest_cost", ai_commands, "handle_ai_suggest_cost_callback", (USER_ID, MESSAGE_ID)),
+    ("ai_generate_description", ai_commands, "handle_ai_generate_description_callback", (USER_ID, MESSAGE_ID)),
+    ("ai_technician_help", ai_commands, "handle_ai_technician_help_callback", (USER_ID, MESSAGE_ID)),
+    ("ai_order_help_7", ai_commands, "handle_ai_order_help_callback", (USER_ID, MESSAGE_ID, 7)),
+    ("set_cost_7_1500.5", ai_commands, "handle_set_cost_callback", (USER_ID, MESSAGE_ID, 7, 1500.5)),
+    ("set_description_7", ai_commands, "handle_set_description_callback", (USER_ID, MESSAGE_ID, 7)),
+]
+
+
+def _call(data):
+    return SimpleNamespace(
+        id='1', data=data, from_user=SimpleNamespace(id=USER_ID),
+        message=SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), message_id=MESSAGE_ID)
+    )
+
+
+@pytest.mark.parametrize('data, module, handler_name, expected_args', LEGACY_CALLBACKS,
+                         ids=[item[0] for item in LEGACY_CALLBACKS])
+def test_legacy_callback_reaches_same_handler(monkeypatch, data, module, handler_name, expected_args):
+    calls = []
+    monkeypatch.setattr(module, handler_name, lambda *args: calls.append(args))
+
+    assert bot.callback_router.dispatch(CallbackContext(_call(data), data))
+    assert calls == [expected_args]
+
+
+def test_unknown_callback_is_not_dispatched():
+    assert not bot.callback_router.dispatch(CallbackContext(_call("order_abc"), "order_abc"))
@@ -0,0 +1,244 @@
+"""
+Тесты кэша: объединение одновременных загрузок, защита от сохранения значения,
+загруженного до инвалидации, stale-while-revalidate и ошибки загрузки
+"""
+
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import CacheNamespace
+from cache_backends import MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def memory_backend(monkeypatch):
+    """Кэш только в памяти процесса, без общего хранилища из окружения"""
+    monkeypatch.setattr(cache, '_backend', MemoryBackend())
+
+
+class BlockingLoader:
+    """Загрузчик, который ждет разрешения и считает вызовы"""
+
+    def __init__(self, value='value', error=None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        self.started.set()
+        assert self.release.wait(5), "загрузка не была разрешена"
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _run_threads(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_concurrent_misses_collapse_to_one_load():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    loader = BlockingLoader('loaded')
+
+    threads, results, errors = _run_threads(8, lambda: namespace.get_or_load('key', loader))
+    assert loader.started.wait(5)
+    # Все потоки, кроме загружающего, ждут его результата
+    assert _wait_for(lambda: namespace.stats.coalesced == 7)
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loader.calls == 1
+    assert results == ['loaded'] * 8
+    assert errors == [None] * 8
+    assert namespace.get('key').value == 'loaded'
+    assert namespace.stats.loads == 1
+
+
+def test_load_started_before_invalidation_is_not_stored():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    loader = BlockingLoader('old')
+
+    threads, results, _ = _run_threads(1, lambda: namespace.get_or_load('key', loader))
+    assert loader.started.wait(5)
+    namespace.delete('key')
+    loader.release.set()
+    threads[0].join(5)
+
+    # Загрузивший поток получает свое значение, но в кэш оно не попадает
+    assert results == ['old']
+    assert namespace.get('key') is None
+
+    # Загрузка после инвалидации не объединяется с прежней и сохраняется
+    assert namespace.get_or_load('key', lambda: 'new') == 'new'
+    assert namespace.get('key').value == 'new'
+
+
+def test_invalidation_during_load_starts_separate_load():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    old_loader = BlockingLoader('old')
+
+    first, first_results, _ = _run_threads(1, lambda: namespace.get_or_load('key', old_loader))
+    assert old_loader.started.wait(5)
+    namespace.delete('key')
+
+    # Поток, запросивший ключ после инвалидации, не ждет загрузки, начатой до нее
+    assert namespace.get_or_load('key', lambda: 'new') == 'new'
+    old_loader.release.set()
+    first[0].join(5)
+
+    assert first_results == ['old']
+    assert namespace.get('key').value == 'new'
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    namespace.set('key', 'stale', ttl=0.01, stale_ttl=60)
+    time.sleep(0.02)
+    loader = BlockingLoader('fresh')
+
+    # Устаревшее значение возвращается сразу всем потокам, не дожидаясь обновления
+    threads, results, errors = _run_threads(8, lambda: namespace.get_or_load('key', loader, stale_ttl=60))
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert results == ['stale'] * 8
+    assert errors == [None] * 8
+
+    assert loader.started.wait(5)
+    assert namespace.stats.stale_hits == 8
+    assert namespace.get_stats()['loading'] == 1
+    loader.release.set()
+
+    assert _wait_for(lambda: namespace.get_stats()['loading'] == 0)
+    assert loader.calls == 1
+    assert namespace.get_or_load('key', loader, stale_ttl=60) == 'fresh'
+    assert loader.calls == 1
+
+
+def test_loader_error_reaches_all_waiters():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    loader = BlockingLoader(error=RuntimeError("db is down"))
+
+    threads, results, errors = _run_threads(5, lambda: namespace.get_or_load('key', loader))
+    assert loader.started.wait(5)
+    assert _wait_for(lambda: namespace.stats.coalesced == 4)
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loader.calls == 1
+    assert results == [None] * 5
+    assert all(isinstance(error, RuntimeError) and str(error) == "db is down" for error in errors)
+    assert namespace.stats.load_errors == 1
+    assert len(namespace) == 0
+
+    # Ошибка не кэшируется: следующий запрос загружает значение заново
+    assert namespace.get_or_load('key', lambda: 'recovered') == 'recovered'
+
+
+
+def test_none_is_cached_only_with_negative_ttl():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None
+
+    assert namespace.get_or_load('key', loader) is None
+    assert namespace.get_or_load('key', loader) is None
+    assert len(calls) == 2
+
+    assert namespace.get_or_load('other', loader, negative_ttl=60) is None
+    assert namespace.get_or_load('other', loader, negative_ttl=60) is None
+    assert len(calls) == 3
+
+
+def test_sweep_expires_short_negative_entry_behind_long_lived_one():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    namespace.set('long', 'value', ttl=3600)
+    assert namespace.get_or_load('missing', lambda: None, negative_ttl=0.01) is None
+    time.sleep(0.02)
+
+    # Очистка при следующей записи находит устаревшую запись, хотя она записана позже
+    namespace.set('other', 'value')
+    assert len(namespace) == 2
+    assert namespace.get('long').value == 'value'
+    assert namespace.stats.expirations == 1
+
+
+def test_overwritten_entries_do_not_grow_expiry_heap():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    for index in range(1000):
+        namespace.set('key', index)
+    assert len(namespace) == 1
+    assert len(namespace._expiry) <= 2 + cache._SWEEP_BATCH
+    assert namespace.get('key').value == 999
+
+
+def test_fill_after_invalidation_is_skipped():
+    cache.cache_clear('users')
+    snapshot = cache.cache_snapshot('users', ['1', '2'])
+    # Пользователь изменен, пока значения загружались из БД
+    cache.cache_delete('users', '1')
+    cache.cache_fill('users', '1', {'role': 'old'}, None, snapshot)
+    cache.cache_fill('users', '2', None, 60, snapshot)
+    assert cache.cache_get('users', '1', cache.MISSING) is cache.MISSING
+    assert cache.cache_get('users', '2', cache.MISSING) is cache.MISSING
+
+    snapshot = cache.cache_snapshot('users', ['1'])
+    cache.cache_fill('users', '1', {'role': 'new'}, None, snapshot)
+    assert cache.cache_get('users', '1') == {'role': 'new'}
+    cache.cache_clear('users')
+
+
+def test_hits_and_misses_count_values_served_from_cache():
+    namespace = CacheNamespace('test', ttl=60, max_size=100)
+    namespace.set('fresh', 'value')
+    namespace.set('stale', 'old', ttl=0.01, stale_ttl=60)
+    time.sleep(0.02)
+    loader = BlockingLoader('new')
+    loader.release.set()
+
+    assert namespace.get('fresh').value == 'value'
+    # get не отдает устаревшую запись: промах
+    assert namespace.get('stale') is None
+    assert namespace.get('absent') is None
+    # get_or_load отдает устаревшее значение на время обновления: попадание
+    assert namespace.get_or_load('stale', loader, stale_ttl=60) == 'old'
+    assert namespace.get_or_load('absent', loader) == 'new'
+
+    stats = namespace.get_stats()
+    assert stats['hits'] == 2 and stats['stale_hits'] == 1
+    assert stats['misses'] == 3
+    assert stats['hit_ratio'] == 0.4
@@ -0,0 +1,291 @@
+"""
+Тесты общих хранилищ кэша: mmap (в том числе между процессами) и Redis
+через локальную замену сервера из local_redis.py
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+
+import pytest
+
+import cache
+from cache import CacheNamespace
+from cache_backends import CacheConfigurationError, MmapBackend, RedisBackend
+from local_redis import LocalRedisServer
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def mmap_path(tmp_path):
+    return str(tmp_path / 'cache.mmap')
+
+
+def _mmap(path, **kwargs):
+    kwargs.setdefault('slots', 64)
+    kwargs.setdefault('slot_size', 512)
+    kwargs.setdefault('ring_size', 16)
+    kwargs.setdefault('poll_interval', 0.02)
+    return MmapBackend(path, **kwargs)
+
+
+def test_mmap_set_get_and_invalidate(mmap_path):
+    backend = _mmap(mmap_path)
+    try:
+        backend.set('users', '1', {'role': 'admin'}, ttl=60, tags=('role:admin',))
+        value, ttl = backend.get('users', '1')
+        assert value == {'role': 'admin'} and 0 < ttl <= 60
+
+        backend.invalidate('tags', 'users', tags=('role:admin',))
+        assert backend.get('users', '1') is None
+
+        backend.set('users', '2', 'x', ttl=60)
+        backend.set('orders', '2', 'y', ttl=60)
+        backend.invalidate('clear', 'users')
+        assert backend.get('users', '2') is None
+        assert backend.get('orders', '2')[0] == 'y'
+
+        # Значение больше ячейки не сохраняется
+        backend.set('orders', '3', 'z' * 1024, ttl=60)
+        assert backend.get('orders', '3') is None
+    finally:
+        backend.close()
+
+
+def test_mmap_geometry_mismatch_refuses_to_open_and_keeps_file(mmap_path):
+    running = _mmap(mmap_path)
+    try:
+        running.set('users', '1', 'value', ttl=60)
+        size = os.path.getsize(mmap_path)
+        with open(mmap_path, 'rb') as f:
+            content = f.read()
+
+        with pytest.raises(CacheConfigurationError, match='CACHE_MMAP_SLOTS'):
+            _mmap(mmap_path, slots=128)
+        with pytest.raises(CacheConfigurationError):
+            _mmap(mmap_path, slot_size=1024)
+
+        # Файл, отображенный работающим процессом, не изменился
+        assert os.path.getsize(mmap_path) == size
+        with open(mmap_path, 'rb') as f:
+            assert f.read() == content
+        assert running.get('users', '1')[0] == 'value'
+    finally:
+        running.close()
+
+
+def test_mmap_skips_write_loaded_before_invalidation(mmap_path):
+    loader, other = _mmap(mmap_path), _mmap(mmap_path)
+    try:
+        generation = loader.generation('users', '1')
+        other.invalidate('delete', 'users', '1')
+        loader.set('users', '1', 'stale', ttl=60, generation=generation)
+        assert other.get('users', '1') is None
+
+        generation = loader.generation('users', '1')
+        loader.set('users', '1', 'fresh', ttl=60, generation=generation)
+        assert other.get('users', '1')[0] == 'fresh'
+    finally:
+        loader.close()
+        other.close()
+
+
+def _mmap_child(path, ready, received, done):
+    backend = _mmap(path)
+    backend.listen(lambda *message: received.put(message))
+    backend.set('orders', '7', 'from child', ttl=60)
+    ready.set()
+    done.wait(10)
+    backend.close()
+
+
+def test_mmap_invalidation_reaches_other_process(mmap_path):
+    context = multiprocessing.get_context('spawn')
+    ready, done = context.Event(), context.Event()
+    received = context.Queue()
+    child = context.Process(target=_mmap_child, args=(mmap_path, ready, received, done))
+    child.start()
+    try:
+        assert ready.wait(30)
+        backend = _mmap(mmap_path)
+        try:
+            # Значение, сохраненное другим процессом, читается из общего файла
+            assert backend.get('orders', '7')[0] == 'from child'
+            backend.invalidate('delete', 'orders', '7')
+            backend.invalidate('tags', 'orders', tags=('order:7',))
+            assert received.get(timeout=10) == ('delete', 'orders', '7', ())
+            assert received.get(timeout=10) == ('tags', 'orders', None, ('order:7',))
+            assert backend.get('orders', '7') is None
+        finally:
+            backend.close()
+    finally:
+        done.set()
+        child.join(10)
+    assert child.exitcode == 0
+
+
+@pytest.fixture
+def redis_server():
+    server = LocalRedisServer(port=0)
+    server.start_background()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_backends(redis_server):
+    prefix = f'test:{uuid.uuid4().hex}:'
+    backends = [RedisBackend(redis_server.url, prefix) for _ in range(2)]
+    yield backends
+    for backend in backends:
+        backend.close()
+
+
+def test_redis_set_get_and_invalidate(redis_backends):
+    backend, _ = redis_backends
+    backend.set('users', '1', {'role': 'admin'}, ttl=60, tags=('role:admin',))
+    value, ttl = backend.get('users', '1')
+    assert value == {'role': 'admin'} and 59 < ttl <= 60
+
+    backend.invalidate('tags', 'users', tags=('role:admin',))
+    assert backend.get('users', '1') is None
+
+    backend.set('users', '2', 'x', ttl=60)
+    backend.invalidate('delete', 'users', '2')
+    assert backend.get('users', '2') is None
+
+    backend.set('users', '3', 'x', ttl=60)
+    backend.set('orders', '3', 'y', ttl=60)
+    backend.invalidate('clear', 'users')
+    assert backend.get('users', '3') is None
+    assert backend.get('orders', '3')[0] == 'y'
+    backend.invalidate('clear', None)
+    assert backend.get('orders', '3') is None
+
+    # После очистки всего кэша поколения не сбрасываются, новые значения читаются
+    backend.set('orders', '3', 'z', ttl=60)
+    assert backend.get('orders', '3')[0] == 'z'
+
+
+def test_redis_ignores_value_loaded_before_invalidation(redis_backends):
+    loader, other = redis_backends
+    for op, kwargs in (('delete', {'key': '1'}), ('tags', {'tags': ('user:1',)}),
+                       ('clear', {}), ('clear_all', {})):
+        other.set('users', '1', 'cached', ttl=60, tags=('user:1',))
+        generation = loader.generation('users', '1')
+        if op == 'clear_all':
+            other.invalidate('clear', None)
+        else:
+            other.invalidate(op, 'users', **kwargs)
+        # Запись завершилась после инвалидации, но значение загружено до нее
+        loader.set('users', '1', 'stale', ttl=60, tags=('user:1',), generation=generation)
+        assert other.get('users', '1') is None, op
+
+    loader.set('users', '1', 'fresh', ttl=60, generation=loader.generation('users', '1'))
+    assert other.get('users', '1')[0] == 'fresh'
+
+
+def _redis_child(url, prefix, invalidations):
+    backend = RedisBackend(url, prefix)
+    for op, namespace, kwargs in invalidations:
+        backend.invalidate(op, namespace, **kwargs)
+    backend.close()
+
+
+def test_redis_invalidation_is_published_to_other_process(redis_server, redis_backends):
+    publisher, subscriber = redis_backends
+    received = queue.Queue()
+    subscriber.listen(lambda *message: received.put(message))
+    assert _wait_for(lambda: redis_server.store.subscribers.get(subscriber.channel.encode('utf-8')))
+
+    # Собственные сообщения процесс не обрабатывает повторно
+    publisher.invalidate('clear', 'users')
+
+    context = multiprocessing.get_context('spawn')
+    child = context.Process(target=_redis_child, args=(redis_server.url, publisher.prefix, [
+        ('delete', 'users', {'key': '1'}),
+        ('tags', 'orders', {'tags': ('order:5',)}),
+    ]))
+    child.start()
+    child.join(30)
+    assert child.exitcode == 0
+
+    assert received.get(timeout=5) == ('delete', 'users', '1', ())
+    assert received.get(timeout=5) == ('tags', 'orders', None, ('order:5',))
+    time.sleep(0.1)
+    assert received.empty()
+
+
+def test_load_is_not_shared_when_invalidated_during_load(monkeypatch, mmap_path):
+    backend, other = _mmap(mmap_path), _mmap(mmap_path)
+    monkeypatch.setattr(cache, '_backend', backend)
+    try:
+        namespace = CacheNamespace('users', ttl=60, max_size=100)
+        started, release = threading.Event(), threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            return 'stale'
+
+        thread = threading.Thread(target=lambda: namespace.get_or_load('1', loader))
+        thread.start()
+        assert started.wait(5)
+        # Другой процесс изменил данные, пока значение загружалось
+        other.invalidate('delete', 'users', '1')
+        release.set()
+        thread.join(5)
+
+        assert other.get('users', '1') is None
+        assert namespace.get_or_load('2', lambda: 'fresh') == 'fresh'
+        assert other.get('users', '2')[0] == 'fresh'
+    finally:
+        backend.close()
+        other.close()
+
+
+def test_fill_is_not_shared_after_invalidation_in_other_process(monkeypatch, redis_backends):
+    backend, other = redis_backends
+    monkeypatch.setattr(cache, '_backend', backend)
+    cache.cache_clear('users')
+    snapshot = cache.cache_snapshot('users', ['1', '2'])
+    # Другой процесс изменил пользователя 1: локальный кэш этого процесса еще не знает об этом
+    other.invalidate('delete', 'users', '1')
+    cache.cache_fill('users', '1', 'stale', None, snapshot)
+    cache.cache_fill('users', '2', 'fresh', None, snapshot)
+
+    assert other.get('users', '1') is None
+    assert other.get('users', '2')[0] == 'fresh'
+    cache.cache_clear('users')
+
+
+def test_mismatched_mmap_stops_startup_but_not_handlers(monkeypatch, mmap_path):
+    running = _mmap(mmap_path, slots=64, slot_size=512)
+    monkeypatch.setenv('CACHE_BACKEND', 'mmap')
+    monkeypatch.setenv('CACHE_MMAP_PATH', mmap_path)
+    monkeypatch.setenv('CACHE_MMAP_SLOTS', '128')
+    monkeypatch.setenv('CACHE_MMAP_SLOT_SIZE', '512')
+    monkeypatch.setattr(cache, '_backend', None)
+    try:
+        # При запуске процесса ошибка настройки останавливает его
+        with pytest.raises(CacheConfigurationError):
+            cache.init_cache_backend()
+
+        # В обработчике ошибка общего хранилища - промах, а не исключение
+        namespace = CacheNamespace('users', ttl=60, max_size=100)
+        assert namespace.get_or_load('1', lambda: 'loaded') == 'loaded'
+        assert namespace.get('1').value == 'loaded'
+    finally:
+        running.close()
@@ -0,0 +1,152 @@
+"""
+Тесты компактного кодирования callback_data
+"""
+
+import base64
+
+import pytest
+
+import callback_codec
+from callback_codec import CallbackDataError, MAX_CALLBACK_DATA_BYTES, decode, encode, is_encoded
+from callback_router import CallbackRouter
+from config import ORDER_STATUSES
+
+# Наибольшее значение uint, которое читает декодер (9 байт varint)
+MAX_UINT = 2 ** 63 - 1
+
+# Действие -> примеры значений полей, в том числе граничных
+ACTION_SAMPLES = {
+    'status': [{'order_id': 0, 'status': status} for status in ORDER_STATUSES]
+              + [{'order_id': MAX_UINT, 'status': 'in_progress'}],
+    'assign': [{'order_id': 1, 'technician_id': 127}, {'order_id': 128, 'technician_id': MAX_UINT}],
+    'set_cost': [{'order_id': 7, 'cost': 0.0}, {'order_id': 7, 'cost': 1500.5}, {'order_id': 7, 'cost': 99999999.99}],
+    'orders_page': [{'direction': 0, 'created_us': 0, 'order_id': 0},
+                    {'direction': 1, 'created_us': MAX_UINT, 'order_id': MAX_UINT}],
+    'logs_page': [{'direction': 1, 'created_us': 1_700_000_000_000_000, 'log_id': 2 ** 31},
+                  {'direction': 0, 'created_us': MAX_UINT, 'log_id': MAX_UINT}],
+    'search_page': [{'offset': 0, 'query': ''}, {'offset': 10 ** 9, 'query': 'Иванов'}],
+}
+
+
+def _raw_payload(raw: bytes) -> str:
+    return callback_codec.MARKER + base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def test_every_action_has_samples():
+    assert set(ACTION_SAMPLES) == set(callback_codec._actions_by_name)
+
+
+@pytest.mark.parametrize('action, values', [
+    (action, values) for action, samples in ACTION_SAMPLES.items() for values in samples
+])
+def test_round_trip(action, values):
+    data = encode(action, **values)
+    assert is_encoded(data)
+    assert len(data.encode('utf-8')) <= MAX_CALLBACK_DATA_BYTES
+    assert decode(data) == (action, values)
+
+
+def test_small_values_use_one_byte_varints():
+    # Версия, действие и два поля по одному байту - 4 байта, 6 символов base64
+    assert len(encode('assign', order_id=127, technician_id=5)) == 1 + 6
+
+
+def test_negative_uint_is_rejected():
+    with pytest.raises(CallbackDataError):
+        encode('assign', order_id=-1, technician_id=1)
+
+
+def test_missing_field_and_unknown_action_are_rejected():
+    with pytest.raises(CallbackDataError):
+        encode('assign', order_id=1)
+    with pytest.raises(CallbackDataError):
+        encode('no_such_action')
+    with pytest.raises(CallbackDataError):
+        encode('status', order_id=1, status='no_such_status')
+
+
+def test_payload_over_telegram_limit_is_rejected():
+    # Самый длинный запрос, с которым callback_data еще помещаются при наибольшем смещении
+    query = ''
+    while True:
+        try:
+            data = encode('search_page', offset=MAX_UINT, query=query + 'a')
+        except CallbackDataError:
+            break
+        assert len(data) <= MAX_CALLBACK_DATA_BYTES
+        query += 'a'
+    # 1 символ маркера + 63 символа base64 = 47 байт: версия, действие, 9 байт смещения, длина
+    assert len(query) == 47 - 2 - 9 - 1
+    assert decode(encode('search_page', offset=MAX_UINT, query=query)) == (
+        'search_page', {'offset': MAX_UINT, 'query': query})
+
+
+@pytest.mark.parametrize('data', [
+    'order_15',                                              # не закодированы
+    '~',                                                     # пустые данные
+    '~!!!!',                                                 # не base64url
+    '~AQ',                                                   # только версия
+    _raw_payload(bytes((99, 1, 1, 0))),                      # неизвестная версия
+    _raw_payload(bytes((callback_codec.VERSION, 200, 1))),   # неизвестное действие
+    _raw_payload(bytes((callback_codec.VERSION, 2, 1))),     # не хватает поля
+    _raw_payload(bytes((callback_codec.VERSION, 2, 1, 1, 0))),  # лишние байты
+    _raw_payload(bytes((callback_codec.VERSION, 2, 0x80))),  # оборванный varint
+    _raw_payload(bytes((callback_codec.VERSION, 2)) + b'\xff' * 10 + b'\x01'),  # varint длиннее 63 бит
+    _raw_payload(bytes((callback_codec.VERSION, 1, 1, 250))),   # неизвестный статус
+    _raw_payload(bytes((callback_codec.VERSION, 6, 0, 5, 0x61))),  # строка короче длины
+    _raw_payload(bytes((callback_codec.VERSION, 6, 0, 1, 0xff))),  # не UTF-8
+])
+def test_malformed_payload_is_rejected(data):
+    with pytest.raises(CallbackDataError):
+        decode(data)
+
+
+def _encoded_with(char):
+    for order_id in range(1, 10000):
+        data = encode('assign', order_id=order_id, technician_id=order_id)
+        if char in data:
+            return data
+    raise AssertionError(f"нет данных с символом {char}")
+
+
+@pytest.mark.parametrize('char, replacement', [('-', '+'), ('_', '/')])
+def test_standard_base64_alphabet_is_rejected(char, replacement):
+    data = _encoded_with(char)
+    assert decode(data)[0] == 'assign'
+    # Стандартный base64 декодируется в те же байты, но кнопки бота его не создают
+    with pytest.raises(CallbackDataError):
+        decode(data.replace(char, replacement))
+
+
+@pytest.mark.parametrize('suffix', ['=', '==', ' ', '\n'])
+def test_padding_and_whitespace_are_rejected(suffix):
+    data = encode('assign', order_id=1, technician_id=2)
+    with pytest.raises(CallbackDataError):
+        decode(data + suffix)
+
+
+def _router():
+    router = CallbackRouter()
+    router.add_route('order_{order_id:int}', lambda ctx, order_id: ('order', order_id))
+    router.add_route('assign_{order_id:int}_{technician_id:int}',
+                     lambda ctx, order_id, technician_id: ('assign', order_id, technician_id),
+                     action='assign')
+    return router
+
+
+def test_router_accepts_legacy_and_encoded_data():
+    router = _router()
+    route, params = router.resolve('order_15')
+    assert route.pattern == 'order_{order_id:int}' and params == {'order_id': 15}
+
+    legacy = router.resolve('assign_15_3')
+    encoded = router.resolve(encode('assign', order_id=15, technician_id=3))
+    assert legacy[0] is encoded[0]
+    assert legacy[1] == encoded[1] == {'order_id': 15, 'technician_id': 3}
+
+
+def test_router_ignores_foreign_encoded_data():
+    router = _router()
+    assert router.resolve(_raw_payload(bytes((callback_codec.VERSION, 200, 1)))) is None
+    # Действие кодека без маршрута в этом маршрутизаторе
+    assert router.resolve(encode('status', order_id=1, status='new')) is None
@@ -0,0 +1,220 @@
+"""
+Тесты запросов database.py на временной базе SQLite (фикстура sqlite_database)
+"""
+
+import datetime
+from contextlib import closing
+
+from activity_log_sink import ActivityLogEntry
+
+SAME_TIME = '2024-05-01 10:00:00'
+
+
+def _execute(database, sql, params=()):
+    conn = database.get_connection()
+    try:
+        conn.cursor().execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _walk_pages(fetch, id_key, limit):
+    """Проходит все страницы к старым записям, а затем обратно к новым"""
+    pages = [fetch(None, 0, limit)]
+    while pages[-1].older is not None:
+        pages.append(fetch(pages[-1].older, 0, limit))
+    back = [pages[-1]]
+    while back[-1].newer is not None:
+        back.append(fetch(back[-1].newer, 1, limit))
+    older = [[item[id_key] for item in page.items] for page in pages]
+    newer = [[item[id_key] for item in page.items] for page in back]
+    return older, newer
+
+
+def _create_orders(database, count):
+    database.save_user(1, 'Диспетчер')
+    return [database.save_order(1, f'+7 900 000 00 {index:02d}', f'Клиент {index}', 'Не включается', 'Адрес')
+            for index in range(count)]
+
+
+def test_orders_keyset_pages_with_equal_created_at(sqlite_database):
+    database = sqlite_database
+    order_ids = _create_orders(database, 8)
+    # Все заказы, кроме последнего, созданы в одну секунду: порядок задает order_id
+    _execute(database, "UPDATE orders SET created_at = ? WHERE order_id != ?", (SAME_TIME, order_ids[-1]))
+    _execute(database, "UPDATE orders SET created_at = ? WHERE order_id = ?", ('2024-05-01 10:00:01', order_ids[-1]))
+
+    older, newer = _walk_pages(lambda key, direction, limit: database.get_orders_page(key, direction, limit),
+                               'order_id', 3)
+    expected = sorted(order_ids, reverse=True)
+    assert older == [expected[0:3], expected[3:6], expected[6:8]]
+    # Обратный проход к новым записям дает те же страницы в обратном порядке
+    assert newer == older[::-1]
+
+    first = database.get_orders_page(limit=3)
+    assert first.newer is None
+    assert database.get_orders_page(first.older, database.PAGE_OLDER, 3).newer is not None
+
+
+def test_activity_logs_keyset_pages_with_equal_created_at(sqlite_database):
+    database = sqlite_database
+    created_at = datetime.datetime(2024, 5, 1, 10, 0, 0)
+    database.insert_activity_logs([ActivityLogEntry(1, 'test', f'запись {index}', None, None, created_at)
+                                   for index in range(7)])
+
+    older, newer = _walk_pages(lambda key, direction, limit: database.get_activity_logs_page(key, direction, limit),
+                               'log_id', 2)
+    log_ids = [log_id for page in older for log_id in page]
+    assert log_ids == sorted(log_ids, reverse=True) and len(set(log_ids)) == 7
+    assert [len(page) for page in older] == [2, 2, 2, 1]
+    assert newer == older[::-1]
+
+
+def test_stream_returns_all_rows_in_batches(sqlite_database):
+    database = sqlite_database
+    order_ids = _create_orders(database, 5)
+
+    orders = list(database.iter_all_orders(batch_size=2))
+    assert [order['order_id'] for order in orders] == order_ids
+    assert orders[0]['client_name'] == 'Клиент 0' and orders[0]['status'] == 'new'
+    assert list(database.iter_all_orders(status='completed', batch_size=2)) == []
+    assert [user['user_id'] for user in database.iter_all_users(batch_size=1)] == [1]
+    assert database.get_pool_stats()['in_use'] == 0
+
+
+def test_interrupted_stream_returns_connection(sqlite_database):
+    database = sqlite_database
+    _create_orders(database, 5)
+
+    with closing(database.iter_all_orders(batch_size=2)) as orders:
+        assert next(orders)['client_name'] == 'Клиент 0'
+        # Соединение занято до конца итерации
+        assert database.get_pool_stats()['in_use'] == 1
+    assert database.get_pool_stats()['in_use'] == 0
+
+
+def test_activity_log_stream_is_filtered_and_ordered(sqlite_database):
+    database = sqlite_database
+    created_at = datetime.datetime(2024, 5, 1, 10, 0, 0)
+    database.insert_activity_logs([
+        ActivityLogEntry(index % 2, 'test', f'запись {index}', None, None, created_at + datetime.timedelta(seconds=-index))
+        for index in range(6)
+    ])
+
+    logs = list(database.iter_activity_logs(user_id=1, batch_size=2))
+    assert [log['action_description'] for log in logs] == ['запись 5', 'запись 3', 'запись 1']
+
+
+
+def test_user_record_is_invalidated_by_user_writes(sqlite_database):
+    database = sqlite_database
+    database.save_user(1, 'Администратор')
+    # Отсутствие пользователя кэшируется и сбрасывается при регистрации
+    assert database.get_user(2) is None
+    database.save_user(2, 'Мастер')
+    assert database.get_user(2)['first_name'] == 'Мастер'
+
+    database.save_user(2, 'Мастер', 'Иванов')
+    assert database.get_user(2)['last_name'] == 'Иванов'
+    database.update_user_role(2, 'technician')
+    assert database.get_user_role(2) == 'technician'
+    database.approve_user(2)
+    assert database.get_user(2)['is_approved']
+    database.reject_user(2)
+    assert database.get_user(2) is None
+
+
+def test_save_user_upsert_keeps_role_and_approval(sqlite_database):
+    database = sqlite_database
+    assert database.save_user(1, 'Первый')
+    assert database.save_user(2, 'Второй', username='second')
+    # Первый пользователь - подтвержденный администратор, остальные ждут подтверждения
+    assert database.get_user(1)['role'] == 'admin' and database.get_user(1)['is_approved']
+    assert database.get_user(2)['role'] == 'user' and not database.get_user(2)['is_approved']
+
+    assert database.update_user_role(2, 'technician') and database.approve_user(2)
+    assert database.save_user(2, 'Второй', 'Мастер', 'master')
+    user = database.get_user(2)
+    assert (user['last_name'], user['username'], user['role']) == ('Мастер', 'master', 'technician')
+    assert user['is_approved']
+    assert [user['user_id'] for user in database.get_users_by_role('technician')] == [2]
+
+
+def test_set_user_state_upsert_keeps_created_at(sqlite_database):
+    database = sqlite_database
+    assert database.set_user_state(5, 'waiting_phone')
+    _execute(database, "UPDATE user_states SET created_at = ?, updated_at = ? WHERE user_id = 5",
+             (SAME_TIME, SAME_TIME))
+
+    assert database.set_user_state(5, 'waiting_name', order_id=7)
+    conn = database.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT state, order_id, created_at, updated_at FROM user_states")
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    assert len(rows) == 1
+    state, order_id, created_at, updated_at = rows[0]
+    assert (state, order_id, created_at) == ('waiting_name', 7, SAME_TIME)
+    assert updated_at > SAME_TIME
+
+    snapshot = database.get_user_state_snapshot(5)
+    assert (snapshot.state, snapshot.order_id) == ('waiting_name', 7)
+    assert database.clear_user_state(5) and database.get_user_state_snapshot(5) is None
+
+
+def test_order_view_follows_assignment_changes(sqlite_database):
+    database = sqlite_database
+    database.save_user(1, 'Диспетчер')
+    database.save_user(2, 'Петр')
+    database.save_user(3, 'Иван')
+    order_id = database.save_order(1, '+7 900 123 45 67', 'Иванов', 'Не включается', 'ул. Ленина, 1')
+
+    view = database.get_order_view(order_id)
+    assert view.dispatcher['first_name'] == 'Диспетчер' and view.technicians == []
+
+    # Карточка кэшируется и сбрасывается при каждом изменении назначений
+    database.assign_order(order_id, 2, 1)
+    assert [technician['user_id'] for technician in database.get_order_view(order_id).technicians] == [2]
+    database.assign_order(order_id, 3, 1)
+    view = database.get_order_view(order_id)
+    assert [technician['user_id'] for technician in view.technicians] == [2, 3]
+    assert view.is_assigned_to(3)
+
+    database.unassign_order(order_id, 2)
+    view = database.get_order_view(order_id)
+    assert [technician['user_id'] for technician in view.technicians] == [3]
+    assert not view.is_assigned_to(2)
+
+    # Изменение данных мастера тоже сбрасывает карточку
+    database.save_user(3, 'Иван', 'Петров')
+    assert database.get_order_view(order_id).technicians[0]['last_name'] == 'Петров'
+
+    assert database.update_order_status(order_id, 'in_progress')
+    view = database.get_order_view(order_id)
+    assert view.order['status'] == 'in_progress' and view.status_changed_at is not None
+    assert database.get_order_view(order_id + 100) is None
+
+
+def test_search_orders_by_phone_and_words(sqlite_database):
+    database = sqlite_database
+    database.save_user(1, 'Диспетчер')
+    ivanov = database.save_order(1, '8 (900) 123-45-67', 'Иванов', 'Не включается ноутбук', 'ул. Ленина, 1')
+    petrov = database.save_order(1, '+7 900 765 43 21', 'Петров', 'Ноутбук Иванова шумит', 'ул. Мира, 5')
+
+    # Номер в любом формате приводится к последним 10 цифрам
+    assert database.normalize_search_query('+7 (900) 123-45-67') == '9001234567'
+    for query in ('+7 (900) 123-45-67', '89001234567', '900 123 45 67'):
+        assert [order['order_id'] for order in database.search_orders(query)] == [ivanov], query
+    assert database.search_orders('+7 900 000 00 00') == []
+
+    # Совпадение в имени клиента важнее совпадения в описании проблемы
+    assert [order['order_id'] for order in database.search_orders('иванов')] == [ivanov, petrov]
+    assert [order['order_id'] for order in database.search_orders('ноутбук мира')] == [petrov]
+    assert [order['order_id'] for order in database.search_orders('ноут', status='new', limit=1, offset=1)] == [ivanov]
+    assert database.search_orders('  ') == []
+
+    database.update_order(petrov, status='completed')
+    assert [order['order_id'] for order in database.search_orders('ноутбук', status='new')] == [ivanov]
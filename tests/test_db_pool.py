@@ -0,0 +1,120 @@
+"""
+Тесты пула соединений SQLite
+"""
+
+import threading
+
+import pytest
+
+from db_pool import SQLiteConnectionPool, NestedTransactionError
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLiteConnectionPool(str(tmp_path / 'pool.db'))
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE items (name TEXT)")
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def _names(pool):
+    conn = pool.acquire()
+    try:
+        return [row[0] for row in conn.execute("SELECT name FROM items ORDER BY name")]
+    finally:
+        conn.close()
+
+
+def test_nested_checkout_reuses_thread_connection(pool):
+    outer = pool.acquire()
+    inner = pool.acquire()
+    assert inner.raw_connection is outer.raw_connection
+    inner.close()
+    outer.close()
+    assert pool.get_stats()['in_use'] == 0
+
+
+def test_nested_checkout_with_open_transaction_is_rejected(pool):
+    outer = pool.acquire()
+    outer.execute("INSERT INTO items VALUES ('outer')")
+    assert outer.in_transaction
+
+    with pytest.raises(NestedTransactionError):
+        pool.acquire()
+
+    # Отказ не меняет глубину выдачи: транзакция внешнего вызова по-прежнему его
+    outer.commit()
+    outer.close()
+    assert _names(pool) == ['outer']
+    assert pool.get_stats()['in_use'] == 0
+
+
+def test_nested_commit_does_not_touch_outer_work(pool):
+    outer = pool.acquire()
+    inner = pool.acquire()
+    inner.execute("INSERT INTO items VALUES ('inner')")
+    inner.commit()
+    inner.close()
+
+    # Транзакция, начатая после вложенного вызова, откатывается при возврате на внешнем уровне
+    outer.execute("INSERT INTO items VALUES ('outer')")
+    outer.close()
+    assert _names(pool) == ['inner']
+
+
+def test_checkout_in_other_thread_is_independent(pool):
+    outer = pool.acquire()
+    outer.execute("INSERT INTO items VALUES ('outer')")
+    result = {}
+
+    def worker():
+        conn = pool.acquire()
+        result['same'] = conn.raw_connection is outer.raw_connection
+        conn.close()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    outer.rollback()
+    outer.close()
+    assert result == {'same': False}
+
+
+def test_release_from_other_thread_is_applied_by_owner(pool):
+    outer = pool.acquire()
+    inner = pool.acquire()
+    # Вложенное соединение возвращено из другого потока (например, сборщиком мусора)
+    thread = threading.Thread(target=inner.close)
+    thread.start()
+    thread.join()
+
+    # Соединение владельца не закрыто и продолжает работать
+    outer.execute("INSERT INTO items VALUES ('outer')")
+    outer.commit()
+    outer.close()
+    assert pool.get_stats()['in_use'] == 0
+
+    # Глубина выдачи сброшена: следующая выдача - внешняя, незавершенная транзакция откатывается
+    conn = pool.acquire()
+    assert conn.raw_connection is outer.raw_connection
+    conn.execute("INSERT INTO items VALUES ('rolled back')")
+    conn.close()
+    assert _names(pool) == ['outer']
+    stats = pool.get_stats()
+    assert stats['checkins'] == stats['checkouts']
+    assert stats['in_use'] == 0
+
+
+def test_outer_release_from_other_thread_is_applied_on_next_checkout(pool):
+    conn = pool.acquire()
+    conn.execute("INSERT INTO items VALUES ('pending')")
+    thread = threading.Thread(target=conn.close)
+    thread.start()
+    thread.join()
+    assert pool.get_stats()['in_use'] == 1
+
+    # Следующая выдача в потоке-владельце учитывает возврат и откатывает брошенную транзакцию
+    assert _names(pool) == []
+    assert pool.get_stats()['in_use'] == 0
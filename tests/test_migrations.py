@@ -0,0 +1,145 @@
+"""
+Тесты миграций схемы на SQLite: повторный запуск ничего не меняет
+"""
+
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, get_schema_version, run_migrations
+
+
+class SQLiteBackend:
+    """Параметры SQLite, которые использует run_migrations (см. DatabaseBackend)"""
+
+    is_postgres = False
+    placeholder = '?'
+
+    def placeholders(self, count):
+        return ', '.join([self.placeholder] * count)
+
+
+# Таблицы, которые создает initialize_database до применения миграций
+BASE_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    role TEXT DEFAULT 'user',
+    is_approved BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_phone TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    problem_description TEXT NOT NULL,
+    client_address TEXT,
+    scheduled_datetime TEXT,
+    status TEXT DEFAULT 'new',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    dispatcher_id INTEGER,
+    service_cost REAL,
+    service_description TEXT
+);
+CREATE TABLE assignments (
+    assignment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER,
+    technician_id INTEGER,
+    assigned_by INTEGER,
+    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE activity_logs (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    action_type TEXT NOT NULL,
+    action_description TEXT NOT NULL,
+    related_order_id INTEGER,
+    related_user_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO users (user_id, role, is_approved) VALUES (1, 'dispatcher', 1), (2, 'technician', 1);
+INSERT INTO orders (client_phone, client_name, problem_description, dispatcher_id)
+VALUES ('8 (900) 123-45-67', 'Иванов', 'Не включается', 1);
+INSERT INTO assignments (order_id, technician_id, assigned_by) VALUES (1, 2, 1), (1, 2, 1), (1, 99, 1);
+"""
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'bot.db'))
+    connection.executescript(BASE_SCHEMA)
+    yield connection
+    connection.close()
+
+
+def _schema(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+
+
+def test_second_run_changes_nothing(conn):
+    backend = SQLiteBackend()
+    applied = run_migrations(conn, backend)
+    assert applied == [migration.version for migration in MIGRATIONS]
+    assert get_schema_version(conn) == MIGRATIONS[-1].version
+
+    versions = conn.execute("SELECT version, description, applied_at FROM schema_version").fetchall()
+    schema = _schema(conn)
+    assignments = conn.execute("SELECT order_id, technician_id FROM order_technicians").fetchall()
+
+    assert run_migrations(conn, backend) == []
+    assert conn.execute("SELECT version, description, applied_at FROM schema_version").fetchall() == versions
+    assert _schema(conn) == schema
+    assert conn.execute("SELECT order_id, technician_id FROM order_technicians").fetchall() == assignments
+    # Повторы и назначения удаленных пользователей не переносятся
+    assert assignments == [(1, 2)]
+
+
+def test_users_role_index_is_created(conn):
+    run_migrations(conn, SQLiteBackend())
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_users_role_approved' in indexes
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT user_id FROM users WHERE role = ? AND is_approved = 1", ('technician',)
+    ).fetchall()
+    assert any('idx_users_role_approved' in row[-1] for row in plan)
+
+
+def _search(conn, query):
+    rows = conn.execute("SELECT rowid FROM orders_fts WHERE orders_fts MATCH ? ORDER BY rowid", (query,))
+    return [row[0] for row in rows]
+
+
+def test_search_index_follows_order_changes(conn):
+    run_migrations(conn, SQLiteBackend())
+    # Заказ, созданный до миграции, попадает в индекс при ее применении
+    assert _search(conn, '"иванов"') == [1]
+    conn.execute("""
+        INSERT INTO orders (client_phone, client_name, problem_description, client_address)
+        VALUES ('+7 (900) 765-43-21', 'Петров', 'Шумит вентилятор', 'ул. Мира, 5')
+    """)
+    assert _search(conn, '"петров"') == [2]
+    assert _search(conn, '"вентил"*') == [2]
+
+    # Телефон находится полным номером и последними 10 цифрами
+    assert _search(conn, '"79007654321"') == [2]
+    assert _search(conn, '"9007654321"') == [2]
+    assert _search(conn, '"89001234567"') == [1]
+    assert _search(conn, '"9001234567"') == [1]
+
+    conn.execute("UPDATE orders SET client_name = 'Сидоров', client_phone = '8 900 111 22 33' WHERE order_id = 2")
+    assert _search(conn, '"петров"') == []
+    assert _search(conn, '"9007654321"') == []
+    assert _search(conn, '"сидоров"') == [2]
+    assert _search(conn, '"9001112233"') == [2]
+    assert _search(conn, '"вентил"*') == [2]
+
+    # Изменение столбцов вне индекса не затрагивает его
+    conn.execute("UPDATE orders SET status = 'completed' WHERE order_id = 2")
+    assert _search(conn, '"сидоров"') == [2]
+
+    conn.execute("DELETE FROM orders WHERE order_id = 2")
+    assert _search(conn, '"сидоров"') == []
+    assert _search(conn, '"вентил"*') == []
+    assert _search(conn, '"иванов"') == [1]
@@ -0,0 +1,130 @@
+"""
+Тесты очереди исходящих сообщений: 429 с retry_after, порядок сообщений чата
+при повторах, отказ от постоянных ошибок и приоритеты
+"""
+
+import threading
+import time
+
+import pytest
+
+from outbound_queue import (
+    PRIORITY_BROADCAST, PRIORITY_NOTIFICATION, PRIORITY_REPLY, OutboundQueue
+)
+
+
+class FakeApiError(Exception):
+    """Ошибка с полями ApiTelegramException: error_code и result_json"""
+
+    def __init__(self, error_code, retry_after=None):
+        super().__init__(f"Error code: {error_code}")
+        self.error_code = error_code
+        self.result_json = {'parameters': {'retry_after': retry_after}} if retry_after is not None else {}
+
+
+class FakeBot:
+    """Запоминает отправленные сообщения; errors[(chat_id, text)] - список ошибок по попыткам"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.attempts = []
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.attempts.append((chat_id, text, time.monotonic()))
+            pending = self.errors.get((chat_id, text))
+            if pending:
+                raise pending.pop(0)
+            self.sent.append((chat_id, text))
+            return text
+
+
+def _queue(bot, **kwargs):
+    kwargs.setdefault('workers', 2)
+    kwargs.setdefault('global_rate', 1000)
+    kwargs.setdefault('chat_rate', 1000)
+    kwargs.setdefault('chat_burst', 100)
+    return OutboundQueue(bot, **kwargs)
+
+
+@pytest.fixture
+def stopped():
+    queues = []
+    yield queues.append
+    for outbound in queues:
+        outbound.stop(timeout=5)
+
+
+def test_retry_after_blocks_only_that_chat(stopped):
+    bot = FakeBot({('a', 'a1'): [FakeApiError(429, retry_after=0.3)]})
+    outbound = _queue(bot)
+    stopped(outbound)
+    outbound.enqueue('a', 'a1')
+    outbound.enqueue('a', 'a2')
+    outbound.enqueue('b', 'b1')
+    outbound.enqueue('b', 'b2')
+    outbound.start()
+    assert outbound.join(timeout=5)
+
+    # Чат b не ждет retry_after чата a
+    assert bot.sent.index(('b', 'b2')) < bot.sent.index(('a', 'a1'))
+    first, retry = [attempt[2] for attempt in bot.attempts if attempt[1] == 'a1']
+    assert retry - first >= 0.3
+    stats = outbound.get_stats()
+    assert stats['rate_limited'] == 1 and stats['retried'] == 1 and stats['dropped'] == 0
+
+
+def test_chat_order_is_kept_across_retries(stopped):
+    bot = FakeBot({('a', 'a2'): [FakeApiError(502), FakeApiError(429, retry_after=0)]})
+    outbound = _queue(bot, workers=4)
+    stopped(outbound)
+    for index in range(1, 6):
+        outbound.enqueue('a', f'a{index}')
+    outbound.start()
+    assert outbound.join(timeout=10)
+
+    assert [text for chat_id, text in bot.sent] == ['a1', 'a2', 'a3', 'a4', 'a5']
+    assert outbound.get_stats()['retried'] == 2
+
+
+@pytest.mark.parametrize('error_code', [400, 403])
+def test_permanent_error_is_dropped_without_retry(stopped, error_code):
+    bot = FakeBot({('a', 'a1'): [FakeApiError(error_code)]})
+    outbound = _queue(bot)
+    stopped(outbound)
+    results = []
+    outbound.enqueue('a', 'a1', callback=lambda result, error: results.append((result, error)))
+    outbound.enqueue('a', 'a2')
+    outbound.start()
+    assert outbound.join(timeout=5)
+
+    assert [text for chat_id, text, _ in bot.attempts] == ['a1', 'a2']
+    assert bot.sent == [('a', 'a2')]
+    assert results[0][0] is None and results[0][1].error_code == error_code
+    stats = outbound.get_stats()
+    assert stats['dropped'] == 1 and stats['retried'] == 0 and stats['sent'] == 1
+
+
+def test_messages_are_sent_by_priority(stopped):
+    bot = FakeBot()
+    outbound = _queue(bot, workers=1)
+    stopped(outbound)
+    outbound.enqueue('admin1', 'broadcast', PRIORITY_BROADCAST)
+    outbound.enqueue('tech', 'notification', PRIORITY_NOTIFICATION)
+    outbound.enqueue('admin2', 'broadcast2', PRIORITY_BROADCAST)
+    outbound.enqueue('user', 'reply', PRIORITY_REPLY)
+    outbound.start()
+    assert outbound.join(timeout=5)
+
+    assert [text for chat_id, text in bot.sent] == ['reply', 'notification', 'broadcast', 'broadcast2']
+
+
+def test_unknown_priority_and_full_queue_are_rejected():
+    outbound = _queue(FakeBot(), max_size=1)
+    with pytest.raises(ValueError):
+        outbound.enqueue('a', 'text', priority=5)
+    assert outbound.enqueue('a', 'first')
+    assert not outbound.enqueue('a', 'second')
+    assert outbound.get_stats()['rejected'] == 1
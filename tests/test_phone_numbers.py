@@ -0,0 +1,74 @@
+"""
+Тесты нормализации номеров телефонов к E.164 и истории клиента по номеру
+"""
+
+import pytest
+
+from phone_numbers import normalize_phone
+
+
+@pytest.mark.parametrize('phone, expected', [
+    ('8 (900) 123-45-67', '+79001234567'),
+    ('+7 900 123 45 67', '+79001234567'),
+    ('79001234567', '+79001234567'),
+    ('9001234567', '+79001234567'),
+    ('(900) 123.45.67', '+79001234567'),
+    ('0049 30 1234567', '+49301234567'),
+    ('+44 20 7946 0958', '+442079460958'),
+    ('  +380 44 123 4567 ', '+380441234567'),
+])
+def test_phone_is_normalized(phone, expected):
+    assert normalize_phone(phone) == expected
+
+
+@pytest.mark.parametrize('phone', [
+    None,
+    '',
+    '12345',
+    '+1234567890123456',
+    '8 900 123 45 67 доб. 12',
+    '8/900/123/45/67',
+    '+7 900 +123 45 67',
+    '00 1234 5678',
+])
+def test_invalid_phone_is_rejected(phone):
+    assert normalize_phone(phone) is None
+
+
+def test_country_code_is_added_to_local_numbers():
+    assert normalize_phone('9001234567', country_code='375') == '+3759001234567'
+    # 8 в начале заменяется на 7 только для кода страны 7
+    assert normalize_phone('89001234567', country_code='375') == '+89001234567'
+    assert normalize_phone('+89001234567', country_code='7') == '+89001234567'
+
+
+def test_client_history_is_found_by_any_phone_format(sqlite_database):
+    database = sqlite_database
+    database.save_user(1, 'Диспетчер')
+    first = database.save_order(1, '8 (900) 123-45-67', 'Иванов', 'Не включается', 'ул. Ленина, 1')
+    second = database.save_order(1, '+7 900 123 45 67', 'Иванов И.', 'Шумит', 'ул. Мира, 2')
+    database.save_order(1, '+7 900 765 43 21', 'Петров', 'Не грузится', 'ул. Мира, 3')
+
+    history = database.get_client_history('9001234567')
+    assert history.client['phone_e164'] == '+79001234567'
+    # В клиенте хранятся последние имя и адрес
+    assert history.client['client_name'] == 'Иванов И.'
+    assert history.client['client_address'] == 'ул. Мира, 2'
+    assert history.orders_count == 2
+    assert [order['order_id'] for order in history.orders] == [second, first]
+
+    assert [order['order_id'] for order in database.get_client_history('89001234567', limit=1).orders] == [second]
+    assert database.get_client_history('+7 900 000 00 00') is None
+    assert database.get_client_history('не номер') is None
+
+
+def test_client_history_after_order_deletion(sqlite_database):
+    database = sqlite_database
+    database.save_user(1, 'Диспетчер')
+    first = database.save_order(1, '89001234567', 'Иванов', 'Не включается', 'ул. Ленина, 1')
+    second = database.save_order(1, '89001234567', 'Иванов', 'Шумит', 'ул. Ленина, 1')
+
+    assert database.delete_order(first)
+    history = database.get_client_history('89001234567')
+    assert history.orders_count == 1
+    assert [order['order_id'] for order in history.orders] == [second]
@@ -0,0 +1,42 @@
+"""
+Тесты выбора хранилища состояний: состояния в памяти хранит только один процесс машины
+"""
+
+import os
+
+import pytest
+
+import state_store
+
+fcntl = pytest.importorskip('fcntl')
+
+
+@pytest.fixture
+def lock_path(monkeypatch, tmp_path):
+    path = str(tmp_path / 'user_states.lock')
+    monkeypatch.setenv('USER_STATE_LOCK_PATH', path)
+    monkeypatch.setenv('USER_STATE_STORE', 'memory')
+    monkeypatch.setenv('USER_STATE_WRITE_BEHIND', 'false')
+    monkeypatch.setattr(state_store, '_process_lock_fd', None)
+    # Загрузка сохраненных состояний не нужна: таблица user_states не используется
+    monkeypatch.setattr(state_store.MemoryStateStore, 'load', lambda self: 0)
+    yield path
+    if state_store._process_lock_fd is not None:
+        os.close(state_store._process_lock_fd)
+
+
+def test_first_process_keeps_states_in_memory(lock_path):
+    assert isinstance(state_store._create_store(), state_store.MemoryStateStore)
+    # Повторное создание в том же процессе не считается другим процессом
+    assert isinstance(state_store._create_store(), state_store.MemoryStateStore)
+
+
+def test_second_process_falls_back_to_database(lock_path):
+    # Блокировку держит другой процесс бота
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        assert isinstance(state_store._create_store(), state_store.DatabaseStateStore)
+    finally:
+        os.close(fd)
+    assert isinstance(state_store._create_store(), state_store.MemoryStateStore)
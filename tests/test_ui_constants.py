@@ -0,0 +1,68 @@
+"""
+Тесты форматирования карточки заказа
+"""
+
+import datetime
+
+from models import OrderView
+from ui_constants import EMOJI, format_order_card
+
+ORDER = {
+    'order_id': 42,
+    'status': 'assigned',
+    'client_name': 'Иванов',
+    'client_phone': '+79001234567',
+    'client_address': 'ул. Ленина, 1',
+    'scheduled_datetime': '2024-05-01T15:30',
+    'problem_description': 'Не включается',
+    'service_cost': 1500,
+    'service_description': 'Замена блока питания',
+    'status_updated_at': '2024-05-01 10:05:00',
+}
+
+
+def _view(**changes):
+    order = dict(ORDER, **changes)
+    dispatcher = {'user_id': 1, 'first_name': 'Анна', 'last_name': None, 'username': 'anna'}
+    technicians = [
+        {'user_id': 2, 'first_name': 'Петр', 'last_name': 'Сидоров', 'username': None},
+        {'user_id': 3, 'first_name': None, 'last_name': None, 'username': None},
+    ]
+    return OrderView(order, dispatcher, technicians)
+
+
+def test_card_of_order_view():
+    card = format_order_card(_view())
+    assert card.startswith(f"*Заказ #42* {EMOJI['assigned']} _Заказ назначен мастеру, ожидает начала работ_\n\n")
+    lines = card.splitlines()
+    assert f"{EMOJI['phone']} *Телефон:* +79001234567" in lines
+    assert f"{EMOJI['date']} *Дата визита:* 01.05.2024 15:30" in lines
+    assert f"{EMOJI['dispatcher']} *Диспетчер:* Анна (@anna)" in lines
+    # Мастер без имени показывается по ID
+    assert f"{EMOJI['technician']} *Мастера:* Петр Сидоров, ID 3" in lines
+    assert f"{EMOJI['time']} *Статус изменен:* 01.05.2024 10:05" in lines
+    assert f"{EMOJI['cost']} *Стоимость услуг:* 1500 руб." in lines
+    assert 'Замена блока питания' in lines
+
+
+def test_card_hides_phone_cost_and_description():
+    card = format_order_card(_view(), include_cost=False, include_description=False, include_phone=False)
+    assert '+79001234567' not in card
+    assert 'Стоимость' not in card and 'Выполненные работы' not in card
+    assert 'Иванов' in card and 'Не включается' in card
+
+
+def test_card_of_plain_order_dict():
+    order = dict(ORDER, status='new', scheduled_datetime='завтра утром', service_cost=None)
+    card = format_order_card(order)
+    assert card.startswith(f"*Заказ #42* {EMOJI['new']} ")
+    # Строка, которую не удается разобрать как дату, выводится как есть
+    assert f"{EMOJI['date']} *Дата визита:* завтра утром" in card.splitlines()
+    # Без OrderView нет диспетчера, мастеров и времени изменения статуса
+    assert 'Диспетчер' not in card and 'Мастера' not in card and 'Статус изменен' not in card
+    assert 'Стоимость' not in card
+
+
+def test_status_changed_at_accepts_datetime():
+    view = _view(status_updated_at=datetime.datetime(2024, 5, 2, 9, 0))
+    assert f"{EMOJI['time']} *Статус изменен:* 02.05.2024 09:00" in format_order_card(view).splitlines()
@@ -0,0 +1,115 @@
+"""
+Тесты параллельной обработки обновлений с сохранением порядка внутри чата
+"""
+
+import threading
+import time
+
+from update_dispatcher import UpdateDispatcher
+
+
+def _chat_key(update):
+    return update[0]
+
+
+def test_updates_of_one_chat_keep_order_and_chats_run_in_parallel():
+    chats = ('a', 'b')
+    per_chat = 50
+    # Первые обновления обоих чатов должны обрабатываться одновременно
+    both_started = threading.Barrier(2, timeout=5)
+    handled = {chat: [] for chat in chats}
+    active = {chat: 0 for chat in chats}
+    overlap_errors = []
+    lock = threading.Lock()
+
+    def handler(update):
+        chat, seq = update
+        with lock:
+            active[chat] += 1
+            if active[chat] > 1:
+                overlap_errors.append(update)
+        if seq == 0:
+            both_started.wait()
+        time.sleep(0.001)
+        with lock:
+            handled[chat].append(seq)
+            active[chat] -= 1
+
+    dispatcher = UpdateDispatcher(handler, workers=4, max_pending=1000, key_func=_chat_key)
+    dispatcher.start()
+    for seq in range(per_chat):
+        for chat in chats:
+            assert dispatcher.submit((chat, seq))
+    assert dispatcher.join(timeout=10)
+    dispatcher.stop()
+
+    assert not overlap_errors
+    assert handled == {chat: list(range(per_chat)) for chat in chats}
+    stats = dispatcher.get_stats()
+    assert stats['processed'] == stats['submitted'] == per_chat * len(chats)
+    assert stats['failed'] == 0 and stats['active_chats'] == 0
+
+
+def test_handler_error_does_not_stop_chat():
+    handled = []
+
+    def handler(update):
+        if update[1] == 1:
+            raise RuntimeError("boom")
+        handled.append(update[1])
+
+    dispatcher = UpdateDispatcher(handler, workers=2, max_pending=10, key_func=_chat_key)
+    dispatcher.start()
+    for seq in range(3):
+        dispatcher.submit(('a', seq))
+    assert dispatcher.join(timeout=5)
+    dispatcher.stop()
+    assert handled == [0, 2]
+    assert dispatcher.get_stats()['failed'] == 1
+
+
+def test_full_queue_rejects_after_timeout_and_blocks_without_it():
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda update: release.wait(5), workers=1, max_pending=2, key_func=_chat_key)
+    dispatcher.start()
+    assert dispatcher.submit(('a', 0))
+    assert dispatcher.submit(('b', 0))
+
+    # С timeout заполненная очередь отклоняет обновление
+    started = time.monotonic()
+    assert not dispatcher.submit(('c', 0), timeout=0.1)
+    assert time.monotonic() - started >= 0.1
+    assert dispatcher.get_stats()['rejected'] == 1
+
+    # Без timeout submit ждет, пока обработчик не освободит место
+    accepted = threading.Event()
+    submitter = threading.Thread(target=lambda: dispatcher.submit(('c', 1)) and accepted.set())
+    submitter.start()
+    assert not accepted.wait(0.2)
+    release.set()
+    assert accepted.wait(5)
+    submitter.join()
+
+    assert dispatcher.join(timeout=5)
+    dispatcher.stop()
+    stats = dispatcher.get_stats()
+    assert stats['processed'] == 3
+    assert stats['backpressure_waits'] == 2
+
+
+def test_stop_drains_accepted_updates():
+    handled = []
+
+    def handler(update):
+        time.sleep(0.01)
+        handled.append(update)
+
+    dispatcher = UpdateDispatcher(handler, workers=2, max_pending=100, key_func=_chat_key)
+    dispatcher.start()
+    updates = [(chat, seq) for seq in range(10) for chat in ('a', 'b')]
+    for update in updates:
+        dispatcher.submit(update)
+    dispatcher.stop(timeout=10)
+
+    assert sorted(handled) == sorted(updates)
+    assert dispatcher.get_stats()['pending'] == 0
@@ -0,0 +1,184 @@
+"""
+Тесты приема обновлений через webhook: проверка токена, повторные доставки
+и некорректные запросы, а также доступ HTTP-сервера к статистике кэша по токену
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+
+import pytest
+
+import render_server
+import webhook_receiver
+from webhook_receiver import SECRET_HEADER, WEBHOOK_PATH, WebhookReceiver
+
+SECRET = 'test-secret'
+
+
+class FakeDispatcher:
+    """Очередь обновлений, которая принимает или отклоняет обновления по флагу accept"""
+
+    workers = 2
+
+    def __init__(self):
+        self.accept = True
+        self.submitted = []
+
+    def submit(self, update, timeout=None):
+        if not self.accept:
+            return False
+        self.submitted.append(update)
+        return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_stats(self):
+        return {'submitted': len(self.submitted)}
+
+
+def _update(update_id):
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': 1, 'date': 0,
+            'chat': {'id': 5, 'type': 'private', 'first_name': 'Test'},
+            'from': {'id': 5, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'hello'
+        }
+    }).encode('utf-8')
+
+
+@pytest.fixture
+def receiver():
+    return WebhookReceiver(bot=None, dispatcher=FakeDispatcher(), secret=SECRET)
+
+
+@pytest.mark.parametrize('header', [None, '', 'wrong-secret', SECRET + 'x'])
+def test_wrong_secret_is_rejected(receiver, header):
+    assert receiver.handle(header, _update(1)) == (403, 'Forbidden')
+    assert receiver.unauthorized == 1
+    assert receiver.dispatcher.submitted == []
+
+
+def test_receiver_without_secret_rejects_everything(monkeypatch):
+    monkeypatch.delenv('TELEGRAM_WEBHOOK_SECRET', raising=False)
+    receiver = WebhookReceiver(bot=None, dispatcher=FakeDispatcher())
+    assert receiver.handle('', _update(1))[0] == 403
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'not json',
+    b'\xff\xfe',
+    b'[1, 2]',
+    b'{"message": {}}',
+    b'{"update_id": "1"}',
+])
+def test_malformed_body_is_rejected(receiver, body):
+    assert receiver.handle(SECRET, body) == (400, 'Bad Request')
+    assert receiver.invalid == 1
+    assert receiver.dispatcher.submitted == []
+
+
+def test_oversized_body_is_rejected(receiver):
+    body = b' ' * (webhook_receiver.MAX_BODY_BYTES + 1)
+    assert receiver.handle(SECRET, body) == (413, 'Payload Too Large')
+
+
+def test_duplicate_update_is_accepted_once(receiver):
+    pytest.importorskip('telebot')
+    assert receiver.handle(SECRET, _update(10)) == (200, 'OK')
+    # Telegram повторяет доставку, не дождавшись ответа
+    assert receiver.handle(SECRET, _update(10)) == (200, 'Duplicate')
+    assert receiver.handle(SECRET, _update(11)) == (200, 'OK')
+    assert [update.update_id for update in receiver.dispatcher.submitted] == [10, 11]
+    assert receiver.duplicates == 1
+
+
+def test_rejected_update_can_be_redelivered(receiver):
+    pytest.importorskip('telebot')
+    receiver.dispatcher.accept = False
+    assert receiver.handle(SECRET, _update(10))[0] == 503
+    receiver.dispatcher.accept = True
+    assert receiver.handle(SECRET, _update(10)) == (200, 'OK')
+
+
+def test_forgotten_and_readded_id_is_not_evicted_early(monkeypatch, receiver):
+    monkeypatch.setattr(webhook_receiver, 'RECENT_UPDATES_LIMIT', 3)
+    for update_id in (1, 2, 3):
+        assert not receiver._is_duplicate(update_id)
+    # Обновление 1 отклонено (очередь заполнена) и доставлено повторно
+    receiver._forget(1)
+    assert not receiver._is_duplicate(1)
+    # Вытесняется самое старое из помнящихся - 2, а не повторно принятое 1
+    assert not receiver._is_duplicate(4)
+    assert receiver._is_duplicate(1)
+    assert not receiver._is_duplicate(2)
+    assert list(receiver._recent_ids) == [1, 4, 2]
+
+
+@pytest.fixture
+def http_server(monkeypatch):
+    created = []
+    monkeypatch.setenv('TELEGRAM_WEBHOOK_SECRET', SECRET)
+    monkeypatch.setattr(render_server, 'get_webhook_receiver',
+                        lambda: created.append(1) or WebhookReceiver(None, FakeDispatcher(), SECRET))
+    server = HTTPServer(('127.0.0.1', 0), render_server.BotStatusHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', created
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url, body, secret):
+    request = urllib.request.Request(url + WEBHOOK_PATH, data=body, method='POST',
+                                     headers={SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_http_handler_checks_mode_and_secret_before_creating_receiver(monkeypatch, http_server):
+    url, created = http_server
+    monkeypatch.delenv('TELEGRAM_WEBHOOK_URL', raising=False)
+    assert _post(url, _update(1), SECRET) == 404
+
+    monkeypatch.setenv('TELEGRAM_WEBHOOK_URL', 'https://example.com')
+    assert _post(url, _update(1), 'wrong-secret') == 403
+    assert created == []
+
+    assert _post(url, b'not json', SECRET) == 400
+    assert created == [1]
+
+
+def _get(url, path, headers=None):
+    request = urllib.request.Request(url + path, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def test_cache_stats_require_token(monkeypatch, http_server):
+    url, _ = http_server
+    monkeypatch.delenv('CACHE_STATS_TOKEN', raising=False)
+    assert _get(url, '/cache-stats')[0] == 404
+    assert _get(url, '/health') == (200, {'status': 'ok'})
+
+    monkeypatch.setenv('CACHE_STATS_TOKEN', 'stats-token')
+    header = render_server.CACHE_STATS_TOKEN_HEADER
+    assert _get(url, '/cache-stats')[0] == 403
+    assert _get(url, '/cache-stats', {header: 'wrong'})[0] == 403
+    status, stats = _get(url, '/cache-stats', {header: 'stats-token'})
+    assert status == 200 and isinstance(stats, dict)
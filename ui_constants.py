@@ -2,6 +2,9 @@
 Константы для улучшения пользовательского интерфейса бота
 """
 
+import datetime
+from models import OrderView
+
 # Читаемые названия статусов заказов
 STATUS_NAMES = {
     'new': 'Новый',
@@ -86,18 +89,42 @@ STATUS_DESCRIPTIONS = {
     'cancelled': 'Заказ отменен'
 }
 
-def format_order_card(order, include_cost=True, include_description=True):
+def _format_person(person):
+    """Имя пользователя с username для карточки заказа"""
+    name = f"{person.get('first_name') or ''} {person.get('last_name') or ''}".strip() or f"ID {person['user_id']}"
+    if person.get('username'):
+        name += f" (@{person['username']})"
+    return name
+
+
+def _format_datetime(value):
+    """Дата и время в формате ДД.ММ.ГГГГ ЧЧ:ММ (строки, которые не удается разобрать, выводятся как есть)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value.strftime('%d.%m.%Y %H:%M')
+
+
+def format_order_card(order, include_cost=True, include_description=True, include_phone=True):
     """
     Форматирует карточку заказа для более удобного отображения
     
     Args:
-        order: Словарь с данными заказа
+        order: Карточка заказа OrderView (с диспетчером, мастерами и временем изменения
+               статуса) или словарь с данными заказа
         include_cost: Включать ли информацию о стоимости
         include_description: Включать ли описание работ
+        include_phone: Включать ли телефон клиента (мастерам не показывается)
         
     Returns:
         Отформатированная строка с информацией о заказе
     """
+    view = order if isinstance(order, OrderView) else None
+    if view is not None:
+        order = view.order
+    
     status = order.get('status', 'new')
     status_emoji = EMOJI.get(status, '')
     
@@ -112,14 +139,25 @@ def format_order_card(order, include_cost=True, include_description=True):
     client_phone = order.get('client_phone', 'Н/Д')
     client_address = order.get('client_address', 'Н/Д')
     result += f"{EMOJI['phone']} *Клиент:* {client_name}\n"
-    result += f"{EMOJI['phone']} *Телефон:* {client_phone}\n"
+    if include_phone:
+        result += f"{EMOJI['phone']} *Телефон:* {client_phone}\n"
     result += f"{EMOJI['address']} *Адрес:* {client_address}\n"
     
-    # Дата и время
+    # Дата и время (scheduled_datetime хранится строкой)
     if order.get('scheduled_datetime'):
-        scheduled_time = order.get('scheduled_datetime').strftime('%d.%m.%Y %H:%M')
+        scheduled_time = _format_datetime(order.get('scheduled_datetime'))
         result += f"{EMOJI['date']} *Дата визита:* {scheduled_time}\n"
     
+    # Диспетчер, мастера и время изменения статуса
+    if view is not None:
+        if view.dispatcher:
+            result += f"{EMOJI['dispatcher']} *Диспетчер:* {_format_person(view.dispatcher)}\n"
+        if view.technicians:
+            technicians = ', '.join(_format_person(technician) for technician in view.technicians)
+            result += f"{EMOJI['technician']} *Мастера:* {technicians}\n"
+        if view.status_changed_at:
+            result += f"{EMOJI['time']} *Статус изменен:* {_format_datetime(view.status_changed_at)}\n"
+    
     # Проблема
     problem_descr = order.get('problem_description', 'Не указано')
     result += f"\n{EMOJI['description']} *Описание проблемы:*\n{problem_descr}\n"
@@ -137,6 +175,33 @@ def format_order_card(order, include_cost=True, include_description=True):
     return result
 
 
+def format_client_history(history):
+    """
+    Форматирует сведения о клиенте, который уже обращался, и его последние заказы.
+    Текст без разметки: имя и описание проблемы вводятся пользователями
+    
+    Args:
+        history: ClientHistory клиента
+        
+    Returns:
+        Отформатированная строка
+    """
+    client = history.client
+    result = f"{EMOJI['info']} Клиент уже обращался: {client.get('client_name') or 'Н/Д'}\n"
+    result += f"{EMOJI['orders']} Заказов: {history.orders_count}\n"
+    if client.get('client_address'):
+        result += f"{EMOJI['address']} Адрес: {client['client_address']}\n"
+    
+    if history.orders:
+        result += "\nПоследние заказы:\n"
+        for order in history.orders:
+            created = _format_datetime(order['created_at']) if order.get('created_at') else ''
+            problem = (order.get('problem_description') or '')[:50]
+            result += f"{EMOJI.get(order.get('status'), '•')} #{order['order_id']} {created} - {problem}\n"
+    
+    return result
+
+
 def get_welcome_message(user_name):
     """
     Возвращает приветственное сообщение для пользователя
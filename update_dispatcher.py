@@ -0,0 +1,264 @@
+"""
+Параллельная обработка обновлений Telegram с сохранением порядка внутри чата
+
+Обновления разных чатов обрабатываются пулом потоков одновременно, поэтому медленный
+обработчик (список для администратора, запрос к ИИ) задерживает только свой чат.
+Обновления одного чата обрабатываются строго по очереди в порядке получения.
+Число ожидающих обработки обновлений ограничено: при заполнении очереди получение
+новых обновлений приостанавливается, и они остаются на стороне Telegram.
+
+Настройки из переменных окружения:
+    BOT_WORKERS            - число потоков обработки (по умолчанию CPU * 4, но не больше 32)
+    BOT_UPDATE_QUEUE_SIZE  - максимум ожидающих обработки обновлений (по умолчанию 1000)
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('update_dispatcher')
+
+# Маркер остановки потока обработки
+_STOP = object()
+
+# Поля Update, из которых берется чат (или пользователь, если чата нет)
+_UPDATE_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer',
+    'my_chat_member', 'chat_member', 'chat_join_request'
+)
+
+
+def get_default_workers() -> int:
+    """Число потоков обработки по умолчанию"""
+    value = os.environ.get('BOT_WORKERS')
+    if value:
+        return max(1, int(value))
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def get_default_queue_size() -> int:
+    """Размер очереди обновлений по умолчанию"""
+    return max(1, int(os.environ.get('BOT_UPDATE_QUEUE_SIZE', 1000)))
+
+
+def get_update_chat_key(update) -> Hashable:
+    """
+    Возвращает ключ, определяющий порядок обработки обновления:
+    ID чата, а для обновлений без чата (inline-запросы и т.п.) - ID пользователя
+    """
+    for field in _UPDATE_FIELDS:
+        payload = getattr(update, field, None)
+        if payload is None:
+            continue
+        chat = getattr(payload, 'chat', None)
+        if chat is None:
+            message = getattr(payload, 'message', None)  # callback_query
+            chat = getattr(message, 'chat', None)
+        if chat is not None:
+            return chat.id
+        user = getattr(payload, 'from_user', None) or getattr(payload, 'user', None)
+        if user is not None:
+            return ('user', user.id)
+        break
+    # Обновления неизвестного вида обрабатываются независимо друг от друга
+    return ('update', getattr(update, 'update_id', id(update)))
+
+
+class UpdateDispatcher:
+    """
+    Пул потоков обработки обновлений с очередью на каждый чат.
+    Чат, у которого есть необработанные обновления, стоит в общей очереди готовых чатов;
+    поток берет из чата одно обновление и, если там остались еще, возвращает чат в конец
+    общей очереди, поэтому активный чат не задерживает остальные.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], workers: Optional[int] = None,
+                 max_pending: Optional[int] = None,
+                 key_func: Callable[[Any], Hashable] = get_update_chat_key):
+        self.handler = handler
+        self.workers = workers or get_default_workers()
+        self.max_pending = max_pending or get_default_queue_size()
+        self.key_func = key_func
+
+        self._chats: Dict[Hashable, Deque[Any]] = {}  # Необработанные обновления по чатам
+        self._ready: 'queue.Queue' = queue.Queue()      # Чаты, готовые к обработке
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._threads = []
+        self._running = False
+
+        # Счетчики
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.backpressure_waits = 0
+        self.total_processing_time = 0.0
+
+    def start(self) -> None:
+        """Запускает потоки обработки"""
+        if self._running:
+            return
+        self._running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'update-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Запущено потоков обработки обновлений: {self.workers}, размер очереди: {self.max_pending}")
+
+    def submit(self, update, timeout: Optional[float] = None) -> bool:
+        """
+        Ставит обновление в очередь его чата.
+        Если очередь заполнена, ждет освобождения места (не дольше timeout, если он указан).
+
+        Returns:
+            bool: True, если обновление принято, False если истекло время ожидания
+        """
+        key = self.key_func(update)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.backpressure_waits += 1
+                if not self._not_full.wait_for(lambda: self._pending < self.max_pending, timeout):
+                    self.rejected += 1
+                    logger.warning(f"Очередь обновлений заполнена, обновление {getattr(update, 'update_id', '?')} отклонено")
+                    return False
+            self._pending += 1
+            self.submitted += 1
+            chat_queue = self._chats.get(key)
+            if chat_queue is not None:
+                # Чат уже в обработке или в очереди готовых - обновление будет взято после предыдущих
+                chat_queue.append(update)
+                return True
+            self._chats[key] = deque((update,))
+        self._ready.put(key)
+        return True
+
+    def _worker(self) -> None:
+        while True:
+            key = self._ready.get()
+            if key is _STOP:
+                return
+
+            with self._lock:
+                update = self._chats[key].popleft()
+
+            started = time.perf_counter()
+            failed = False
+            try:
+                self.handler(update)
+            except Exception as e:
+                failed = True
+                logger.error(f"Ошибка при обработке обновления {getattr(update, 'update_id', '?')}: {e}")
+            elapsed = time.perf_counter() - started
+
+            with self._lock:
+                self.processed += 1
+                self.total_processing_time += elapsed
+                if failed:
+                    self.failed += 1
+                self._pending -= 1
+                has_more = bool(self._chats[key])
+                if not has_more:
+                    del self._chats[key]
+                self._not_full.notify()
+                if self._pending == 0:
+                    self._idle.notify_all()
+            if has_more:
+                self._ready.put(key)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет обработки всех принятых обновлений
+
+        Returns:
+            bool: True, если очередь опустела, False если истекло время ожидания
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stop(self, timeout: Optional[float] = 30.0) -> None:
+        """Дожидается обработки принятых обновлений и останавливает потоки"""
+        if not self._running:
+            return
+        if not self.join(timeout):
+            logger.warning(f"Не дождались обработки {self._pending} обновлений при остановке")
+        self._running = False
+        for _ in self._threads:
+            self._ready.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает размер очереди и счетчики обработки"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'active_chats': len(self._chats),
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'backpressure_waits': self.backpressure_waits,
+                'avg_processing_time': round(self.total_processing_time / self.processed, 6) if self.processed else 0.0
+            }
+
+
+def create_bot_dispatcher(bot, workers: Optional[int] = None,
+                          max_pending: Optional[int] = None) -> UpdateDispatcher:
+    """
+    Создает диспетчер, передающий обновления обработчикам бота.
+    Собственный пул потоков telebot отключается: обработчики выполняются в потоках диспетчера.
+    """
+    bot.threaded = False
+    return UpdateDispatcher(lambda update: bot.process_new_updates([update]), workers, max_pending)
+
+
+def run_polling(bot, dispatcher: Optional[UpdateDispatcher] = None, timeout: int = 60,
+                long_polling_timeout: int = 20, allowed_updates=None,
+                stop_event: Optional[threading.Event] = None) -> None:
+    """
+    Получает обновления через getUpdates и передает их диспетчеру.
+    Работает до установки stop_event или KeyboardInterrupt; ошибки сети повторяются с задержкой.
+    """
+    dispatcher = dispatcher or create_bot_dispatcher(bot)
+    dispatcher.start()
+    stop_event = stop_event or threading.Event()
+    offset = None
+    error_delay = 1
+
+    logger.info("Запуск получения обновлений через getUpdates")
+    try:
+        while not stop_event.is_set():
+            try:
+                updates = bot.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                    long_polling_timeout=long_polling_timeout
+                )
+                error_delay = 1
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновлений: {e}. Повтор через {error_delay} сек")
+                stop_event.wait(error_delay)
+                error_delay = min(error_delay * 2, 30)
+                continue
+
+            for update in updates:
+                # Подтверждаем обновление, только когда оно принято в очередь:
+                # при заполненной очереди ждем, а не теряем обновления
+                dispatcher.submit(update)
+                offset = update.update_id + 1
+    except KeyboardInterrupt:
+        logger.info("Получение обновлений остановлено")
+    finally:
+        dispatcher.stop()
@@ -3,10 +3,14 @@
 """
 
 import logging
-import re
 from typing import List, Dict, Tuple, Optional
 from config import ROLES, ORDER_STATUSES
-from database import get_user_role, get_all_users, get_technicians, get_unapproved_users
+from database import get_user_role, get_all_users, get_users_by_role, get_technicians, get_unapproved_users, get_order
+from database import PAGE_OLDER, PAGE_NEWER
+from models import Page
+import callback_codec
+from outbound_queue import enqueue_message, PRIORITY_NOTIFICATION, PRIORITY_BROADCAST
+from phone_numbers import normalize_phone
 
 def get_status_text(status_code: str) -> str:
     """
@@ -208,32 +212,32 @@ def get_order_status_keyboard(order_id: int, user_id: int = None) -> InlineKeybo
     if current_status in ['new', 'approved']:
         # Начальные статусы для новых заказов
         keyboard.add(
-            InlineKeyboardButton("✅ Принят", callback_data=f"status_{order_id}_approved"),
-            InlineKeyboardButton("👨‍🔧 Назначен", callback_data=f"status_{order_id}_assigned")
+            InlineKeyboardButton("✅ Принят", callback_data=callback_codec.encode("status", order_id=order_id, status="approved")),
+            InlineKeyboardButton("👨‍🔧 Назначен", callback_data=callback_codec.encode("status", order_id=order_id, status="assigned"))
         )
     
     if current_status in ['approved', 'assigned', 'scheduled']:
         # Статусы для назначенных и запланированных заказов
         keyboard.add(
-            InlineKeyboardButton("📅 Запланирован", callback_data=f"status_{order_id}_scheduled"),
-            InlineKeyboardButton("🔄 В работе", callback_data=f"status_{order_id}_in_progress")
+            InlineKeyboardButton("📅 Запланирован", callback_data=callback_codec.encode("status", order_id=order_id, status="scheduled")),
+            InlineKeyboardButton("🔄 В работе", callback_data=callback_codec.encode("status", order_id=order_id, status="in_progress"))
         )
     
     if current_status in ['in_progress', 'pending_parts', 'pending_client', 'testing']:
         # Статусы для заказов в процессе работы
         keyboard.add(
-            InlineKeyboardButton("⏳ Ожидание запчастей", callback_data=f"status_{order_id}_pending_parts"),
-            InlineKeyboardButton("👥 Ожидание клиента", callback_data=f"status_{order_id}_pending_client")
+            InlineKeyboardButton("⏳ Ожидание запчастей", callback_data=callback_codec.encode("status", order_id=order_id, status="pending_parts")),
+            InlineKeyboardButton("👥 Ожидание клиента", callback_data=callback_codec.encode("status", order_id=order_id, status="pending_client"))
         )
         keyboard.add(
-            InlineKeyboardButton("🧪 Тестирование", callback_data=f"status_{order_id}_testing"),
-            InlineKeyboardButton("📦 Готов к выдаче", callback_data=f"status_{order_id}_ready")
+            InlineKeyboardButton("🧪 Тестирование", callback_data=callback_codec.encode("status", order_id=order_id, status="testing")),
+            InlineKeyboardButton("📦 Готов к выдаче", callback_data=callback_codec.encode("status", order_id=order_id, status="ready"))
         )
     
     if current_status in ['ready', 'testing']:
         # Завершающие статусы
         keyboard.add(
-            InlineKeyboardButton("✅ Завершен", callback_data=f"status_{order_id}_completed")
+            InlineKeyboardButton("✅ Завершен", callback_data=callback_codec.encode("status", order_id=order_id, status="completed"))
         )
     
     # Управленческие кнопки только для админов и диспетчеров
@@ -241,15 +245,15 @@ def get_order_status_keyboard(order_id: int, user_id: int = None) -> InlineKeybo
         management_row = []
         
         if current_status not in ['cancelled', 'completed', 'rejected']:
-            management_row.append(InlineKeyboardButton("❌ Отменен", callback_data=f"status_{order_id}_cancelled"))
-            management_row.append(InlineKeyboardButton("⛔ Отклонен", callback_data=f"status_{order_id}_rejected"))
+            management_row.append(InlineKeyboardButton("❌ Отменен", callback_data=callback_codec.encode("status", order_id=order_id, status="cancelled")))
+            management_row.append(InlineKeyboardButton("⛔ Отклонен", callback_data=callback_codec.encode("status", order_id=order_id, status="rejected")))
         
         if management_row:
             keyboard.row(*management_row)
             
         # Дополнительный статус для особых случаев
         if current_status not in ['delayed', 'completed']:
-            keyboard.add(InlineKeyboardButton("⏱ Отложен", callback_data=f"status_{order_id}_delayed"))
+            keyboard.add(InlineKeyboardButton("⏱ Отложен", callback_data=callback_codec.encode("status", order_id=order_id, status="delayed")))
     
     # Кнопка "Назад"
     keyboard.add(InlineKeyboardButton("◀️ Назад к заказу", callback_data=f"order_{order_id}"))
@@ -393,11 +397,15 @@ def get_technician_list_keyboard(order_id: int) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(row_width=1)
     
     for tech in technicians:
-        name = tech.get_full_name()
+        # get_technicians возвращает словари, а не объекты User
+        name = f"{tech['first_name']} {tech.get('last_name') or ''}".strip()
         if len(name) > 20:  # Укорачиваем имя для кнопки
             name = name[:17] + "..."
             
-        keyboard.add(InlineKeyboardButton(name, callback_data=f"assign_{order_id}_{tech.user_id}"))
+        keyboard.add(InlineKeyboardButton(
+            name,
+            callback_data=callback_codec.encode("assign", order_id=order_id, technician_id=tech['user_id'])
+        ))
     
     keyboard.add(InlineKeyboardButton("◀️ Назад к заказу", callback_data=f"order_{order_id}"))
     
@@ -407,10 +415,8 @@ def send_order_notification_to_admins(bot, order_id: int) -> None:
     """
     Отправляет уведомление администраторам о новом заказе
     """
-    from database import get_order
-    
-    # Получаем всех пользователей
-    users = get_all_users()
+    # Получаем администраторов одним запросом (список кэшируется)
+    admins = get_users_by_role('admin')
     
     # Получаем информацию о заказе
     order = get_order(order_id)
@@ -426,13 +432,9 @@ def send_order_notification_to_admins(bot, order_id: int) -> None:
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton("👁️ Посмотреть заказ", callback_data=f"order_{order_id}"))
     
-    # Отправляем уведомление всем администраторам
-    for user in users:
-        if user.is_admin():
-            try:
-                bot.send_message(user.user_id, message, reply_markup=keyboard)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления администратору {user.user_id}: {e}")
+    # Рассылка всем администраторам ставится в очередь отправки, не дожидаясь Telegram
+    for admin in admins:
+        enqueue_message(bot, admin['user_id'], message, PRIORITY_BROADCAST, reply_markup=keyboard)
                 
 def send_order_status_update_notification(bot, order_id: int, old_status: str, new_status: str) -> None:
     """
@@ -444,10 +446,8 @@ def send_order_status_update_notification(bot, order_id: int, old_status: str, n
         old_status: Предыдущий статус заказа
         new_status: Новый статус заказа
     """
-    from database import get_order
-    
-    # Получаем всех пользователей
-    users = get_all_users()
+    # Получаем администраторов одним запросом (список кэшируется, упорядочен по регистрации)
+    admins = get_users_by_role('admin')
     
     # Получаем информацию о заказе
     order = get_order(order_id)
@@ -457,8 +457,6 @@ def send_order_status_update_notification(bot, order_id: int, old_status: str, n
         return
     
     # Находим главного администратора (первого зарегистрированного)
-    admins = [user for user in users if user.is_admin()]
-    
     if not admins:
         logger.warning("В системе нет администраторов для отправки уведомления об изменении статуса заказа.")
         return
@@ -472,31 +470,30 @@ def send_order_status_update_notification(bot, order_id: int, old_status: str, n
     # Формируем текст уведомления
     message = (
         f"🔄 *Изменение статуса заказа #{order_id}*\n\n"
-        f"👤 Клиент: {order.client_name}\n"
-        f"📞 Телефон: {order.client_phone}\n\n"
+        f"👤 Клиент: {order.get('client_name', '')}\n"
+        f"📞 Телефон: {order.get('client_phone', '')}\n\n"
         f"Статус изменен: *{old_status_name}* → *{new_status_name}*\n\n"
-        f"🔍 Проблема: {order.problem_description}\n"
+        f"🔍 Проблема: {order.get('problem_description', '')}\n"
     )
     
     # Создаем инлайн клавиатуру с кнопкой просмотра заказа
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton("👁️ Посмотреть заказ", callback_data=f"order_{order_id}"))
     
-    try:
-        bot.send_message(main_admin.user_id, message, parse_mode="Markdown", reply_markup=keyboard)
-        logger.info(f"Уведомление об изменении статуса заказа #{order_id} отправлено главному администратору {main_admin.user_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления об изменении статуса заказа #{order_id} главному администратору {main_admin.user_id}: {e}")
+    if enqueue_message(bot, main_admin['user_id'], message, PRIORITY_NOTIFICATION,
+                       parse_mode="Markdown", reply_markup=keyboard):
+        logger.info(f"Уведомление об изменении статуса заказа #{order_id} поставлено в очередь для главного администратора {main_admin['user_id']}")
 
 def validate_phone(phone: str) -> bool:
     """
-    Проверяет формат номера телефона
+    Проверяет формат номера телефона: номер должен приводиться к E.164 (см. normalize_phone).
+
+    Раньше проверялось только число цифр (10-15) после удаления всех остальных символов.
+    Теперь, как и при сохранении заказа, отклоняются номера с буквами ("доб. 12"),
+    с символами кроме пробелов, дефисов, точек и скобок, с "+" не в начале, а у номера
+    с префиксом 00 цифры считаются без этого префикса.
     """
-    # Удаляем все нецифровые символы из строки
-    digits_only = re.sub(r'\D', '', phone)
-    
-    # Проверяем длину (от 10 до 15 цифр)
-    return 10 <= len(digits_only) <= 15
+    return normalize_phone(phone) is not None
 
 def format_orders_list(orders: List[Dict], show_buttons: bool = True, user_role: str = 'admin') -> Tuple[str, Optional[InlineKeyboardMarkup]]:
     """
@@ -580,6 +577,73 @@ def format_orders_list(orders: List[Dict], show_buttons: bool = True, user_role:
         keyboard.add(InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
     
     return message, keyboard
+
+def get_page_navigation_row(page: Page, action: str, id_field: str) -> List[InlineKeyboardButton]:
+    """
+    Возвращает кнопки перехода к соседним страницам курсорной пагинации
+    
+    Args:
+        page: Текущая страница
+        action: Действие callback_codec с полями direction, created_us и id_field
+        id_field: Имя поля ID записи в действии
+    """
+    row = []
+    if page.newer:
+        row.append(InlineKeyboardButton("◀️ Назад", callback_data=callback_codec.encode(
+            action, direction=PAGE_NEWER, created_us=page.newer[0], **{id_field: page.newer[1]})))
+    if page.older:
+        row.append(InlineKeyboardButton("Вперед ▶️", callback_data=callback_codec.encode(
+            action, direction=PAGE_OLDER, created_us=page.older[0], **{id_field: page.older[1]})))
+    return row
+
+def format_orders_page(page: Page, user_role: str = 'admin') -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Форматирует страницу заказов: список заказов и кнопки навигации над кнопкой главного меню
+    """
+    message, keyboard = format_orders_list(page.items, user_role=user_role)
+    nav_row = get_page_navigation_row(page, 'orders_page', 'order_id')
+    if nav_row:
+        keyboard.keyboard.insert(len(keyboard.keyboard) - 1, nav_row)
+    return message, keyboard
+
+def format_search_results(orders: List[Dict], query: str, offset: int, has_more: bool,
+                          page_size: int, user_role: str = 'admin') -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Форматирует страницу результатов поиска заказов с кнопками перехода к соседним страницам
+    
+    Args:
+        orders: Заказы страницы
+        query: Нормализованный поисковый запрос
+        offset: Сколько результатов пропущено до этой страницы
+        has_more: Есть ли результаты после этой страницы
+        page_size: Размер страницы
+        user_role: Роль пользователя ('admin', 'dispatcher', 'technician')
+    """
+    if not orders:
+        message = f"🔍 Поиск: {query}\n\nЗаказы не найдены."
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
+        return message, keyboard
+    
+    message, keyboard = format_orders_list(orders, user_role=user_role)
+    message = message.replace("📋 Список заказов", f"🔍 Поиск: {query}", 1)
+    
+    row = []
+    try:
+        if offset > 0:
+            row.append(InlineKeyboardButton("◀️ Назад", callback_data=callback_codec.encode(
+                'search_page', offset=max(offset - page_size, 0), query=query)))
+        if has_more:
+            row.append(InlineKeyboardButton("Вперед ▶️", callback_data=callback_codec.encode(
+                'search_page', offset=offset + page_size, query=query)))
+    except callback_codec.CallbackDataError:
+        # Запрос не помещается в callback_data - показываем только первую страницу
+        row = []
+        if has_more:
+            message += "\nПоказаны первые результаты. Уточните запрос, чтобы найти нужный заказ."
+    if row:
+        keyboard.keyboard.insert(len(keyboard.keyboard) - 1, row)
+    return message, keyboard
     
 def get_user_list_for_deletion() -> Tuple[str, InlineKeyboardMarkup]:
     """
@@ -0,0 +1,256 @@
+"""
+Получение обновлений Telegram через webhook
+
+Telegram отправляет каждое обновление POST-запросом на адрес webhook. Запрос проверяется
+по секретному токену из заголовка X-Telegram-Bot-Api-Secret-Token, обновление ставится
+в ограниченную очередь UpdateDispatcher и обрабатывается теми же обработчиками бота,
+что и при polling. Если очередь заполнена, возвращается 503 и Telegram повторит доставку позже.
+
+Настройки из переменных окружения:
+    TELEGRAM_WEBHOOK_URL     - внешний адрес сервиса (https://...); если задан, бот работает через webhook
+    TELEGRAM_WEBHOOK_SECRET  - секретный токен (1-256 символов A-Z, a-z, 0-9, _ и -)
+    TELEGRAM_WEBHOOK_PATH    - путь обработчика (по умолчанию /telegram/webhook)
+
+Для локальной проверки без Telegram используется send_test_update(), отправляющий
+обновление на обработчик так же, как это делает Telegram.
+"""
+
+import os
+import hmac
+import json
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from logger import get_component_logger
+
+# Настройка логирования
+logger = get_component_logger('webhook_receiver')
+
+WEBHOOK_PATH = os.environ.get('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Ограничение размера тела запроса (обновления Telegram значительно меньше)
+MAX_BODY_BYTES = 1024 * 1024
+# Сколько последних update_id помнить для отбрасывания повторных доставок
+RECENT_UPDATES_LIMIT = 1000
+
+
+def get_webhook_url() -> Optional[str]:
+    """Возвращает внешний адрес сервиса для webhook или None, если webhook не используется"""
+    url = os.environ.get('TELEGRAM_WEBHOOK_URL')
+    return url.rstrip('/') if url else None
+
+
+def is_webhook_mode() -> bool:
+    """Проверяет, должен ли бот получать обновления через webhook"""
+    return get_webhook_url() is not None
+
+
+def verify_secret_token(secret_header: Optional[str], secret: Optional[str] = None) -> bool:
+    """
+    Сравнивает секретный токен из заголовка с ожидаемым (по умолчанию TELEGRAM_WEBHOOK_SECRET)
+    за постоянное время. HTTP-обработчики проверяют токен до создания приемника, чтобы
+    запрос без токена не запускал потоки обработки
+    """
+    secret = secret if secret is not None else os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+    if not secret or secret_header is None:
+        return False
+    return hmac.compare_digest(secret_header.encode('utf-8'), secret.encode('utf-8'))
+
+
+class WebhookReceiver:
+    """Проверка запросов webhook и передача обновлений в UpdateDispatcher"""
+
+    def __init__(self, bot, dispatcher, secret: Optional[str] = None, queue_timeout: float = 0.0):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.secret = secret if secret is not None else os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+        self.queue_timeout = queue_timeout
+        self._recent_ids: 'OrderedDict[int, None]' = OrderedDict()  # update_id в порядке получения
+        self._lock = threading.Lock()
+
+        # Счетчики
+        self.accepted = 0
+        self.duplicates = 0
+        self.unauthorized = 0
+        self.invalid = 0
+        self.overloaded = 0
+
+        if not self.secret:
+            logger.warning("TELEGRAM_WEBHOOK_SECRET не задан: запросы webhook будут отклоняться")
+
+    def start(self) -> None:
+        """Запускает потоки обработки обновлений"""
+        self.dispatcher.start()
+
+    def stop(self) -> None:
+        """Дожидается обработки принятых обновлений и останавливает потоки"""
+        self.dispatcher.stop()
+
+    def verify(self, secret_header: Optional[str]) -> bool:
+        """Сравнивает секретный токен из заголовка с ожидаемым за постоянное время"""
+        return verify_secret_token(secret_header, self.secret or '')
+
+    def _is_duplicate(self, update_id: Optional[int]) -> bool:
+        """Отмечает update_id и сообщает, приходило ли обновление раньше"""
+        if update_id is None:
+            return False
+        with self._lock:
+            if update_id in self._recent_ids:
+                return True
+            self._recent_ids[update_id] = None
+            if len(self._recent_ids) > RECENT_UPDATES_LIMIT:
+                self._recent_ids.popitem(last=False)
+        return False
+
+    def _forget(self, update_id: Optional[int]) -> None:
+        """Убирает update_id из недавних, чтобы повторная доставка была принята"""
+        with self._lock:
+            self._recent_ids.pop(update_id, None)
+
+    def handle(self, secret_header: Optional[str], body: bytes) -> Tuple[int, str]:
+        """
+        Обрабатывает запрос webhook
+
+        Args:
+            secret_header: Значение заголовка X-Telegram-Bot-Api-Secret-Token
+            body: Тело запроса (JSON обновления)
+
+        Returns:
+            (HTTP код ответа, описание)
+        """
+        if not self.verify(secret_header):
+            self.unauthorized += 1
+            logger.warning("Запрос webhook с неверным секретным токеном отклонен")
+            return 403, 'Forbidden'
+
+        if len(body) > MAX_BODY_BYTES:
+            self.invalid += 1
+            return 413, 'Payload Too Large'
+
+        try:
+            data = json.loads(body.decode('utf-8'))
+            if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+                raise ValueError("нет update_id")
+            import telebot
+            update = telebot.types.Update.de_json(data)
+        except Exception as e:
+            self.invalid += 1
+            logger.warning(f"Некорректное обновление в запросе webhook: {e}")
+            return 400, 'Bad Request'
+
+        update_id = getattr(update, 'update_id', None)
+        if self._is_duplicate(update_id):
+            # Telegram повторяет доставку, если не дождался ответа - обновление уже в очереди
+            self.duplicates += 1
+            return 200, 'Duplicate'
+
+        if not self.dispatcher.submit(update, timeout=self.queue_timeout):
+            self._forget(update_id)
+            self.overloaded += 1
+            return 503, 'Update queue is full'
+
+        self.accepted += 1
+        return 200, 'OK'
+
+    def set_webhook(self, base_url: Optional[str] = None, drop_pending_updates: bool = False) -> bool:
+        """Регистрирует webhook в Telegram"""
+        base_url = base_url or get_webhook_url()
+        if not base_url:
+            logger.error("Не задан TELEGRAM_WEBHOOK_URL, webhook не зарегистрирован")
+            return False
+        url = base_url + WEBHOOK_PATH
+        result = self.bot.set_webhook(
+            url=url,
+            secret_token=self.secret,
+            max_connections=self.dispatcher.workers,
+            drop_pending_updates=drop_pending_updates
+        )
+        logger.info(f"Webhook зарегистрирован: {url}")
+        return bool(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики запросов webhook и состояние очереди"""
+        return {
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'unauthorized': self.unauthorized,
+            'invalid': self.invalid,
+            'overloaded': self.overloaded,
+            'dispatcher': self.dispatcher.get_stats()
+        }
+
+
+_receiver: Optional[WebhookReceiver] = None
+_receiver_lock = threading.Lock()
+
+
+def get_webhook_receiver() -> WebhookReceiver:
+    """
+    Возвращает приемник webhook, создавая его при первом обращении.
+    Обработчики команд регистрируются импортом working_bot - тем же модулем, что и при polling.
+    """
+    global _receiver
+    if _receiver is None:
+        with _receiver_lock:
+            if _receiver is None:
+                from working_bot import bot
+                from update_dispatcher import create_bot_dispatcher
+                receiver = WebhookReceiver(bot, create_bot_dispatcher(bot))
+                receiver.start()
+                _receiver = receiver
+    return _receiver
+
+
+def build_test_message_update(chat_id: int, text: str, update_id: int = 1,
+                              message_id: int = 1, first_name: str = 'Test') -> Dict[str, Any]:
+    """Формирует обновление с текстовым сообщением в формате Telegram для локальной проверки"""
+    import time
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+            'text': text,
+            'entities': [{'offset': 0, 'length': len(text.split()[0]), 'type': 'bot_command'}]
+            if text.startswith('/') else []
+        }
+    }
+
+
+def send_test_update(base_url: str, update: Dict[str, Any], secret: Optional[str] = None,
+                     timeout: float = 10.0) -> Tuple[int, str]:
+    """
+    Отправляет обновление на обработчик webhook так же, как это делает Telegram
+
+    Returns:
+        (HTTP код ответа, тело ответа)
+    """
+    secret = secret if secret is not None else os.environ.get('TELEGRAM_WEBHOOK_SECRET', '')
+    request = urllib.request.Request(
+        base_url.rstrip('/') + WEBHOOK_PATH,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+
+if __name__ == '__main__':
+    # Локальная отправка тестового обновления:
+    # python webhook_receiver.py http://localhost:5001 123456789 "/start"
+    import sys
+    if len(sys.argv) < 4:
+        print("Использование: python webhook_receiver.py <адрес сервиса> <chat_id> <текст>")
+        sys.exit(1)
+    status, response_body = send_test_update(
+        sys.argv[1], build_test_message_update(int(sys.argv[2]), sys.argv[3])
+    )
+    print(status, response_body)
@@ -31,11 +31,10 @@ try:
     from config import ROLES, ORDER_STATUSES
     from ui_constants import EMOJI, STATUS_NAMES  # Добавляем STATUS_NAMES
     from database import (
-        save_user, get_all_users, get_user_role, is_user_approved,
+        save_user, get_all_users, get_users_by_role, get_user_role, is_user_approved,
         get_unapproved_users, approve_user, reject_user, update_user_role,
         save_order, update_order, get_orders_by_user, get_all_orders,
         get_assigned_orders, assign_order, get_technicians, get_order_technicians,
-        set_user_state, get_user_state, get_current_order_id, clear_user_state,
         save_problem_template, update_problem_template, get_problem_template,
         get_problem_templates, delete_problem_template, delete_user, delete_order,
         add_activity_log, get_activity_logs, get_admin_activity_summary, update_order_status
@@ -50,17 +49,29 @@ try:
         send_order_notification_to_admins, validate_phone, format_orders_list, get_technician_list_keyboard,
         get_role_name, get_user_list_for_deletion, get_order_list_for_deletion
     )
-    from shared_state import bot
+    # Состояния диалога - через хранилище shared_state, а не напрямую в таблицу user_states
+    from shared_state import bot, set_user_state, get_user_state, get_current_order_id, clear_user_state
     from telebot import types
     from ai_commands import (
-        register_ai_commands, handle_cancel_command
+        register_ai_commands, handle_cancel_command, register_ai_callback_routes
     )
+    from callback_router import CallbackRouter, CallbackContext
+    from update_dispatcher import run_polling
+    from cache import init_cache_backend
+    from cache_backends import CacheConfigurationError
     
     logger.info("Все модули успешно импортированы")
 except ImportError as e:
     logger.error(f"Ошибка при импорте модулей: {e}")
     sys.exit(1)
 
+# Общее хранилище кэша создается до приема обновлений: ошибка его настройки останавливает запуск
+try:
+    init_cache_backend()
+except CacheConfigurationError as e:
+    logger.error(f"Ошибка настройки общего кэша: {e}")
+    sys.exit(1)
+
 # Определение вспомогательных функций
 def get_status_name(status_code):
     """
@@ -217,7 +228,7 @@ def handle_start_command(message):
         )
 
         # Отправляем уведомление администраторам о новом пользователе
-        admins = [user for user in get_all_users() if user['role'] == 'admin']
+        admins = get_users_by_role('admin')
 
         if admins:
             username_info = f" (@{username})" if username else ""
@@ -355,6 +366,10 @@ def handle_info_command(message):
     # Отправляем информацию
     bot.send_message(user_id, info_text, parse_mode="Markdown")
 
+# Маршруты колбэков ИИ функций (ai_*, set_cost_*, set_description_*)
+ai_callback_router = CallbackRouter()
+register_ai_callback_routes(ai_callback_router)
+
 # Обработчик callback-запросов для кнопок
 @bot.callback_query_handler(func=lambda call: True)
 def handle_callback_query(call):
@@ -370,6 +385,9 @@ def handle_callback_query(call):
     
     logger.info(f"Получен callback: {callback_data} от пользователя {user_id}")
     
+    # Маршрут ИИ функции, если callback_data относится к ним
+    ai_route = ai_callback_router.resolve(callback_data)
+    
     try:
         # Обработка запросов подтверждения/отклонения пользователей
         if callback_data.startswith("approve_"):
@@ -518,45 +536,11 @@ def handle_callback_query(call):
                     parse_mode="Markdown"
                 )
                 
-        # Обработка AI-запросов через модуль ai_commands
-        elif callback_data.startswith("ai_"):
+        # Обработка AI-запросов через маршруты модуля ai_commands
+        elif ai_route is not None:
             bot.answer_callback_query(call.id, "ИИ-функция обрабатывается...")
             try:
-                from ai_commands import (
-                    handle_ai_analyze_problem_callback,
-                    handle_ai_suggest_cost_callback,
-                    handle_ai_generate_description_callback,
-                    handle_ai_technician_help_callback,
-                    handle_ai_order_help_callback,
-                    handle_set_cost_callback,
-                    handle_set_description_callback
-                )
-                
-                if callback_data.startswith("ai_analyze_problem"):
-                    handle_ai_analyze_problem_callback(user_id, message_id)
-                
-                elif callback_data.startswith("ai_suggest_cost"):
-                    handle_ai_suggest_cost_callback(user_id, message_id)
-                
-                elif callback_data.startswith("ai_generate_description"):
-                    handle_ai_generate_description_callback(user_id, message_id)
-                
-                elif callback_data.startswith("ai_technician_help"):
-                    handle_ai_technician_help_callback(user_id, message_id)
-                
-                elif callback_data.startswith("ai_order_help_"):
-                    order_id = int(callback_data.split("_")[-1])
-                    handle_ai_order_help_callback(user_id, message_id, order_id)
-                
-                elif callback_data.startswith("set_cost_"):
-                    parts = callback_data.split("_")
-                    order_id = int(parts[2])
-                    cost = float(parts[3])
-                    handle_set_cost_callback(user_id, message_id, order_id, cost)
-                
-                elif callback_data.startswith("set_description_"):
-                    order_id = int(callback_data.split("_")[-1])
-                    handle_set_description_callback(user_id, message_id, order_id)
+                ai_callback_router.call_route(CallbackContext(call), *ai_route)
             except Exception as e:
                 logger.error(f"Ошибка при обработке AI-запроса: {e}")
                 bot.send_message(user_id, "⚠️ Ошибка при обработке ИИ-запроса. Попробуйте позже.")
@@ -951,7 +935,7 @@ def handle_callback_query(call):
                 reply_markup=types.ForceReply(selective=True)
             )
             # Устанавливаем состояние пользователя в базе данных
-            from database import set_user_state
+            from shared_state import set_user_state
             set_user_state(user_id, "creating_order_client_phone")
             
         elif callback_data == "help":
@@ -1063,7 +1047,7 @@ def handle_callback_query(call):
                 parse_mode="Markdown"
             )
             # Устанавливаем состояние пользователя
-            from database import set_user_state
+            from shared_state import set_user_state
             set_user_state(user_id, "adding_admin")
         
         elif callback_data == "add_dispatcher":
@@ -1077,7 +1061,7 @@ def handle_callback_query(call):
                 parse_mode="Markdown"
             )
             # Устанавливаем состояние пользователя
-            from database import set_user_state
+            from shared_state import set_user_state
             set_user_state(user_id, "adding_dispatcher")
         
         elif callback_data == "add_technician":
@@ -1091,7 +1075,7 @@ def handle_callback_query(call):
                 parse_mode="Markdown"
             )
             # Устанавливаем состояние пользователя
-            from database import set_user_state
+            from shared_state import set_user_state
             set_user_state(user_id, "adding_technician")
         
         elif callback_data == "delete_user_menu":
@@ -1473,7 +1457,7 @@ def handle_text_message(message):
     text = message.text
     
     # Получаем текущее состояние пользователя
-    from database import get_user_state
+    from shared_state import get_user_state
     user_state = get_user_state(user_id)
     
     logger.info(f"Получено текстовое сообщение от пользователя {user_id}, состояние: {user_state}")
@@ -1530,7 +1514,7 @@ def handle_text_message(message):
                 )
             
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
         except ValueError:
             bot.send_message(
@@ -1546,7 +1530,7 @@ def handle_text_message(message):
                 parse_mode="Markdown"
             )
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
     
     elif user_state == "adding_dispatcher":
@@ -1601,7 +1585,7 @@ def handle_text_message(message):
                 )
             
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
         except ValueError:
             bot.send_message(
@@ -1617,7 +1601,7 @@ def handle_text_message(message):
                 parse_mode="Markdown"
             )
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
     
     elif user_state == "adding_technician":
@@ -1672,7 +1656,7 @@ def handle_text_message(message):
                 )
             
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
         except ValueError:
             bot.send_message(
@@ -1688,13 +1672,13 @@ def handle_text_message(message):
                 parse_mode="Markdown"
             )
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
     
     elif user_state == "creating_order_client_name":
         # Обработка создания заказа - шаг 2: имя клиента
         # Сохраняем имя клиента и запрашиваем описание проблемы
-        from database import set_user_state
+        from shared_state import set_user_state
         set_user_state(user_id, "creating_order_problem", None)
         
         # Сохраняем имя клиента в параметрах
@@ -1714,7 +1698,7 @@ def handle_text_message(message):
             log_file.write(f"\n[{datetime.datetime.now()}] Получен номер телефона: {text}\n")
         
         # Сохраняем телефон клиента и запрашиваем имя клиента
-        from database import set_user_state
+        from shared_state import set_user_state
         set_user_state(user_id, "creating_order_client_name", None)
         
         bot.send_message(
@@ -1728,7 +1712,7 @@ def handle_text_message(message):
     elif user_state == "creating_order_client_address":
         # Обработка создания заказа - шаг 4: адрес клиента
         # Сохраняем адрес клиента и запрашиваем время
-        from database import set_user_state
+        from shared_state import set_user_state
         set_user_state(user_id, "creating_order_time", None)
         
         bot.send_message(
@@ -1742,7 +1726,7 @@ def handle_text_message(message):
     elif user_state == "creating_order_problem":
         # Обработка создания заказа - шаг 3: описание проблемы
         # Сохраняем описание проблемы и запрашиваем адрес
-        from database import set_user_state
+        from shared_state import set_user_state
         set_user_state(user_id, "creating_order_client_address", None)
         
         bot.send_message(
@@ -1837,7 +1821,7 @@ def handle_text_message(message):
                 )
             
             # Очищаем состояние
-            from database import clear_user_state
+            from shared_state import clear_user_state
             clear_user_state(user_id)
         except Exception as e:
             logger.error(f"Ошибка при обработке времени заказа: {e}")
@@ -1895,7 +1879,8 @@ def start_bot_polling():
     """
     try:
         logger.info("Запуск бота в режиме polling...")
-        bot.polling(none_stop=True, interval=1, timeout=60)
+        # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+        run_polling(bot, timeout=60)
         return True
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")